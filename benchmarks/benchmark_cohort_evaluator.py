@@ -0,0 +1,112 @@
+"""
+compare PatientTimelineEvaluator.evaluate (one timeline at a time) with the vectorized CohortTimelineEvaluator
+
+the object engine is run on a synthetic cohort of PatientTimelines and both engines' decision points are checked
+to be identical, then the cohort engine alone is timed on a large synthetic cohort built directly as arrays
+
+run from the root directory:
+> python -m benchmarks.benchmark_cohort_evaluator --check-patients 2000 --patients 100000
+"""
+import argparse
+import datetime as dt
+import time
+
+import numpy as np
+
+from classes.collection.eventday import EventDay
+from classes.collection.patienttimeline import PatientTimeline
+from classes.evaluator.cohortevaluator import CohortArrays, CohortTimelineEvaluator
+from classes.evaluator.patienttimelineevaluator import PatientTimelineEvaluator
+from classes.event.relapseencounter import RelapseEncounter
+from classes.event.treatmentencounter import TreatmentEncounter
+from classes.event.vitalsencounter import VitalsEncounter
+
+TREATMENTS = ['induction_chemo', 'consolidation_chemo', 'hydroxyurea', 'targeted', 'cytokine', 'hct']
+INDICATIONS = [TreatmentEncounter.INDICATION_INDUCTION, TreatmentEncounter.INDICATION_MRD_TREATMENT,
+               TreatmentEncounter.INDICATION_CONSOLIDATION_CR, TreatmentEncounter.INDICATION_MAINTENANCE_CR, None]
+
+
+def make_timelines(n_patients, days_per_patient=12, seed=12345):
+    """
+    a synthetic cohort of PatientTimelines with treatments, relapses and deaths a few days to months apart
+    """
+    rng = np.random.RandomState(seed)
+    timelines = dict()
+    for pid in range(n_patients):
+        offsets = np.cumsum(rng.choice([1, 2, 3, 5, 30, 120], rng.randint(1, days_per_patient + 1)))
+        days = []
+        for offset in offsets:
+            date = dt.datetime(2015, 1, 1) + dt.timedelta(days=int(offset))
+            ed = EventDay(pid, date)
+            if rng.rand() < 0.6:
+                given = {t: 1 for t in TREATMENTS if rng.rand() < 0.3}
+                ed.add_event(TreatmentEncounter(pid, date, date, int(offset), 0,
+                                                rx_indication=INDICATIONS[rng.randint(len(INDICATIONS))], **given))
+            if rng.rand() < 0.2:
+                ed.add_event(RelapseEncounter(pid, date, int(offset), 0, relapse_or_response=rng.choice([1, 2]),
+                                              relapse_presentation=rng.choice([1, 2, 3])))
+            if rng.rand() < 0.03:
+                ed.add_event(VitalsEncounter(pid, date, int(offset), 0, death_status=1))
+            days.append(ed)
+        timelines[pid] = PatientTimeline(pid, days)
+    return timelines
+
+
+def make_cohort_arrays(n_patients, days_per_patient=12, n_treatments=14, seed=12345):
+    """
+    a synthetic CohortArrays built directly, without EventDay objects
+    """
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, days_per_patient + 1, n_patients)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    n = offsets[-1]
+    gaps = rng.choice([1, 2, 3, 5, 30, 120], n)
+    # restart each patient's dates from the first of january 2015
+    day_numbers = np.cumsum(gaps) - np.repeat(np.cumsum(gaps)[offsets[:-1]] - gaps[offsets[:-1]], lengths)
+    dates = (np.datetime64('2015-01-01', 'ns') + day_numbers.astype('timedelta64[D]')).astype(np.int64)
+
+    treated = rng.rand(n) < 0.6
+    treatments = np.where(treated, rng.randint(0, 2 ** n_treatments, n), 0).astype(np.uint64)
+    indications = np.where(treated, rng.choice([1, 2, 4, 8, 0], n), 0).astype(np.uint8)
+    relapse = rng.rand(n) < 0.2
+    presentation = rng.choice([1, 2, 3], n)
+    flags = (CohortArrays.FLAG_DECISION_POINT * (treated & (treatments != 0)) |
+             CohortArrays.FLAG_DEATH * (rng.rand(n) < 0.03) |
+             CohortArrays.FLAG_MORPH_RELAPSE * (relapse & (presentation < 3)) |
+             CohortArrays.FLAG_MRD_RELAPSE * (relapse & (presentation == 3)) |
+             CohortArrays.FLAG_RELAPSE * relapse).astype(np.uint8)
+    return CohortArrays(range(n_patients), offsets, dates, flags, indications, treatments,
+                        ['treatment_{}'.format(i) for i in range(n_treatments)])
+
+
+def decision_point_summary(decision_points):
+    return {pid: [(dp.eval_date, [ed.date for ed in dp.eventdays], dp.label, dp.label_cause, dp.target_date)
+                  for dp in dps] for pid, dps in decision_points.items()}
+
+
+if __name__ == '__main__':
+    import logging
+    logging.disable(logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check-patients', type=int, default=2000)
+    parser.add_argument('--patients', type=int, default=100000)
+    args = parser.parse_args()
+
+    timelines = make_timelines(args.check_patients)
+    evaluator = PatientTimelineEvaluator()
+    start = time.perf_counter()
+    expected = {pid: evaluator.evaluate(timeline) for pid, timeline in timelines.items()}
+    timeline_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = CohortTimelineEvaluator().evaluate_timelines(timelines)
+    cohort_time = time.perf_counter() - start
+    print("timeline engine: {t:.2f}s for {n} patients".format(t=timeline_time, n=len(timelines)))
+    print("cohort engine (including flattening the timelines): {t:.2f}s".format(t=cohort_time))
+    print("identical decision points: {}".format(decision_point_summary(expected) == decision_point_summary(actual)))
+
+    cohort = make_cohort_arrays(args.patients)
+    start = time.perf_counter()
+    decision_points = CohortTimelineEvaluator().evaluate(cohort)
+    print("cohort engine: {t:.2f}s for {p} patients, {d} days, {n} decision points".format(
+        t=time.perf_counter() - start, p=args.patients, d=len(cohort), n=len(decision_points)))
@@ -0,0 +1,64 @@
+"""
+compare per-row (iterrows + make_encounters) and batch (make_encounters_from_df) encounter construction
+on a synthetic treatment_event form
+
+run from the root directory:
+> python -m benchmarks.benchmark_encounter_factory --rows 20000
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from classes.event.treatmentencounter import TreatmentEncounterFactory
+
+
+def make_treatment_form(n_rows, n_extra_cols=100, seed=12345):
+    rng = np.random.RandomState(seed)
+    dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.randint(0, 2000, n_rows), unit='D')
+    df = pd.DataFrame({'redcap_repeat_instrument': 'treatment_event',
+                       'date_treatment': dates.strftime('%Y-%m-%d'),
+                       'w_target_stop': np.nan,
+                       'days_hct1_to_tx': rng.randint(0, 600, n_rows),
+                       'days_index_relapse_to_tx': rng.randint(-50, 100, n_rows),
+                       'rx_indication': rng.choice([1, 2, 3, 4, 9], n_rows)},
+                      index=pd.Index(rng.randint(1, n_rows // 10 + 2, n_rows), name='subject_id'))
+    treatments = pd.DataFrame({'e_treatment___{}'.format(i): rng.randint(0, 2, n_rows) for i in range(1, 15)},
+                              index=df.index)
+    extras = pd.DataFrame({'extra_{}'.format(i): np.where(rng.rand(n_rows) < 0.9, np.nan, rng.rand(n_rows))
+                           for i in range(n_extra_cols)}, index=df.index)
+    return pd.concat([df, treatments, extras], axis=1)
+
+
+def per_row(factory, df):
+    return list(itertools.chain(*[factory.make_encounters(index, row) for index, row in df.iterrows()]))
+
+
+def batch(factory, df):
+    return factory.make_encounters_from_df(df)
+
+
+if __name__ == '__main__':
+    import logging
+    logging.disable(logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    df = make_treatment_form(args.rows)
+    factory = TreatmentEncounterFactory()
+    timings = dict()
+    results = dict()
+    for name, fn in [('per_row', per_row), ('batch', batch)]:
+        start = time.perf_counter()
+        results[name] = fn(factory, df)
+        timings[name] = time.perf_counter() - start
+        print("{n}: {t:.2f}s for {r} rows".format(n=name, t=timings[name], r=len(df)))
+
+    identical = all(a.date == b.date and a.patientid == b.patientid and a.treatment_dict == b.treatment_dict and
+                    a.features.keys() == b.features.keys() for a, b in zip(results['per_row'], results['batch']))
+    print("identical encounters: {}".format(identical and len(results['per_row']) == len(results['batch'])))
+    print("speedup: {:.1f}x".format(timings['per_row'] / timings['batch']))
@@ -0,0 +1,77 @@
+"""
+compare loading RETAIN training rows from a pickled dataframe with memory-mapping the ragged array format
+
+run from the root directory:
+> python -m benchmarks.benchmark_ragged_training_data --rows 100000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.ragged_training_data import RaggedTrainingData
+
+
+def make_training_rows(n_rows, max_visits=40, n_numerics=200, max_codes=12, seed=12345):
+    """
+    synthetic training rows shaped like TrainingRowEvaluator output, with mostly missing numerics
+    """
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(n_rows):
+        n_visits = rng.randint(1, max_visits + 1)
+        numerics = np.where(rng.rand(n_visits, n_numerics) < 0.95, np.nan, rng.rand(n_visits, n_numerics)).tolist()
+        rows.append({'PID': i // 3,
+                     'numerics': [[None if v != v else v for v in visit] for visit in numerics],
+                     'codes': [rng.randint(0, 1000, rng.randint(0, max_codes)).tolist() for _ in range(n_visits)],
+                     'to_event': np.cumsum(rng.randint(1, 30, n_visits)).tolist(),
+                     'target': int(rng.rand() < 0.3)})
+    return rows
+
+
+LOADERS = {
+    'pickle': ("import pandas as pd",
+               "df = pd.read_pickle(path); n = sum(len(r) for r in df['to_event'])"),
+    'ragged': ("from scripts.ragged_training_data import RaggedTrainingData",
+               "data = RaggedTrainingData.load(path); n = sum(len(data.row(i)['to_event']) for i in range(len(data)))"),
+}
+
+
+def time_load(loader, path):
+    """
+    load in a fresh interpreter so the peak RSS (VmHWM) belongs to the load alone
+    """
+    setup, load = loader
+    code = "import sys, time; {s}; path = sys.argv[1]; start = time.perf_counter(); {l}; " \
+           "print(time.perf_counter() - start, [line.split()[1] for line in open('/proc/self/status') " \
+           "if line.startswith('VmHWM')][0])".format(s=setup, l=load)
+    out = subprocess.check_output([sys.executable, '-c', code, path], cwd=os.getcwd())
+    seconds, max_rss = out.split()
+    return float(seconds), int(max_rss) / 1024
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    rows = make_training_rows(args.rows)
+    out_dir = tempfile.mkdtemp()
+    pickle_path = os.path.join(out_dir, 'training_df.pkl')
+    ragged_path = os.path.join(out_dir, 'training_df')
+
+    start = time.perf_counter()
+    pd.DataFrame(rows).to_pickle(pickle_path)
+    print("pickle write: {t:.2f}s".format(t=time.perf_counter() - start))
+    start = time.perf_counter()
+    RaggedTrainingData.from_rows(rows).write(ragged_path)
+    print("ragged write: {t:.2f}s".format(t=time.perf_counter() - start))
+    print("identical rows: {}".format(RaggedTrainingData.load(ragged_path).to_rows() == rows))
+
+    for name, path in [('pickle', pickle_path), ('ragged', ragged_path)]:
+        seconds, max_rss = time_load(LOADERS[name], path)
+        print("{n} load: {t:.2f}s, peak RSS {m:.0f}MB".format(n=name, t=seconds, m=max_rss))
@@ -1,4 +1,3 @@
-import itertools
 import logging
 
 from classes.event import gvhdencounter, relapseencounter, treatmentencounter, \
@@ -32,19 +31,25 @@ REPEAT_FORMS = {'treatment_event',
                 }
 
 
+def instrument_fields(instrument_name):
+    """
+    return the set of form columns the instrument's encounter factory reads, empty for unmapped instruments
+    >>> sorted(instrument_fields('patient_id'))
+    ['hct1_date_manual', 'relapse_date_manual', 'uwid']
+    """
+    factory = INSTRUMENT_TO_FACTORY_MAP.get(instrument_name)
+    return set(factory.FIELDS) if factory is not None else set()
+
+
 def map_instrument_df_to_class(instrument_name, instrument_df):
-    # pass off single dataframe rows as Series to appropriate instrument factory
-    # get back dictionary of event features, return list of event dictionaries
+    # pass off the whole dataframe to the appropriate instrument factory
+    # get back the list of encounters built from its rows
     if instrument_name in INSTRUMENT_TO_FACTORY_MAP.keys():
-        event_list = []
         df = instrument_df
         enc_fact = INSTRUMENT_TO_FACTORY_MAP[instrument_name]()
         if instrument_name in REPEAT_FORMS:
             df = instrument_df.loc[instrument_df['redcap_repeat_instrument'].notnull()]
-        for index, df_row in df.iterrows():
-            event_list.append(enc_fact.make_encounters(index, df_row))
-        event_list = list(itertools.chain(*[e for e in event_list]))
-        return event_list
+        return enc_fact.make_encounters_from_df(df)
     else:
         warning_str = "no valid instrument types passed to mapper: {}".format(instrument_name)
         logger.warning(warning_str)
@@ -6,6 +6,7 @@ class EventDay():
         self.date = date
         self.patientid = patientid
         self.events = []
+        self._clear_cache()
         for event in events:
             self.add_event(event)
 
@@ -52,6 +53,15 @@ class EventDay():
                                                                               old_pid=self.patientid)
             raise ValueError(error_msg)
         self.events.append(event)
+        self._clear_cache()
+
+    def _clear_cache(self):
+        """
+        forget the memoized features, existant_features and treatments, they are rebuilt on next access
+        """
+        self._features = None
+        self._existant_features = None
+        self._treatments = None
 
     def is_decision_point(self):
         return any(e.is_decision_point() for e in self.events)
@@ -136,6 +146,7 @@ class EventDay():
         """
         Get the list of relevant features for the event day
 
+        memoized until the next add_event, the returned list must not be modified by callers
         :return:
         >>> from datetime import datetime
         >>> from classes.event.treatmentencounter import TreatmentEncounter
@@ -150,13 +161,16 @@ class EventDay():
         >>> ed.features
         []
         """
-        return sorted(list(itertools.chain(*[e.features for e in self.events])))
+        if self._features is None:
+            self._features = sorted(list(itertools.chain(*[e.features for e in self.events])))
+        return self._features
 
     @property
     def existant_features(self):
         """
-        Get the list of relevant features for the event day
+        Get the dictionary of features with tangible information across the event day's encounters
 
+        memoized until the next add_event, the returned dictionary must not be modified by callers
         :return:
         >>> from datetime import datetime
         >>> from classes.event.treatmentencounter import TreatmentEncounter
@@ -170,14 +184,21 @@ class EventDay():
         >>> ed.add_event(e2)
         >>> ed.existant_features
         {}
+        >>> from classes.event.encounter import Encounter
+        >>> ed.add_event(Encounter(pid, dt, 3, 2, raw_df={'wbc': 1.5}))
+        >>> ed.existant_features
+        {'wbc': 1.5}
         """
-        return {k:v for e in self.events for k,v in e.existant_features.items()}
+        if self._existant_features is None:
+            self._existant_features = {k:v for e in self.events for k,v in e.existant_features.items()}
+        return self._existant_features
 
     @property
     def treatments(self):
         """
         Get the list of relevant treatments for the event day
 
+        memoized until the next add_event, the returned list must not be modified by callers
         :return:
         >>> from datetime import datetime
         >>> from classes.event.treatmentencounter import TreatmentEncounter
@@ -193,7 +214,9 @@ class EventDay():
         >>> ed.treatments
         ['hydroxyurea']
         """
-        return sorted(list(itertools.chain(*[e.treatments for e in self.events])))
+        if self._treatments is None:
+            self._treatments = sorted(list(itertools.chain(*[e.treatments for e in self.events])))
+        return self._treatments
 
     @property
     def indications(self):
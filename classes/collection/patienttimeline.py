@@ -1,4 +1,5 @@
 import logging
+from bisect import bisect_right
 from typing import List
 from datetime import datetime
 from classes.collection.eventday import EventDay
@@ -9,11 +10,73 @@ logger.setLevel(logging.INFO)
 
 
 class PatientTimeline:
+    """
+    A patient's EventDays, kept with a date-sorted index so date queries are answered by bisection
+
+    the index is built on first query and maintained by add_event_day; replacing event_days rebuilds it
+    >>> from datetime import datetime
+    >>> days = [EventDay(1, datetime(2019, 7, d)) for d in (20, 11, 15)]
+    >>> timeline = PatientTimeline(1, days)
+    >>> [ed.date.day for ed in timeline.get_sorted_events()]
+    [11, 15, 20]
+    >>> timeline.add_event_day(EventDay(1, datetime(2019, 7, 12)))
+    >>> [ed.date.day for ed in timeline.get_events_before_date(datetime(2019, 7, 15))]
+    [11, 12, 15]
+    >>> [ed.date.day for ed in timeline.get_events_in_range(datetime(2019, 7, 11), datetime(2019, 7, 15))]
+    [12, 15]
+    >>> [ed.date.day for ed in timeline.get_events_after_date(datetime(2019, 7, 15))]
+    [20]
+    """
     def __init__(self, patientid, eventdays: List[EventDay]):
         self.patientid = patientid
         self.event_days = eventdays
         self.decision_points = list()
 
+    @property
+    def event_days(self):
+        return self._event_days
+
+    @event_days.setter
+    def event_days(self, eventdays: List[EventDay]):
+        self._event_days = eventdays
+        self._sorted_days = None
+        self._sorted_dates = None
+        self._prefix_counts = dict()
+
+    def add_event_day(self, ed: EventDay):
+        """
+        add an EventDay to the timeline, keeping the sorted date index up to date
+        EventDays on the same date keep their insertion order, as with a stable sort
+        """
+        self._event_days.append(ed)
+        if self._sorted_days is not None and len(self._sorted_days) == len(self._event_days) - 1:
+            position = bisect_right(self._sorted_dates, ed.date)
+            self._sorted_days.insert(position, ed)
+            self._sorted_dates.insert(position, ed.date)
+        self._prefix_counts = dict()
+
+    def _sorted_index(self):
+        # rebuild if event_days was modified in place rather than through add_event_day
+        if self._sorted_days is None or len(self._sorted_days) != len(self._event_days):
+            self._sorted_days = sorted(self._event_days, key=lambda x: x.date)
+            self._sorted_dates = [ed.date for ed in self._sorted_days]
+            self._prefix_counts = dict()
+        return self._sorted_days, self._sorted_dates
+
+    def _prefix_count(self, day_check):
+        """
+        return the running count of sorted event days for which the EventDay method day_check is True,
+        element i counts the days before position i, so any range of days is counted with one subtraction
+        """
+        sorted_days, _ = self._sorted_index()
+        counts = self._prefix_counts.get(day_check)
+        if counts is None:
+            counts = [0]
+            for ed in sorted_days:
+                counts.append(counts[-1] + bool(getattr(ed, day_check)()))
+            self._prefix_counts[day_check] = counts
+        return counts
+
     def add_decision_point(self, dp: DecisionPoint):
         if dp.patientid == self.patientid:
             self.decision_points.append(dp)
@@ -30,7 +93,8 @@ class PatientTimeline:
         return sum_delta
 
     def get_sorted_events(self):
-        return sorted(self.event_days, key=lambda x: x.date)
+        sorted_days, _ = self._sorted_index()
+        return list(sorted_days)
 
     def get_events_after_date(self, date: datetime):
         """
@@ -38,8 +102,8 @@ class PatientTimeline:
         :param date:
         :return: self.event_days with date > param date
         """
-        sorted_days = sorted(self.event_days, key=lambda x: x.date)
-        return  [ed for ed in sorted_days if ed.date > date]
+        sorted_days, sorted_dates = self._sorted_index()
+        return sorted_days[bisect_right(sorted_dates, date):]
 
     def get_events_before_date(self, date: datetime):
         """
@@ -47,15 +111,42 @@ class PatientTimeline:
         :param date:
         :return: self.event_days with date <= param date
         """
-        sorted_days = sorted(self.event_days, key=lambda x: x.date)
-        return  [ed for ed in sorted_days if ed.date <= date]
+        sorted_days, sorted_dates = self._sorted_index()
+        return sorted_days[:bisect_right(sorted_dates, date)]
 
     def get_events_in_range(self, beginningdate: datetime, enddate: datetime):
         """
-        return list of event days that occur on or after a given date and strictly before another date
+        return list of event days that occur after a given date and on or before another date
         :param beginningdate: a datetime date
         :param enddate: a datetime date
-        :return: self.event_days with date > param date
+        :return: self.event_days with param beginningdate < date <= param enddate
+        """
+        sorted_days, sorted_dates = self._sorted_index()
+        return sorted_days[bisect_right(sorted_dates, beginningdate):bisect_right(sorted_dates, enddate)]
+
+    def count_events_in_range(self, day_check: str, beginningdate: datetime, enddate: datetime):
+        """
+        return the number of event days after a given date and on or before another date for which an
+        EventDay check ('relapse', 'died', 'morphological_relapse', 'mrd_relapse', ...) is True
+
+        the check is evaluated once per event day and cached as a prefix count, which is reset when event days
+        are added to the timeline (but not when encounters are added to one of its EventDays)
+        :param day_check: the name of an EventDay method that takes no arguments and returns a bool
+        :param beginningdate: a datetime date
+        :param enddate: a datetime date
+        :return: int
+        >>> from datetime import datetime
+        >>> from classes.event.relapseencounter import RelapseEncounter
+        >>> days = [EventDay(1, datetime(2019, 7, d)) for d in (11, 12, 15)]
+        >>> days[1].add_event(RelapseEncounter(1, datetime(2019, 7, 12), 3, 1, relapse_or_response=1))
+        >>> timeline = PatientTimeline(1, days)
+        >>> timeline.count_events_in_range('relapse', datetime(2019, 7, 11), datetime(2019, 7, 15))
+        1
+        >>> timeline.count_events_in_range('relapse', datetime(2019, 7, 12), datetime(2019, 7, 15))
+        0
         """
-        sorted_days = sorted(self.event_days, key=lambda x: x.date)
-        return [ed for ed in sorted_days if ed.date > beginningdate and ed.date <= enddate]
+        _, sorted_dates = self._sorted_index()
+        counts = self._prefix_count(day_check)
+        begin = bisect_right(sorted_dates, beginningdate)
+        end = max(begin, bisect_right(sorted_dates, enddate))
+        return counts[end] - counts[begin]
@@ -0,0 +1,403 @@
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+from collections import Counter
+from typing import Dict, List
+
+from classes.collection.decisionpoint import DecisionPoint
+from classes.collection.patienttimeline import PatientTimeline
+from classes.event.treatmentencounter import TreatmentEncounter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+NS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+
+class CohortArrays:
+    """
+    Every patient's EventDays flattened into NumPy arrays, sorted by patient and then date
+
+    patient i owns the days in positions patient_offsets[i]:patient_offsets[i + 1]
+        dates:       int64 nanoseconds since the unix epoch
+        flags:       uint8 bitmask of FLAG_* values
+        indications: uint8 bitmask of the INDICATION_BITS recorded on the day
+        treatments:  uint64 bitmask of the treatments given on the day, bit i is treatment_names[i]
+        days:        the EventDay objects in the same order, if the arrays were built from timelines
+    """
+    FLAG_DECISION_POINT = 1
+    FLAG_DEATH = 2
+    FLAG_MORPH_RELAPSE = 4
+    FLAG_MRD_RELAPSE = 8
+    FLAG_RELAPSE = 16
+
+    INDICATION_BITS = ((TreatmentEncounter.INDICATION_INDUCTION, 1),
+                       (TreatmentEncounter.INDICATION_MRD_TREATMENT, 2),
+                       (TreatmentEncounter.INDICATION_CONSOLIDATION_CR, 4),
+                       (TreatmentEncounter.INDICATION_MAINTENANCE_CR, 8),
+                       (TreatmentEncounter.INDICATION_OTHER_INDICATION, 16))
+
+    def __init__(self, patientids, patient_offsets, dates, flags, indications, treatments, treatment_names, days=None):
+        self.patientids = list(patientids)
+        self.patient_offsets = np.asarray(patient_offsets, dtype=np.int64)
+        self.dates = np.asarray(dates, dtype=np.int64)
+        self.flags = np.asarray(flags, dtype=np.uint8)
+        self.indications = np.asarray(indications, dtype=np.uint8)
+        self.treatments = np.asarray(treatments, dtype=np.uint64)
+        self.treatment_names = list(treatment_names)
+        self.days = days
+        self._day_index = None
+
+    def __len__(self):
+        return len(self.dates)
+
+    def day_index(self):
+        """
+        return (patient_of_day, seg_end, run_end, relapse_count) for every day position, built once per cohort:
+            patient_of_day: index of the day's patient
+            seg_end:       the end of the day's patient
+            run_end:       the first later position with a later date (or the patient's end)
+            relapse_count: prefix count of relapse days, relapse_count[i] counts the days before position i
+        """
+        if self._day_index is None:
+            n = len(self)
+            lengths = np.diff(self.patient_offsets)
+            patient_of_day = np.repeat(np.arange(len(lengths)), lengths)
+            seg_end = self.patient_offsets[1:][patient_of_day]
+
+            new_run = np.ones(n + 1, dtype=bool)
+            new_run[1:n] = (patient_of_day[1:] != patient_of_day[:-1]) | (self.dates[1:] != self.dates[:-1])
+            run_bounds = np.flatnonzero(new_run)
+            run_end = run_bounds[np.cumsum(new_run[:n])]
+
+            relapse_count = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum((self.flags & self.FLAG_RELAPSE) != 0, out=relapse_count[1:])
+            self._day_index = (patient_of_day, seg_end, run_end, relapse_count)
+        return self._day_index
+
+    @classmethod
+    def from_timelines(cls, timelines: Dict[object, PatientTimeline]):
+        """
+        flatten a dict of patientid -> PatientTimeline, in the dict's order
+        every EventDay check is evaluated once here, the engine never goes back to the objects
+        """
+        patientids = []
+        offsets = [0]
+        days = []
+        for patientid, timeline in timelines.items():
+            patientids.append(patientid)
+            days.extend(timeline.get_sorted_events())
+            offsets.append(len(days))
+
+        flags = np.zeros(len(days), dtype=np.uint8)
+        indications = np.zeros(len(days), dtype=np.uint8)
+        treatments = np.zeros(len(days), dtype=np.uint64)
+        treatment_bits = dict()
+        for i, ed in enumerate(days):
+            flags[i] = (cls.FLAG_DECISION_POINT * ed.is_decision_point() |
+                        cls.FLAG_DEATH * ed.died() |
+                        cls.FLAG_MORPH_RELAPSE * ed.morphological_relapse() |
+                        cls.FLAG_MRD_RELAPSE * ed.mrd_relapse() |
+                        cls.FLAG_RELAPSE * ed.relapse())
+            day_indications = ed.indications
+            indications[i] = sum(bit for indication, bit in cls.INDICATION_BITS if indication in day_indications)
+            mask = 0
+            for treatment in ed.treatments:
+                if treatment not in treatment_bits:
+                    if len(treatment_bits) == 64:
+                        raise ValueError("CohortArrays supports at most 64 distinct treatments")
+                    treatment_bits[treatment] = len(treatment_bits)
+                mask |= 1 << treatment_bits[treatment]
+            treatments[i] = mask
+
+        dates = pd.DatetimeIndex([ed.date for ed in days]).asi8 if days else np.zeros(0, dtype=np.int64)
+        return cls(patientids, offsets, dates, flags, indications, treatments, list(treatment_bits), days=days)
+
+
+class CohortDecisionPoints:
+    """
+    The consolidated and labelled decision points of a whole cohort, as arrays with one entry per decision point
+
+        patient:     index into CohortArrays.patientids
+        members:     positions (into the CohortArrays days) of the decision point's event days,
+                     decision point i owns members[member_offsets[i]:member_offsets[i + 1]]
+        eval_pos:    position of the day the decision point is evaluated from (its last event day)
+        label:       bool label
+        cause:       index into CAUSES, -1 when no positive rule was found
+        target_pos:  position of the day the cause was found on, -1 when there is none
+    """
+    CAUSES = ("Death", "Morph", "MRD")
+    NO_CAUSE = -1
+
+    def __init__(self, cohort: CohortArrays, patient, members, member_offsets, eval_pos, label, cause, target_pos):
+        self.cohort = cohort
+        self.patient = patient
+        self.members = members
+        self.member_offsets = member_offsets
+        self.eval_pos = eval_pos
+        self.label = label
+        self.cause = cause
+        self.target_pos = target_pos
+
+    def __len__(self):
+        return len(self.eval_pos)
+
+    @classmethod
+    def positive_labels(cls, cause, dpoint_positive_labels):
+        """
+        return the bool label of every decision point from its cause index, a cause in dpoint_positive_labels is True
+        """
+        # the trailing False is indexed by NO_CAUSE
+        positive = np.array([c in dpoint_positive_labels for c in cls.CAUSES] + [False])
+        return positive[cause]
+
+    def relabel(self, dpoint_positive_labels):
+        """
+        return a copy of the decision points labelled with a different set of positive causes
+        """
+        return CohortDecisionPoints(self.cohort, self.patient, self.members, self.member_offsets, self.eval_pos,
+                                    self.positive_labels(self.cause, dpoint_positive_labels), self.cause,
+                                    self.target_pos)
+
+    def summary(self):
+        """
+        return the decision point statistics logged after a pull (see log_decision_point_summary)
+        averages are nan rather than failing when there is nothing to average over
+        """
+        total_patients = len(self.cohort.patientids)
+        total_dpts = len(self)
+        patients_with_dpts = len(np.unique(self.patient))
+        eval_dates = self.cohort.dates[self.eval_pos]
+        same_patient = self.patient[1:] == self.patient[:-1]
+        days_between = int(np.sum((np.diff(eval_dates) // NS_PER_DAY)[same_patient]))
+
+        def ratio(num, den):
+            return num / den if den else float('nan')
+
+        return {'total_patients': total_patients,
+                'total_decision_points': total_dpts,
+                'patients_with_decision_points': patients_with_dpts,
+                'avg_decision_points_per_patient': ratio(total_dpts, total_patients),
+                'avg_decision_points_per_patient_with_decision_point': ratio(total_dpts, patients_with_dpts),
+                'avg_days_between_decision_points': ratio(days_between, total_dpts),
+                'decision_point_reasons': dict(Counter(self.label_causes())),
+                'decision_point_labels': dict(Counter(bool(l) for l in self.label))}
+
+    def label_causes(self):
+        return [self.CAUSES[c] if c != self.NO_CAUSE else None for c in self.cause]
+
+    def to_frame(self):
+        """
+        return one row per decision point: PID, eval_date, label, label_cause, target_date
+        """
+        dates = self.cohort.dates
+        target_dates = pd.to_datetime(np.where(self.target_pos >= 0, dates[self.target_pos], np.iinfo(np.int64).min))
+        return pd.DataFrame({'PID': [self.cohort.patientids[p] for p in self.patient],
+                             'eval_date': pd.to_datetime(dates[self.eval_pos]),
+                             'label': self.label,
+                             'label_cause': self.label_causes(),
+                             'target_date': target_dates})
+
+    def to_decision_points(self):
+        """
+        return dict of patientid -> list of DecisionPoint over the cohort's EventDay objects,
+        as PatientTimelineEvaluator.evaluate would return them
+        """
+        days = self.cohort.days
+        if days is None:
+            raise ValueError("CohortDecisionPoints can only be converted for a cohort built from timelines")
+        decision_points = {patientid: [] for patientid in self.cohort.patientids}
+        causes = self.label_causes()
+        for i in range(len(self)):
+            patientid = self.cohort.patientids[self.patient[i]]
+            members = self.members[self.member_offsets[i]:self.member_offsets[i + 1]]
+            dpt = DecisionPoint(patientid, [days[m] for m in members])
+            dpt.label = bool(self.label[i])
+            dpt.label_cause = causes[i]
+            if self.target_pos[i] >= 0:
+                dpt.target_date = days[self.target_pos[i]].date
+            decision_points[patientid].append(dpt)
+        return decision_points
+
+
+class CohortTimelineEvaluator:
+    """
+    A vectorized equivalent of PatientTimelineEvaluator.evaluate for a whole cohort at once
+
+    Decision points, their consolidation and their labels are computed with NumPy passes over CohortArrays,
+    giving the same decision points, labels, causes and target dates as evaluating each timeline in turn
+    """
+    def __init__(self, induction_timewindow: int = 90, mrd_timewindow: int = 365,
+                 consolidation_timewindow: int = 365, dpoint_eval_window: int = 7,
+                 dpoint_positive_labels: List[str] = CohortDecisionPoints.CAUSES):
+        self.induction_timewindow = induction_timewindow
+        self.mrd_response_timewindow = mrd_timewindow
+        self.consolidation_timewindow = consolidation_timewindow
+        self.decision_point_consolidation_window = dpoint_eval_window
+        self.dpoint_positive_labels = dpoint_positive_labels
+
+    def evaluate_timelines(self, timelines: Dict[object, PatientTimeline]):
+        """
+        return dict of patientid -> list of DecisionPoint for every timeline
+        """
+        return self.evaluate(CohortArrays.from_timelines(timelines)).to_decision_points()
+
+    def evaluate(self, cohort: CohortArrays):
+        candidates = self.decision_point_candidates(cohort)
+        return self.label_decision_points(cohort, *self.consolidate_decision_pts(cohort, candidates))
+
+    def decision_point_candidates(self, cohort: CohortArrays):
+        """
+        return the positions of the days that are decision points before consolidation
+        """
+        return np.flatnonzero(cohort.flags & CohortArrays.FLAG_DECISION_POINT)
+
+    def consolidate_decision_pts(self, cohort: CohortArrays, candidates):
+        """
+        the vectorized consolidate_decision_pts: a candidate joins the preceding decision point of its patient when it
+        is within the consolidation window of the preceding candidate (the preceding decision point's eval date) and
+        no relapse happened after that candidate, up to and including the candidate's date
+        :return: (candidates, group_starts) where decision point i is candidates[group_starts[i]:group_starts[i + 1]]
+        """
+        patient_of_day, _, run_end, relapse_count = cohort.day_index()
+        window = self.decision_point_consolidation_window * NS_PER_DAY
+
+        starts_new = np.ones(len(candidates), dtype=bool)
+        if len(candidates) > 1:
+            prev, cur = candidates[:-1], candidates[1:]
+            merge = ((patient_of_day[cur] == patient_of_day[prev]) &
+                     (cohort.dates[cur] - cohort.dates[prev] <= window) &
+                     (relapse_count[run_end[cur]] == relapse_count[run_end[prev]]))
+            starts_new[1:] = ~merge
+        return candidates, np.append(np.flatnonzero(starts_new), len(candidates))
+
+    def _evaluation_windows(self, indications, has_target_days):
+        """
+        the evaluation window of each decision point from its most relevant indication, as in
+        PatientTimelineEvaluator._most_relevant_indication and INDUCTION_TO_EVALUATION_TIMEWINDOW
+        """
+        windows = np.full(len(indications), self.induction_timewindow * NS_PER_DAY, dtype=np.int64)
+        undecided = np.ones(len(indications), dtype=bool)
+        other_indication = np.zeros(len(indications), dtype=bool)
+        for bits, days in [(1, self.induction_timewindow), (2, self.mrd_response_timewindow),
+                           (4 | 8, self.consolidation_timewindow), (16, None)]:
+            selected = undecided & ((indications & bits) != 0)
+            if days is None:
+                other_indication = selected
+            else:
+                windows[selected] = days * NS_PER_DAY
+            undecided &= ~selected
+        if np.any(other_indication & has_target_days):
+            # the timeline evaluator has no window for the OTHER indication and fails comparing to it
+            raise TypeError("'<=' not supported between instances of 'datetime.timedelta' and 'NoneType'")
+        return windows
+
+    def label_decision_points(self, cohort: CohortArrays, candidates, group_starts):
+        """
+        the vectorized assign_labels: for every decision point find the first later day inside its evaluation window
+        with a death, a morphological relapse, or a treatment not in the decision point given for an induction or
+        MRD indication, and label the decision point with that cause
+        """
+        patient_of_day, seg_end, run_end, _ = cohort.day_index()
+        n = len(cohort)
+        dates = cohort.dates
+        n_dpts = len(group_starts) - 1
+
+        eval_pos = candidates[group_starts[1:] - 1]
+        if not n_dpts:
+            empty = np.zeros(0, dtype=np.int64)
+            return CohortDecisionPoints(cohort, empty, candidates, group_starts, eval_pos, np.zeros(0, dtype=bool),
+                                        empty, empty)
+        dp_treatments = np.bitwise_or.reduceat(cohort.treatments[candidates], group_starts[:-1])
+        dp_indications = np.bitwise_or.reduceat(cohort.indications[candidates], group_starts[:-1])
+        eval_dates = dates[eval_pos]
+        start = run_end[eval_pos]
+        end = seg_end[eval_pos]
+        windows = self._evaluation_windows(dp_indications, start < end)
+
+        def next_position(mask):
+            # next_position[i] is the first position >= i where mask is set, n if there is none
+            positions = np.where(mask, np.arange(n), n)
+            return np.append(np.minimum.accumulate(positions[::-1])[::-1], n)
+
+        def in_window(pos, limit, dpts=slice(None)):
+            # positions past the cohort's end are never in a window, they are clipped only to index dates
+            return (pos < limit) & (dates[np.minimum(pos, n - 1)] - eval_dates[dpts] <= windows[dpts])
+
+        death_or_morph = (cohort.flags & (CohortArrays.FLAG_DEATH | CohortArrays.FLAG_MORPH_RELAPSE)) != 0
+        dm_pos = next_position(death_or_morph)[start]
+        dm_found = in_window(dm_pos, end)
+
+        # a treatment change only counts before the first death or morphological relapse in the window
+        mrd_candidate = ((cohort.indications & 3) != 0) & (cohort.treatments != 0)
+        next_mrd = next_position(mrd_candidate)
+        limit = np.where(dm_found, dm_pos, end)
+        mrd_pos = np.full(n_dpts, -1, dtype=np.int64)
+        active = np.arange(n_dpts)
+        pos = next_mrd[start]
+        while len(active):
+            ok = in_window(pos, limit[active], active)
+            active, pos = active[ok], pos[ok]
+            changed = (cohort.treatments[pos] & ~dp_treatments[active]) != 0
+            mrd_pos[active[changed]] = pos[changed]
+            active, pos = active[~changed], next_mrd[pos[~changed] + 1]
+
+        mrd_found = mrd_pos >= 0
+        death = (cohort.flags[np.minimum(dm_pos, n - 1)] & CohortArrays.FLAG_DEATH) != 0
+        cause = np.where(mrd_found, 2, np.where(dm_found, np.where(death, 0, 1), CohortDecisionPoints.NO_CAUSE))
+        target_pos = np.where(mrd_found, mrd_pos, np.where(dm_found, dm_pos, -1))
+        label = CohortDecisionPoints.positive_labels(cause, self.dpoint_positive_labels)
+
+        return CohortDecisionPoints(cohort, patient_of_day[eval_pos], candidates, group_starts, eval_pos, label,
+                                    cause, target_pos)
+
+
+def sweep_decision_parameters(cohort: CohortArrays, grid):
+    """
+    evaluate the cohort once per DECISION_PARAMETERS setting in grid
+
+    the cohort's day index and candidate decision points are built once, consolidation is reused between settings
+    that share a DECISION_POINT_EVAL_WINDOW and labelling between settings that only differ in their
+    DECISION_POINT_REASONS
+    :param cohort: a CohortArrays
+    :param grid: a list of DECISION_PARAMETERS dicts, or a dict of DECISION_PARAMETERS key -> list of values
+                 in which case every combination of the values is evaluated
+    :return: list of (DECISION_PARAMETERS dict, CohortDecisionPoints), in grid order
+    >>> cohort = CohortArrays.from_timelines(dict())
+    >>> grid = {'INDUCTION_WINDOW': [30, 90], 'MRD_WINDOW': [365], 'CONSOLIDATION_WINDOW': [365],
+    ...         'DECISION_POINT_EVAL_WINDOW': [7], 'DECISION_POINT_REASONS': [['Death', 'Morph', 'MRD']]}
+    >>> [(params['INDUCTION_WINDOW'], len(dpts)) for params, dpts in sweep_decision_parameters(cohort, grid)]
+    [(30, 0), (90, 0)]
+    """
+    if isinstance(grid, dict):
+        keys = list(grid.keys())
+        grid = [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+    candidates = CohortTimelineEvaluator().decision_point_candidates(cohort)
+    consolidations = dict()
+    labellings = dict()
+    results = []
+    for params in grid:
+        evaluator = CohortTimelineEvaluator(induction_timewindow=params["INDUCTION_WINDOW"],
+                                            mrd_timewindow=params["MRD_WINDOW"],
+                                            consolidation_timewindow=params["CONSOLIDATION_WINDOW"],
+                                            dpoint_eval_window=params["DECISION_POINT_EVAL_WINDOW"],
+                                            dpoint_positive_labels=params["DECISION_POINT_REASONS"])
+        eval_window = params["DECISION_POINT_EVAL_WINDOW"]
+        if eval_window not in consolidations:
+            consolidations[eval_window] = evaluator.consolidate_decision_pts(cohort, candidates)
+        windows = (params["INDUCTION_WINDOW"], params["MRD_WINDOW"], params["CONSOLIDATION_WINDOW"], eval_window)
+        if windows not in labellings:
+            labellings[windows] = evaluator.label_decision_points(cohort, *consolidations[eval_window])
+        results.append((params, labellings[windows].relabel(params["DECISION_POINT_REASONS"])))
+        logger.info("evaluated decision parameters: {p}".format(p=params))
+
+    return results
+
+
+def sweep_summary(results):
+    """
+    return a dataframe with one row per swept DECISION_PARAMETERS setting and its decision point statistics
+    """
+    return pd.DataFrame([{**params, **dpts.summary()} for params, dpts in results])
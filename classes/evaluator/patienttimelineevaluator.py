@@ -1,4 +1,5 @@
 import datetime as dt
+import itertools
 import logging
 from classes.collection.patienttimeline import PatientTimeline
 from classes.collection.eventday import EventDay
@@ -88,27 +89,33 @@ class PatientTimelineEvaluator:
         -if two decision points are within the consolidation window of each other,
          treat them as one decision point
         -recursively perform this until it is no longer possible.
+        intervening relapses are counted from the timeline's prefix counts, so each pair is checked in O(log N)
         :param timeline: the supporting PatientTimeline
         :param decisionpts: a list of DecisionPoint
         :return: a list of DecisionPoint
         """
         consolidated_dpts = []
+        last_eval_date = None
         for pt in decisionpts:
+            pt_eval_date = pt.eval_date
             if not consolidated_dpts:
                 consolidated_dpts.append(pt)
+                last_eval_date = pt_eval_date
                 continue
 
             # if the current decision point and the previous decision point are within the window for consolidation
             # AND there are no intervening events
-            if (pt.eval_date - consolidated_dpts[-1].eval_date) <= self.decision_point_consolidation_window and not any(
-                    ed.relapse() for ed in timeline.get_events_in_range(consolidated_dpts[-1].eval_date, pt.eval_date)):
+            if (pt_eval_date - last_eval_date) <= self.decision_point_consolidation_window and not \
+                    timeline.count_events_in_range('relapse', last_eval_date, pt_eval_date):
                 msg = "DecisionPoint Consolidation Event: adding Decision Point {new}" \
                       " to preceeding DecisionPoint {old}".format(
                         new=pt, old=consolidated_dpts[-1])
                 logger.debug(msg)
                 consolidated_dpts[-1].add_event_day(pt.eventdays)
+                last_eval_date = max(last_eval_date, pt_eval_date)
             else:
                 consolidated_dpts.append(pt)
+                last_eval_date = pt_eval_date
 
         return consolidated_dpts
 
@@ -121,22 +128,36 @@ class PatientTimelineEvaluator:
         """
         for a patient timeline and a list of decision points corresponding to it,
          determine and assign the correct labels to each decision point
+
+        the sorted timeline is walked with a pointer to the first day after each decision point, which only
+        moves forward while decision points are in date order, and each decision point stops comparing days
+        once they fall outside its evaluation window, as no later day can be labelled by target_eval
         :param timeline: A Patient Timeline
         :param decision_points: A List of DecisionPoint's generated from timeline
         :return: decision_points, with labels assigned
         """
+        ordered_days = timeline.get_sorted_events()
+        first_after = 0
+        prev_eval_date = None
         for dpt in decision_points:
-            context = self.Context()
-            target_days = timeline.get_events_after_date(dpt.eval_date)
-            evaluation_timewindow =  self.INDUCTION_TO_EVALUATION_TIMEWINDOW[self._most_relevant_indication(dpt.indications)]
-            for target_day in target_days:
-                context.add_eventday(target_day)
-                cause = self.target_eval(dpt, target_day, evaluation_timewindow, context)
+            eval_date = dpt.eval_date
+            if prev_eval_date is not None and eval_date < prev_eval_date:
+                first_after = 0
+            while first_after < len(ordered_days) and ordered_days[first_after].date <= eval_date:
+                first_after += 1
+            prev_eval_date = eval_date
+
+            evaluation_timewindow = self.INDUCTION_TO_EVALUATION_TIMEWINDOW[self._most_relevant_indication(dpt.indications)]
+            dpt_treatments = dpt.treatments
+            for target_day in itertools.islice(ordered_days, first_after, None):
+                if not (target_day.date - eval_date) <= evaluation_timewindow:
+                    break
+                cause = self._target_cause(dpt_treatments, target_day)
                 if cause is not None:
                     logger.info(
                         "Decision Point Positive Label was found. PatientId: {pid} LabelDate: {dt} Decision Point: {dp}"
-                        "  Target Day: {ed} Context: {c}  Cause: {cause}".format(
-                            pid=timeline.patientid, dt=target_day.date, dp=dpt, ed=target_day, c=context, cause=cause))
+                        "  Target Day: {ed}  Cause: {cause}".format(
+                            pid=timeline.patientid, dt=target_day.date, dp=dpt, ed=target_day, cause=cause))
                     dpt.label_cause = cause
                     dpt.label = cause in self.dpoint_positive_labels
                     dpt.target_date = target_day.date
@@ -147,7 +168,7 @@ class PatientTimelineEvaluator:
                                                                                               dp=dpt))
                 dpt.label = False
 
-    def target_eval(self, dpt: DecisionPoint, day: EventDay, evaluation_timewindow: dt.timedelta, context: Context):
+    def target_eval(self, dpt: DecisionPoint, day: EventDay, evaluation_timewindow: dt.timedelta, context: Context = None):
         """
         Return a cause IFF occurs within the decision window:
             -the patient Died with the decision window
@@ -158,22 +179,34 @@ class PatientTimelineEvaluator:
             -the patient relapsed from MRD within decision window AND there was a change in Tx within a year
         :param dpt:
         :param day:
-        :param context:
+        :param context: only used for debug logging
         :return: String Representation of positive label reason or None
         """
         time_window = day.date - dpt.eval_date
-        logging.debug(
-            "DecisionPoint: {dp} Compared EventDay: {ed} Evaluation Time Window: {etw} Provided Context: {c}".format(
-                dp=dpt, ed=day, etw=evaluation_timewindow, c=context))
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "DecisionPoint: {dp} Compared EventDay: {ed} Evaluation Time Window: {etw} Provided Context: {c}".format(
+                    dp=dpt, ed=day, etw=evaluation_timewindow, c=context))
         if time_window <= evaluation_timewindow:
-            if day.died():
-                return "Death"
-            if day.morphological_relapse():
-                return "Morph"
-            if any(treatment not in dpt.treatments for treatment in day.treatments) and (
-                    {TreatmentEncounter.INDICATION_INDUCTION, TreatmentEncounter.INDICATION_MRD_TREATMENT} & day.indications):
-                return "MRD"
-              
+            return self._target_cause(dpt.treatments, day)
+
+        return None
+
+    def _target_cause(self, dpt_treatments, day: EventDay):
+        """
+        the target_eval rules for a day already known to be inside the evaluation window
+        :param dpt_treatments: the set of treatments of the decision point
+        :param day: the EventDay compared to the decision point
+        :return: String Representation of positive label reason or None
+        """
+        if day.died():
+            return "Death"
+        if day.morphological_relapse():
+            return "Morph"
+        if any(treatment not in dpt_treatments for treatment in day.treatments) and (
+                {TreatmentEncounter.INDICATION_INDUCTION, TreatmentEncounter.INDICATION_MRD_TREATMENT} & day.indications):
+            return "MRD"
+
         return None
 
     def _most_relevant_indication(self, indications):
@@ -1,4 +1,5 @@
 import logging
+from bisect import bisect_right
 from operator import itemgetter
 from classes.collection.patienttimeline import PatientTimeline
 
@@ -26,19 +27,9 @@ class TrainingRowEvaluator:
 
         dp_rows = list()
         bad_cols = set()
+        visits = _VisitPrefix(timeline)
         for dp in timeline.decision_points:
-            visit_representations = list()
-            label = dp.label
-            eventdays = timeline.get_events_before_date(dp.eval_date)
-            raw_feature_days = {ed.days_since_epoch: ed.existant_features for ed in eventdays}
-            for day, features in raw_feature_days.items():
-                rowdict = {'PID': timeline.patientid,
-                           'DAY': day,
-                           **features
-                           }
-
-                visit_rep, bad_cols = self.build_visit_dict(rowdict, datadict, bad_cols)
-                visit_representations.append(visit_rep)
+            visit_representations, bad_cols = visits.before_date(dp.eval_date, datadict, self.build_visit_dict, bad_cols)
             training_row = self.create_condensed_row(timeline.patientid, visit_representations,
                                                       self.convert_label_to_int(dp.label))
             dp_rows.append(training_row)
@@ -83,26 +74,19 @@ class TrainingRowEvaluator:
                     'DAY': int(rowdict.pop('DAY', 0))
                     }
         codeset = set()
+        router = datadict.feature_router(FEATURE_RECODE_MAP)
         for col, val in rowdict.items():
-            # data manipulation
-            ## one-hot encoding
-            cat_col, cat_val = datadict.is_categorical_var(col, val)
-            if cat_col:
-                col = cat_col
-                val = cat_val
-            ## create meta feature for treatment and indication
-            if col in FEATURE_RECODE_MAP:
-                col = FEATURE_RECODE_MAP.get(col)
-            # map feature to data dictionary
-            direct_codekey = datadict.code_cols.get(col)
-            if col in datadict.drop_cols:
+            # data manipulation: one-hot encoding, meta features for treatment and indication
+            # and the mapping to the data dictionary are compiled into the feature's route
+            (kind, target, col, binary), val = router.route(col, val)
+            if kind == router.DROP:
                 pass
-            elif direct_codekey:
-                if direct_codekey[1] == 'Binary' and not val:
+            elif kind == router.CODE:
+                if binary and not val:
                     pass
                 else:
-                    codeset.add(datadict.code_mappings.get(col))
-            elif col in datadict.numeric_cols:
+                    codeset.add(target)
+            elif kind == router.NUMERIC:
                 # change NULL values in numerics to valid default float given in config file
                 # backoff to zero if column is not in config['DEFAULT_VALUES']
                 if val is None and default_vals is not None:
@@ -112,8 +96,55 @@ class TrainingRowEvaluator:
                         print("Numeric columns must be non null or contained within the DEFAULT_VALUES \
                                 dictionary in config.json - Column  ({}) defaulting to 0 ".format(col))
                         val = 0
-                newvisit['numerics'][datadict.numeric_cols.index(col)] = val
+                newvisit['numerics'][target] = val
             else:
-                error_cols.add(col)
+                error_cols.add(target)
         newvisit['codes'] = list(codeset)
-        return newvisit, error_cols
\ No newline at end of file
+        return newvisit, error_cols
+
+class _VisitPrefix:
+    """
+    the visit representations of a timeline's sorted event days, each encoded once and shared by every
+    decision point whose history includes that day
+
+    the days before a decision point are a prefix of the sorted days, so while the days since epoch increase
+    along the prefix a decision point's visits are a slice of the shared list. Otherwise the visits are
+    deduplicated by days since epoch (last day wins) like a per decision point dictionary would be, and a day
+    already overwritten in the first decision point that includes it is never encoded (nor are its bad columns
+    reported), as it is overwritten in every later decision point too
+    """
+    def __init__(self, timeline):
+        self.patientid = timeline.patientid
+        self.days = timeline.get_sorted_events()
+        self.dates = [ed.date for ed in self.days]
+        self.visits = []
+        # the number of leading visits whose DAYs are strictly increasing
+        self.increasing = 0
+
+    def before_date(self, date, datadict, build_visit_dict, bad_cols):
+        """
+        :return: the visit representations of the event days on or before date, and the updated bad_cols
+        """
+        n_days = bisect_right(self.dates, date)
+        begin = len(self.visits)
+        last_of_day = {ed.days_since_epoch: i for i, ed in enumerate(self.days[begin:n_days], begin)}
+        for i in range(begin, n_days):
+            ed = self.days[i]
+            if last_of_day[ed.days_since_epoch] != i:
+                # overwritten by a later day with the same days since epoch
+                self.visits.append(None)
+                continue
+            rowdict = {'PID': self.patientid,
+                       'DAY': ed.days_since_epoch,
+                       **ed.existant_features
+                       }
+            visit_rep, bad_cols = build_visit_dict(rowdict, datadict, bad_cols)
+            if self.increasing == len(self.visits) and \
+                    (not self.visits or self.visits[-1]['DAY'] < visit_rep['DAY']):
+                self.increasing += 1
+            self.visits.append(visit_rep)
+
+        if n_days <= self.increasing:
+            return self.visits[:n_days], bad_cols
+        deduplicated = {ed.days_since_epoch: visit for ed, visit in zip(self.days[:n_days], self.visits)}
+        return list(deduplicated.values()), bad_cols
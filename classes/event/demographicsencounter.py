@@ -1,6 +1,8 @@
 from classes.event.encounter import Encounter, EncounterFactory
 
 class DemographicsEncounter(Encounter):
+    __slots__ = ()
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(DemographicsEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
 
@@ -14,6 +16,8 @@ class DemographicsEncounter(Encounter):
 
 
 class DemographicsEncounterFactory(EncounterFactory):
+    FIELDS = ('uwid', 'hct1_date_manual', 'relapse_date_manual')
+
     def __init__(self):
         super(DemographicsEncounterFactory, self).__init__(DemographicsEncounter)
 
@@ -1,20 +1,102 @@
 import datetime as dt
+import sys
+import numpy as np
 import pandas as pd
+from array import array
 from math import isnan
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+class FeatureTable():
+    """
+    An interned, shared tuple of feature names
+
+    Encounters built from the same form share one FeatureTable and store only the positions
+    and values of their non-null features against it
+    >>> FeatureTable.intern(('a', 'b')) is FeatureTable.intern(('a', 'b'))
+    True
+    """
+    __slots__ = ('names', 'positions')
+    _TABLES = dict()
+
+    def __init__(self, names):
+        self.names = tuple(sys.intern(n) if type(n) is str else n for n in names)
+        self.positions = {n: i for i, n in enumerate(self.names)}
+
+    def __reduce__(self):
+        return (FeatureTable.intern, (self.names,))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def intern(cls, names):
+        names = tuple(names)
+        table = cls._TABLES.get(names)
+        if table is None:
+            table = cls._TABLES.setdefault(names, cls(names))
+        return table
+
+
 class Encounter():
     EXPECTED_DATE_STRING_FORMAT = '%Y-%m-%d'
+    __slots__ = ('date', 'days_since_epoch', 'days_since_relapse', 'patientid',
+                 '_feature_table', '_feature_idx', '_feature_vals', '_features', '_existant_features')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         self.date = self._date_coercion(date)
         self.days_since_epoch = days_since_epoch
         self.days_since_relapse = days_since_relapse
-        self.type = type(self).__name__
         self.patientid = patientid
         self.raw_df = kwargs.get("raw_df", None)
 
+    @property
+    def type(self):
+        return type(self).__name__
+
+    @property
+    def raw_df(self):
+        """
+        the raw form row the encounter was built from, as a dictionary (None if there was none)
+        """
+        if self._feature_table is None:
+            return None
+        return self._row_features()
+
+    @raw_df.setter
+    def raw_df(self, raw_df):
+        """
+        store a raw form row compactly: its column names are interned in a shared FeatureTable
+        and only the non-null values are kept, alongside their positions in the table
+
+        replacing the raw row clears the memoized features and existant_features
+        """
+        self._features, self._existant_features = None, None
+        if raw_df is None:
+            self._feature_table, self._feature_idx, self._feature_vals = None, None, None
+            return
+        if type(raw_df) == pd.DataFrame:
+            raw_df = raw_df.to_dict(orient='records')[0]
+        elif type(raw_df) == pd.Series:
+            raw_df = raw_df.to_dict()
+        elif type(raw_df) != dict:
+            raise ValueError(
+                "the Dataframe supplied to Encounter {c} is invalid!: {df}".format(c=type(self).__name__, df=raw_df))
+        table = FeatureTable.intern(raw_df.keys())
+        idx = []
+        vals = []
+        for i, v in enumerate(raw_df.values()):
+            # python float NaNs are the missing values of a form row, they are restored by features
+            if type(v) is float and isnan(v):
+                continue
+            idx.append(i)
+            vals.append(v)
+        self._feature_table = table
+        self._feature_idx = array('H' if len(table) < 2 ** 16 else 'I', idx)
+        self._feature_vals = tuple(vals)
+
     def __lt__(self, other):
         return self.date < other.date
 
@@ -66,6 +148,9 @@ class Encounter():
     def features(self):
         """
         return the features for use in creating training rows
+
+        the features are built on first access and memoized, so the returned dictionary
+        is shared and must not be modified by callers
         :return:
         >>> import datetime as dt
         >>> import pandas as pd
@@ -73,29 +158,46 @@ class Encounter():
         >>> enc = Encounter(123, dt.datetime.strptime("7-11-2019", '%m-%d-%Y') , 0, 0, raw_df=raw_df)
         >>> enc.features
         {'pid': 123, 'date': Timestamp('2019-07-11 00:00:00'), 'cat': 'meow'}
-        >>> raw_df = {"pid": 456, "date":dt.datetime.strptime("7-11-2019", '%m-%d-%Y'), "dog":"bork"}
+        >>> enc.features is enc.features
+        True
+        >>> raw_df = {"pid": 456, "date":dt.datetime.strptime("7-11-2019", '%m-%d-%Y'), "dog":"bork", "fish": float('nan')}
         >>> enc = Encounter(456, dt.datetime.strptime("7-11-2019", '%m-%d-%Y') , 0, 0, raw_df=raw_df)
         >>> enc.features
-        {'pid': 456, 'date': datetime.datetime(2019, 7, 11, 0, 0), 'dog': 'bork'}
-        """
-        if type(self.raw_df) == pd.DataFrame:
-            return self.raw_df.to_dict(orient='records')[0]
-        if type(self.raw_df) == pd.Series:
-            return self.raw_df.to_dict()
-        if type(self.raw_df) == dict:
-            return self.raw_df
-        if self.raw_df is None:
+        {'pid': 456, 'date': datetime.datetime(2019, 7, 11, 0, 0), 'dog': 'bork', 'fish': nan}
+        """
+        if self._features is None:
+            self._features = self._build_features()
+        return self._features
+
+    def _build_features(self):
+        """
+        build the features for the encounter, subclasses override this to add or replace features
+        """
+        return self._row_features()
+
+    def _row_features(self):
+        if self._feature_table is None:
             return dict()
-        return ValueError(
-            "the Dataframe supplied to Encounter {c} is invalid!: {df}".format(c=type(self).__name__, df=self.raw_df))
+        names = self._feature_table.names
+        features = dict.fromkeys(names, float('nan'))
+        for i, v in zip(self._feature_idx, self._feature_vals):
+            features[names[i]] = v
+        return features
 
     @property
     def existant_features(self):
         """
         return the subset of features that have tangible information for the encounter
+
+        memoized like features, the returned dictionary must not be modified by callers
         :return:
+        >>> enc = Encounter(123, "2019-07-11", 0, 0, raw_df={"pid": 123, "cat": "meow", "fish": float('nan')})
+        >>> enc.existant_features
+        {'pid': 123}
         """
-        return {k:v for k,v in self.features.items() if type(v) in [float, int, not str] and not isnan(v)}
+        if self._existant_features is None:
+            self._existant_features = {k:v for k,v in self.features.items() if type(v) in [float, int, not str] and not isnan(v)}
+        return self._existant_features
 
     @property
     def treatments(self):
@@ -123,6 +225,9 @@ class Encounter():
 
 
 class EncounterFactory():
+    # the form columns the factory reads to make an encounter, besides the features stored from the whole row
+    FIELDS = ()
+
     def __init__(self, encountertype):
         self.encounterType = encountertype
 
@@ -137,6 +242,44 @@ class EncounterFactory():
 
         return events
 
+    def make_encounters_from_df(self, events_df):
+        """
+        Batch version of make_encounters for a whole form dataframe, using each row's index as its patientid
+
+        The dataframe is converted to values once and each row is handed to the factory as a plain dict
+        of python values, so no pandas Series is created per row. The encounters are identical to calling
+        make_encounters on every row of events_df.iterrows()
+        :param events_df: a form dataframe indexed by patientid
+        :return: list of encounters, in row order
+        >>> import datetime as dt
+        >>> import pandas as pd
+        >>> from classes.event.relapseencounter import RelapseEncounterFactory
+        >>> df = pd.DataFrame({'date_response': ['2019-07-11'], 'days_hct1_to_e': [3], 'days_index_relapse_to_e': [2],
+        ...                    'e_response': [1], 'w_relapse': [1], 'w_crdepth': [None], 'wbc': [1.0],
+        ...                    'pb_blasts': [None], 'bm_blasts': [None]}, index=[12345])
+        >>> encounters = RelapseEncounterFactory().make_encounters_from_df(df)
+        >>> encounters
+        [RelapseEncounter instance: patientid: 12345 date: 2019-07-11 00:00:00 type: RelapseEncounter]
+        >>> encounters[0].is_morphologic_relapse()
+        True
+        """
+        events = []
+        columns = list(events_df.columns)
+        rows = events_df.values
+        # the rows of iterrows are series of the frame's common dtype, and their values reach the encounters as
+        # python values, a subject id added to a float row becomes a float
+        float_rows = rows.dtype.kind == 'f'
+        if rows.dtype.kind in 'biuf':
+            rows = rows.astype(object)
+        elif rows.dtype != object:
+            rows = events_df.astype(object).values
+        for pid, values in zip(events_df.index, rows):
+            if float_rows and isinstance(pid, (int, np.integer)):
+                pid = float(pid)
+            self._add_event_to_events_list(pid, dict(zip(columns, values)), events)
+
+        return events
+
     def _add_event_to_events_list(self, pid, df_row, events_list):
         df_row = self._add_subjectid_to_df(df_row, pid)
         try:
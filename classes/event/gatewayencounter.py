@@ -2,6 +2,8 @@ from classes.event.encounter import Encounter, EncounterFactory
 
 
 class gatewayEncounter(Encounter):
+    __slots__ = ()
+
     def __init__(self, patientid, date, days_since_epoch=0, days_since_relapse=0,**kwargs):
         super(gatewayEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         
@@ -15,6 +17,8 @@ class gatewayEncounter(Encounter):
 
 
 class gatewayEncounterFactory(EncounterFactory):
+    FIELDS = ('uwid', 'txdate')
+
     def __init__(self):
         super(gatewayEncounterFactory, self).__init__(gatewayEncounter)
 
@@ -1,6 +1,8 @@
 from classes.event.encounter import Encounter, EncounterFactory
 
 class GraftRejectionEncounter(Encounter):
+    __slots__ = ('chim_mark', 'graft_rej_event')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(GraftRejectionEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse)
         self.chim_mark = kwargs.get('chim_mark', None)
@@ -18,14 +20,15 @@ class GraftRejectionEncounter(Encounter):
     def treatments(self):
         return list()
 
-    @property
-    def features(self):
-        f = super(GraftRejectionEncounter, self).features
+    def _build_features(self):
+        f = super(GraftRejectionEncounter, self)._build_features()
         f['graft_rej_event'] = self.graft_rej_event
 
         return f
 
 class GraftRejectionEncounterFactory(EncounterFactory):
+    FIELDS = ('rej_date', 'hct1_to_rej', 'rel_to_rej', 'chim_mark', 'graft_rej')
+
     def __init__(self):
         super(GraftRejectionEncounterFactory, self).__init__(GraftRejectionEncounter)
 
@@ -1,6 +1,8 @@
 from classes.event.encounter import Encounter, EncounterFactory
 
 class GVHDEncounter(Encounter):
+    __slots__ = ('gvhd_type', 'acute_gvhd_grade', 'chronic_gvhd_severity', 'gvhd_event')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(GVHDEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         self.gvhd_type = kwargs.get('gvhd_type', None)
@@ -20,13 +22,15 @@ class GVHDEncounter(Encounter):
     def treatments(self):
         return list()
 
-    @property
-    def features(self):
-        f = super(GVHDEncounter, self).features
+    def _build_features(self):
+        f = super(GVHDEncounter, self)._build_features()
         f['gvhd_event'] = self.gvhd_event
         return f
 
 class GVHDEncounterFactory(EncounterFactory):
+    FIELDS = ('date_gvhd', 'days_hct1_gvhd', 'days_index_rel_to_gvhd', 'e_gvhd', 'w_sub_agvh_grade',
+              'w_sub_cgvh_severity')
+
     def __init__(self):
         super(GVHDEncounterFactory, self).__init__(GVHDEncounter)
 
@@ -4,6 +4,8 @@ from classes.event.encounter import Encounter, EncounterFactory
 
 class ISPEncounter(Encounter):
     ISP_STOP_VAR = 2
+    __slots__ = ('e_isp', 'isp_event')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(ISPEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         self.e_isp = kwargs.get('e_isp', None)
@@ -21,13 +23,14 @@ class ISPEncounter(Encounter):
     def treatments(self):
         return list()
 
-    @property
-    def features(self):
-        f = super(ISPEncounter, self).features
+    def _build_features(self):
+        f = super(ISPEncounter, self)._build_features()
         f['isp_event'] = self.isp_event
         return f
 
 class ISPEncounterFactory(EncounterFactory):
+    FIELDS = ('date_isp_action', 'days_hct1_to_ispact', 'days_index_rel_to_ispact', 'e_isp')
+
     def __init__(self):
         super(ISPEncounterFactory, self).__init__(ISPEncounter)
     def translate_df_to_dict(self, df_row):
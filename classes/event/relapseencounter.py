@@ -9,6 +9,8 @@ class RelapseEncounter(Encounter):
     MORPHOLOGIC_EXTRAMEDULLARY_PRESENTATION = 2
     MRD_PRESENTATION = 3
 
+    __slots__ = ('event_type', 'relapse_presentation', 'cr_depth')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(RelapseEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         self.event_type = kwargs.get('relapse_or_response', None)
@@ -66,6 +68,9 @@ class RelapseEncounter(Encounter):
 
 
 class RelapseEncounterFactory(EncounterFactory):
+    FIELDS = ('date_response', 'days_hct1_to_e', 'days_index_relapse_to_e', 'e_response', 'w_relapse',
+              'w_crdepth', 'wbc', 'pb_blasts', 'bm_blasts')
+
     def __init__(self):
         super(RelapseEncounterFactory, self).__init__(RelapseEncounter)
 
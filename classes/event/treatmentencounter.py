@@ -18,6 +18,8 @@ class TreatmentEncounter(Encounter):
                       "INDICATION_MAINTENANCE_CR": INDICATION_MAINTENANCE_CR
                       }
 
+    __slots__ = ('start_date', 'rx_indication', 'treatment_dict')
+
     def __init__(self, patientid, date, start_date, days_since_epoch, days_since_relapse, **kwargs):
         super(TreatmentEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         self.start_date = self._date_coercion(start_date)
@@ -180,6 +182,9 @@ class TreatmentEncounterFactory(EncounterFactory):
     >>> print(encounter)
     [TreatmentEncounter instance: patientid: 12345 date: 2019-07-29 00:00:00 type: TreatmentEncounter rx_indication: None treatments: {'induction_chemo': None, 'consolidation_chemo': None, 'hydroxyurea': None, 'intrathecal_therapy': None, 'radiation': None, 'hypomethylating': None, 'targeted': None, 'checkpoint_inhibitors': None, 'cytokine': None, 'cli': None, 'hct': None, 'other_np': None, 'palliative_chemo': None, 'other_tcell_targeted': None}]
     """
+    FIELDS = ('date_treatment', 'w_target_stop', 'days_hct1_to_tx', 'days_index_relapse_to_tx', 'rx_indication') + \
+             tuple('e_treatment___{}'.format(i) for i in range(1, 15))
+
     def __init__(self):
         super(TreatmentEncounterFactory, self).__init__(TreatmentEncounter)
 
@@ -196,15 +201,20 @@ class TreatmentEncounterFactory(EncounterFactory):
             start_date = TreatmentEncounter._date_coercion(df_row['date_treatment'])
             delta += (end_date - start_date).days
 
+        split_events = []
         for d in range(delta):
             try:
                 df_row['date_treatment'] = TreatmentEncounter._date_coercion(df_row['start_date']) + datetime.timedelta(days=d)
                 dictionary = self.translate_df_to_dict(df_row)
-                events_list.append(self.encounterType(**dictionary))
+                split_events.append(self.encounterType(**dictionary))
             except ValueError as e:
                 logger.warning(
                     "A value error occurred when adding events to the events list for type: {}  {e}".format(
                         type(self).__name__, e=e))
+        # every day of a multi-day treatment shares the raw row as it stands after the final day
+        for event in split_events[:-1]:
+            event.raw_df = df_row
+        events_list.extend(split_events)
 
     def _add_start_date_to_df(self, df):
         df['start_date'] = df['date_treatment']
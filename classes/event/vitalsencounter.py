@@ -2,6 +2,8 @@ from classes.event.encounter import Encounter, EncounterFactory
 
 
 class VitalsEncounter(Encounter):
+    __slots__ = ('death_status', 'status_at_death', 'status_last_alive')
+
     def __init__(self, patientid, date, days_since_epoch, days_since_relapse, **kwargs):
         super(VitalsEncounter, self).__init__(patientid, date, days_since_epoch, days_since_relapse, **kwargs)
         self.death_status = kwargs.get('death_status', None)
@@ -28,8 +30,7 @@ class VitalsEncounter(Encounter):
         """
         return self.death_status == 1
 
-    @property
-    def features(self):
+    def _build_features(self):
         return list()
 
     @property
@@ -38,6 +39,9 @@ class VitalsEncounter(Encounter):
 
 
 class VitalsEncounterFactory(EncounterFactory):
+    FIELDS = ('date_status', 'days_hct1_to_status', 'days_index_rel_to_status', 'e_status', 'w_status_dead',
+              'w_status_alive')
+
     def __init__(self):
         super(VitalsEncounterFactory, self).__init__(VitalsEncounter)
 
@@ -51,6 +51,21 @@ GATEWAY_FEATURE_RECODE_MAP = {'cmvx': {'-/-': 'neg_neg', '-/': 'neg_neg', '/': '
                                           'URD/MATCHED': 'URD/MATCHED',
                                           'URD/MISMATCH': 'URD/MISMATCH'}}
 
+# columns of the gateway csv that pull_gateway_data prepares, with the dtypes they are read as
+# (None lets the csv reader infer the dtype, the 0/1 flags are int64, or float64 when a value is missing)
+GATEWAY_COLUMNS = {'uwid': 'str', 'txdate': 'str', 'txage': 'float64', 'relage': 'float64',
+                   'minitx': None, 'delatg': None, 'delcamp': None, 'sex': 'str', 'donsex': 'str',
+                   'tbidose': 'float64', 'proplbl': 'str', 'cmvx': 'str', 'hla_cco': 'str', 'celltxl': 'str'}
+
+# the strings read as missing in the gateway csv, pandas' default NA values
+GATEWAY_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                     'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null']
+
+# gateway columns that prepare_gateway_data encodes as '<column>_<level>' features,
+# and the gateway columns that other features are derived from
+GATEWAY_ENCODED_COLUMNS = ['cmvx', 'hla_cco', 'tbidose', 'celltxl', 'proplbl']
+GATEWAY_DERIVED_FEATURES = {'female_donor_male_recipient': ['sex', 'donsex']}
+
 BUCKETS = {'txage':{0: (0, 1), 1: (1, 12), 2: (13, 18), 3: (18, 60), 4: (60, 160)},
            'relage':{0: (0, 1), 1: (1, 12), 2: (13, 18), 3: (18, 60), 4: (60, 160)},
            'pb_blasts':{0: (0, 1), 1:(1, 5), 2:(5, 20), 3:(20, 50), 4:(50, 100)},
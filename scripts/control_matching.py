@@ -0,0 +1,211 @@
+"""
+match negative (no relapse) training rows with positive training rows, returning the positions of the selected rows
+"""
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+logger = logging.getLogger(__name__)
+
+
+class LengthIndex():
+    """
+    The positions of the positive rows not yet matched, bucketed by sequence length, with the lengths kept sorted
+
+    >>> index = LengthIndex([3, 5, 5, 8], [0, 1, 2, 3])
+    >>> index.closest(4), index.closest(5), index.closest(6), index.closest(9)
+    (5, 5, None, None)
+    >>> index.remove(5, [1]), index.buckets[5]
+    ([2], [1])
+    """
+    def __init__(self, lengths, positions):
+        self.buckets = defaultdict(list)
+        for length, position in zip(lengths, positions):
+            self.buckets[length].append(position)
+        self.lengths = sorted(self.buckets)
+
+    def closest(self, length):
+        """
+        return the closest sequence length, if it is at least length, or None
+
+        like the original matching only positive rows at least as long as the negative row are matched,
+        a negative row whose closest positive rows are all shorter gets no match
+        """
+        k = bisect_left(self.lengths, length)
+        if k == len(self.lengths):
+            return None
+        if k > 0 and length - self.lengths[k - 1] < self.lengths[k] - length:
+            return None
+        return self.lengths[k]
+
+    def remove(self, length, picks):
+        """
+        remove the picks (positions in the length's bucket) from the index
+        :return: the row positions of the picks, in the order of picks
+        """
+        bucket = self.buckets[length]
+        positions = [bucket[p] for p in picks]
+        for p in sorted(picks, reverse=True):
+            del bucket[p]
+        if not bucket:
+            del self.buckets[length]
+            del self.lengths[bisect_left(self.lengths, length)]
+        return positions
+
+
+def match_by_length(lengths, targets, seed, match_num):
+    """
+    pair every negative row with match_num positive rows of the closest sequence length, without replacement
+
+    the negative rows are visited by sequence length in set order and the positive rows are drawn as
+    DataFrame.sample(match_num, random_state=seed) draws from the candidates, so the selection is the same
+    as the original DataFrame based matching
+    :param lengths: sequence length of every row
+    :param targets: target of every row, 1 for positive rows and 0 for negative rows
+    :return: the positions of the selected rows, each negative row following its matched positive rows
+    """
+    lengths = np.asarray(lengths)
+    targets = np.asarray(targets)
+    positive = np.flatnonzero(targets == 1)
+    negative = np.flatnonzero(targets == 0)
+    index = LengthIndex(lengths[positive].tolist(), positive.tolist())
+    negatives_by_length = defaultdict(list)
+    for position, length in zip(negative.tolist(), lengths[negative].tolist()):
+        negatives_by_length[length].append(position)
+
+    # the first match_num positions of a permutation only depend on the number of candidates
+    picks_cache = dict()
+    random_state = np.random.RandomState()
+    selected = []
+    for i in set(lengths[negative].tolist()):
+        for position in negatives_by_length[i]:
+            closest = index.closest(i)
+            n_candidates = len(index.buckets[closest]) if closest is not None else 0
+            if n_candidates < match_num:
+                logger.info("missing matched controls for sequence length: {s}".format(s=i))
+                continue
+            if match_num:
+                picks = picks_cache.get(n_candidates)
+                if picks is None:
+                    random_state.seed(seed)
+                    picks = picks_cache[n_candidates] = random_state.permutation(n_candidates)[:match_num].tolist()
+                selected.extend(index.remove(closest, picks))
+            selected.append(position)
+    return selected
+
+
+def covariate_frame(df, covariates, code_mappings=None):
+    """
+    return the matching covariates of every training row, indexed like df
+    :param covariates: list of covariate names:
+                       'length' is the number of visits, 'days_since_hct' the day of the last visit,
+                       any other name is a group of code features named '<name>_<level>' (e.g. 'txage' or 'hla_cco'),
+                       which adds one 0/1 column per level for whether the row has that code
+    :param code_mappings: {code feature name: code}, from the DataDictionary, needed for code groups
+    >>> df = pd.DataFrame({'to_event': [[0, 4], [0, 2, 9]], 'codes': [[[1], []], [[2], [7], []]]})
+    >>> covariate_frame(df, ['length', 'days_since_hct', 'txage'], {'txage_0': 1, 'txage_1': 2, 'Chemotherapy': 7})
+       length  days_since_hct  txage_0  txage_1
+    0       2               4        1        0
+    1       3               9        0        1
+    """
+    columns = dict()
+    for covariate in covariates:
+        if covariate == 'length':
+            columns[covariate] = df['to_event'].str.len()
+        elif covariate == 'days_since_hct':
+            columns[covariate] = df['to_event'].map(lambda days: days[-1] if len(days) else 0)
+        else:
+            prefix = "".join([covariate, '_'])
+            level_codes = {name: code for name, code in (code_mappings or dict()).items() if name.startswith(prefix)}
+            if not level_codes:
+                raise ValueError("No code features found for matching covariate: {c}".format(c=covariate))
+            row_codes = df['codes'].map(lambda visits: {c for visit in visits for c in visit})
+            for name, code in sorted(level_codes.items()):
+                columns[name] = row_codes.map(lambda codes: int(code in codes))
+    return pd.DataFrame(columns, index=df.index)
+
+
+def match_nearest_neighbours(covariates, targets, seed, match_num, caliper=None):
+    """
+    pair every negative row with its match_num nearest positive rows in covariate space, without replacement
+
+    the covariates are scaled to unit standard deviation, so a caliper (the largest distance allowed between
+    a negative row and its matches) is in standard deviations. Positive rows with the same covariates share a
+    point of a KD-tree, with a count of the rows still unmatched, and negative rows with the same covariates share
+    their nearest neighbour queries. Negative rows take their matches greedily in a seeded random order, from the
+    nearest points that still have rows left, and rows with the same covariates are taken in a seeded random order
+    :param covariates: (n rows, n covariates) array
+    :param targets: target of every row, 1 for positive rows and 0 for negative rows
+    :return: the positions of the selected rows, each negative row following its matched positive rows
+    >>> covariates = [[1, 0], [2, 0], [1, 1], [5, 0], [1, 0], [5, 1]]
+    >>> match_nearest_neighbours(covariates, [0, 1, 1, 0, 1, 1], seed=1, match_num=1)
+    [4, 0, 1, 3]
+    >>> match_nearest_neighbours(covariates, [0, 1, 1, 0, 1, 1], seed=1, match_num=2, caliper=0.5)
+    []
+    """
+    random_state = np.random.RandomState(seed)
+    targets = np.asarray(targets)
+    covariates = np.asarray(covariates, dtype=np.float64).reshape(len(targets), -1)
+    scale = covariates.std(axis=0)
+    covariates = covariates / np.where(scale > 0, scale, 1)
+    if caliper is None:
+        caliper = np.inf
+
+    positive = random_state.permutation(np.flatnonzero(targets == 1))
+    negative = random_state.permutation(np.flatnonzero(targets == 0))
+    if not match_num or not len(negative):
+        return negative.tolist()
+    if len(positive) < match_num:
+        logger.info("missing matched controls: fewer than {m} positive instances".format(m=match_num))
+        return []
+
+    points, point_of_positive = np.unique(covariates[positive], axis=0, return_inverse=True)
+    point_rows = [[] for _ in range(len(points))]
+    for point, position in zip(point_of_positive.reshape(-1).tolist(), positive.tolist()):
+        point_rows[point].append(position)
+    tree = KDTree(points)
+    queries, query_of_negative = np.unique(covariates[negative], axis=0, return_inverse=True)
+
+    def nearest_points(query, k):
+        # [distances, point indices, number of leading points without rows left]
+        distances, indices = tree.query(queries[query:query + 1], k=min(len(points), k))
+        return [distances[0].tolist(), indices[0].tolist(), 0]
+
+    neighbours = dict()
+    selected = []
+    for position, query in zip(negative.tolist(), query_of_negative.reshape(-1).tolist()):
+        if query not in neighbours:
+            neighbours[query] = nearest_points(query, 4 * match_num)
+        nearest = neighbours[query]
+        picks = []
+        needed = match_num
+        i = nearest[2]
+        while needed:
+            if i == len(nearest[1]):
+                if len(nearest[1]) == len(points):
+                    break
+                # the points queried so far do not have enough rows left, query twice as many
+                nearest = neighbours[query] = nearest_points(query, 2 * len(nearest[1]))
+                picks, needed, i = [], match_num, 0
+                continue
+            if nearest[0][i] > caliper:
+                break
+            n_rows = len(point_rows[nearest[1][i]])
+            if not n_rows and i == nearest[2]:
+                nearest[2] += 1
+            if n_rows:
+                picks.append((nearest[1][i], min(n_rows, needed)))
+                needed -= picks[-1][1]
+            i += 1
+        if needed:
+            logger.info("missing matched controls within caliper for row: {p}".format(p=position))
+            continue
+        for point, n_rows in picks:
+            for _ in range(n_rows):
+                selected.append(point_rows[point].pop())
+        selected.append(position)
+    return selected
@@ -0,0 +1,191 @@
+"""
+recode and bucket whole feature columns of the REDCap and gateway exports at once, instead of cell by cell
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_float_dtype, is_object_dtype
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalBins():
+    """
+    The buckets of one numeric feature, {bucket: (lower, upper)} of half-open intervals [lower, upper),
+    compiled to the sorted edges of all intervals and the bucket of every span between two edges
+
+    a value gets the largest bucket whose interval holds it, and NaN when no interval holds it
+    (e.g. 12.5 in a gap between [1, 12) and [13, 18)) or when it is NaN
+
+    >>> bins = IntervalBins({0: (0, 1), 1: (1, 12), 2: (13, 18)})
+    >>> bins.edges.tolist(), bins.buckets.tolist()
+    ([0.0, 1.0, 12.0, 13.0, 18.0], [0.0, 1.0, nan, 2.0])
+    >>> bins.bucket([0, 0.5, 1, 12, 12.5, 13, 17.9, 18, -1, np.nan]).tolist()
+    [0.0, 0.0, 1.0, nan, nan, 2.0, 2.0, nan, nan, nan]
+    """
+    def __init__(self, buckets):
+        self.edges = np.unique(np.array([edge for interval in buckets.values() for edge in interval], dtype=np.float64))
+        lowers = self.edges[:-1]
+        self.buckets = np.full(len(lowers), np.nan)
+        for bucket, (lower, upper) in buckets.items():
+            # a span between two edges is either inside or outside of every interval
+            inside = (lowers >= lower) & (lowers < upper)
+            self.buckets[inside] = np.fmax(self.buckets[inside], bucket)
+
+    def bucket(self, values):
+        """
+        :param values: array like of numbers, None or NaN
+        :return: float array of the bucket of every value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        # NaN sorts after every edge, into the span past the last edge
+        span = np.searchsorted(self.edges, values, side='right') - 1
+        inside = (span >= 0) & (span < len(self.buckets))
+        buckets = np.full(values.shape, np.nan)
+        buckets[inside] = self.buckets[span[inside]]
+        return buckets
+
+
+_COMPILED_BUCKETS = dict()
+
+
+def compile_buckets(lookups):
+    """
+    return {feature: IntervalBins} for lookups ({feature: {bucket: (lower, upper)}}, e.g. BUCKETS),
+    compiled on the first call for the lookups object and reused after
+    """
+    compiled = _COMPILED_BUCKETS.get(id(lookups))
+    if compiled is None or compiled[0] is not lookups:
+        compiled = _COMPILED_BUCKETS[id(lookups)] = (lookups, {col: IntervalBins(buckets)
+                                                               for col, buckets in lookups.items()})
+    return compiled[1]
+
+
+class ValueRecoder():
+    """
+    Recode the values of one feature column with a lookup of {value: recoded value}, like get_values cell by cell
+
+    - numbers are looked up as str(int(number)), NaN becomes None
+    - strings without commas are looked up as they are
+    - comma separated strings (e.g. 'proplbl') become the set of their looked up parts joined by commas,
+      without the parts that have no (or an empty) recoded value
+    - values of any other type, and values not in the lookup, become None
+
+    the distinct values of a column are recoded once and remembered, later columns only recode values not seen yet
+
+    >>> recoder = ValueRecoder({'0': 'le450', '450': 'le450', 'FK506': 'CNI', 'CSP': 'CNI', 'MMF': 'MMF'})
+    >>> recoder.recode(pd.Series([450.0, np.nan, 1200.0, 0.0])).tolist()
+    ['le450', None, None, 'le450']
+    >>> recoder.recode(pd.Series(['MMF', 'FK506,CSP', 'X,Y', np.nan, 'FK506', 'X'])).tolist()
+    ['MMF', 'CNI', '', None, 'CNI', None]
+    >>> recoder.recode(pd.Series([0, 450])).tolist()
+    [None, None]
+    """
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self._strings = dict()
+        self._numbers = dict()
+
+    def recode(self, series):
+        """
+        :return: object array of the recoded values of series
+        """
+        if is_float_dtype(series.dtype):
+            return self._recode_numbers(series.to_numpy())
+        recoded = np.full(len(series), None, dtype=object)
+        if is_object_dtype(series.dtype) or isinstance(series.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            values = series.to_numpy(dtype=object)
+            if infer_dtype(values, skipna=True) == 'string':
+                # strings and missing values only: the strings are recoded, the missing values stay None
+                is_string = ~pd.isna(values)
+                is_number = np.zeros(len(values), dtype=bool)
+            else:
+                is_string = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+                is_number = np.fromiter((isinstance(v, float) for v in values), dtype=bool, count=len(values))
+            if is_string.any():
+                recoded[is_string] = self._recode_strings(values[is_string])
+            if is_number.any():
+                recoded[is_number] = self._recode_numbers(values[is_number].astype(np.float64))
+        # integer, boolean and date columns never hold floats or strings, nothing is recoded
+        return recoded
+
+    def _recode_numbers(self, values):
+        is_nan = np.isnan(values)
+        uniques, codes = np.unique(values[~is_nan], return_inverse=True)
+        new = [u for u in uniques.tolist() if u not in self._numbers]
+        self._numbers.update(zip(new, [self.lookup.get(str(int(u))) for u in new]))
+        recoded = np.full(len(values), None, dtype=object)
+        recoded[~is_nan] = np.array([self._numbers[u] for u in uniques.tolist()] + [None], dtype=object)[codes]
+        return recoded
+
+    def _recode_strings(self, values):
+        codes, uniques = pd.factorize(values)
+        new = pd.Series([u for u in uniques if u not in self._strings], dtype=object)
+        is_multi = new.str.contains(',', regex=False).to_numpy(dtype=bool)
+        self._strings.update((u, self.lookup.get(u)) for u in new[~is_multi])
+        if is_multi.any():
+            multi = new[is_multi].reset_index(drop=True)
+            parts = multi.str.split(',').explode()
+            parts = pd.Series([self.lookup.get(p) for p in parts], index=parts.index, dtype=object)
+            parts = parts[[bool(p) for p in parts]]
+            # the sets get the parts in the same order as in get_values, so they join in the same order
+            joined = parts.groupby(level=0, sort=False).agg(lambda p: ','.join(set(p)))
+            self._strings.update(zip(multi, joined.reindex(range(len(multi)), fill_value='')))
+        return np.array([self._strings[u] for u in uniques] + [None], dtype=object)[codes]
+
+
+_COMPILED_RECODERS = dict()
+
+
+def compile_recoders(lookups):
+    """
+    return {feature: ValueRecoder} for lookups ({feature: {value: recoded value}}, e.g. GATEWAY_FEATURE_RECODE_MAP),
+    created on the first call for the lookups object and reused after
+    """
+    compiled = _COMPILED_RECODERS.get(id(lookups))
+    if compiled is None or compiled[0] is not lookups:
+        compiled = _COMPILED_RECODERS[id(lookups)] = (lookups, {col: ValueRecoder(lookup)
+                                                                for col, lookup in lookups.items()})
+    return compiled[1]
+
+
+class MultiHotEncoder():
+    """
+    Encode a column of comma separated labels (e.g. the recoded 'proplbl') as one 0/1 column per label of a fixed
+    vocabulary, in sorted order, so the columns are the same whichever labels a column holds
+
+    labels outside of the vocabulary are left out, missing values and empty strings have no labels
+
+    >>> encoder = MultiHotEncoder(['MMF', 'CNI', 'MTX', 'CNI'])
+    >>> encoder.encode(pd.Series(['MMF,CNI', None, '', ' MTX ', 'CNI,OTHER'], index=[4, 3, 2, 1, 0]), prefix='proplbl_')
+       proplbl_CNI  proplbl_MMF  proplbl_MTX
+    4            1            1            0
+    3            0            0            0
+    2            0            0            0
+    1            0            0            1
+    0            1            0            0
+    """
+    def __init__(self, vocabulary):
+        self.vocabulary = sorted(set(vocabulary))
+        self._columns = {label: i for i, label in enumerate(self.vocabulary)}
+
+    def encode(self, series, prefix=''):
+        """
+        :return: dataframe of uint8 columns '<prefix><label>' for every label of the vocabulary, indexed like series
+        """
+        codes, uniques = pd.factorize(series)
+        # the rows of the distinct values, with an empty row last for the missing values (code -1)
+        unique_hot = np.zeros((len(uniques) + 1, len(self.vocabulary)), dtype=np.uint8)
+        unknown = set()
+        for i, value in enumerate(uniques):
+            for label in str(value).split(','):
+                label = label.strip()
+                if label in self._columns:
+                    unique_hot[i, self._columns[label]] = 1
+                elif label:
+                    unknown.add(label)
+        if unknown:
+            logger.warning("left out labels not in the vocabulary: {u}".format(u=sorted(unknown)))
+        return pd.DataFrame(unique_hot[codes], index=series.index,
+                            columns=["".join([prefix, label]) for label in self.vocabulary])
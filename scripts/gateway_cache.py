@@ -0,0 +1,102 @@
+"""
+keep the prepared gateway dataframe on local disk in a columnar format so that
+later pulls skip reading the gateway csv from the network share and preparing it again
+"""
+import os
+import json
+import hashlib
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayCache():
+    """
+    The prepared gateway dataframe, keyed by the size, modification time and content hash of its source csv
+    and by a key for how it was prepared
+
+    the size and modification time are checked first, the source csv is only hashed (read) when they changed,
+    so a copy or touch of an unchanged csv still uses the cached dataframe
+
+    layout:
+        <cache_dir>/manifest.json   -> {"source": {"size": <bytes>, "mtime_ns": <ns>, "sha256": <hex>},
+                                        "prepare_key": <key>}
+        <cache_dir>/gateway.parquet
+
+    >>> import tempfile
+    >>> source = os.path.join(tempfile.mkdtemp(), 'gateway.csv')
+    >>> with open(source, 'w') as fout:
+    ...     _ = fout.write('uwid,txage\\nU1,4\\n')
+    >>> cache = GatewayCache(tempfile.mkdtemp())
+    >>> cache.read(source, 'v1') is None
+    True
+    >>> cache.write(source, 'v1', pd.DataFrame({'uwid': ['1'], 'txage': [1.0]}))
+    >>> cache.read(source, 'v1')
+      uwid  txage
+    0    1    1.0
+    >>> cache.read(source, 'v2') is None
+    True
+    """
+    MANIFEST_NAME = 'manifest.json'
+    FRAME_NAME = 'gateway.parquet'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def file_hash(path, chunk_size=1 << 20):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _file_stats(path):
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _read_manifest(self):
+        path = os.path.join(self.cache_dir, self.MANIFEST_NAME)
+        if not os.path.exists(path):
+            return dict()
+        with open(path, 'r') as fin:
+            return json.load(fin)
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.cache_dir, self.MANIFEST_NAME)
+        tmp_path = "".join([path, '.tmp'])
+        with open(tmp_path, 'w') as fout:
+            json.dump(manifest, fout, indent=1)
+        os.replace(tmp_path, path)
+
+    def read(self, source_path, prepare_key):
+        """
+        return the cached gateway dataframe prepared from source_path, or None if there is none for its contents
+        :param prepare_key: str, changes whenever the preparation of the gateway dataframe changes
+        """
+        manifest = self._read_manifest()
+        frame_path = os.path.join(self.cache_dir, self.FRAME_NAME)
+        if manifest.get('prepare_key') != prepare_key or not os.path.exists(frame_path):
+            return None
+        source = manifest['source']
+        stats = self._file_stats(source_path)
+        if stats != {'size': source['size'], 'mtime_ns': source['mtime_ns']}:
+            if stats['size'] != source['size'] or self.file_hash(source_path) != source['sha256']:
+                return None
+            # same contents with a new modification time, check the size and time only next time
+            manifest['source'].update(stats)
+            self._write_manifest(manifest)
+        logger.info("read prepared gateway data for: {s} from: {p}".format(s=source_path, p=frame_path))
+        return pd.read_parquet(frame_path)
+
+    def write(self, source_path, prepare_key, df):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = {'source': dict(self._file_stats(source_path), sha256=self.file_hash(source_path)),
+                    'prepare_key': prepare_key}
+        frame_path = os.path.join(self.cache_dir, self.FRAME_NAME)
+        df.to_parquet(frame_path)
+        self._write_manifest(manifest)
+        logger.info("wrote prepared gateway data for: {s} to: {p}".format(s=source_path, p=frame_path))
@@ -26,6 +26,7 @@ logger.setLevel(logging.INFO)
 
 
 if __name__ == '__main__':
+    import argparse
     import yaml
     import logging
     import logging.config
@@ -34,6 +35,11 @@ if __name__ == '__main__':
     import matplotlib.mlab as mlab
     import matplotlib.pyplot as plt
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true',
+                        help='rebuild timelines from the REDCap snapshot instead of exporting from REDCap')
+    args = parser.parse_args()
+
     cd = os.path.dirname(os.path.realpath(__file__))
     with open(os.path.join(cd, '../logging.yaml'), 'r') as f:
         log_cfg = yaml.safe_load(f.read())
@@ -44,7 +50,7 @@ if __name__ == '__main__':
         with open(os.path.join(cd, c), 'r') as fin:
             config.update(json.load(fin))
 
-    timelines = pull_from_red_cap(config)
+    timelines = pull_from_red_cap(config, replay=args.replay)
     time_to_relapse = np.array([(dp.target_date - dp.eval_date).days
                        for timeline in timelines.values()
                        for dp in timeline.decision_points
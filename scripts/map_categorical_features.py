@@ -19,6 +19,7 @@ class DataDictionary():
         self.numeric_cols = []
         self.drop_cols = []
         self.code_mappings = {}        
+        self._feature_router = None
         self.data_dict_pkl_path = data_dict_pkl_path
         self.data_dict_csv_path = data_dict_csv_path
         self.categorical_feature_path = categorical_feature_path
@@ -31,6 +32,18 @@ class DataDictionary():
 
         return None, None
 
+    def feature_router(self, recode_map=None):
+        """
+        the FeatureRouter for this dictionary and recode map, compiled on first use
+
+        the router is rebuilt when the dictionary is read again or a different recode map is given
+        :param recode_map: {feature name: meta feature name}, e.g. FEATURE_RECODE_MAP
+        :return: FeatureRouter
+        """
+        router = self._feature_router
+        if router is None or router.recode_map is not recode_map:
+            router = self._feature_router = FeatureRouter(self, recode_map)
+        return router
 
     def create_data_dict(self):
         # initial creation of pickled data dictionary
@@ -73,12 +86,14 @@ class DataDictionary():
                     self.combine_cols.append(row['Name'])
                 else:
                     self.drop_cols.append(row['Name'])        
+        self._feature_router = None
 
 
     def get_code_mapping(self):
         with open(self.data_dict_pkl_path, "rb") as fin:
             code_d = pickle.load(fin)
         self.code_mappings = dict((v,k) for k,v in code_d.items())
+        self._feature_router = None
 
     def load_categorical_dict(self):
         # read in precreated pickled data dictionary
@@ -97,6 +112,7 @@ class DataDictionary():
                 cat_name[row['Name']] = row['N']
 
         self.categorical_cols = cat_name
+        self._feature_router = None
 
     def one_hot_encoding(self, feature):
         '''
@@ -131,6 +147,97 @@ class DataDictionary():
             pickle.dump(dict((i,all_features[i]) for i in range(len(all_features))), fin)
 
 
+class FeatureRouter():
+    """
+    A compiled routing table from raw feature names (and categorical levels) to their place in a visit
+
+    Each route is a tuple of (kind, target, name, binary): DROP, CODE with the feature's integer code as target,
+    NUMERIC with the feature's slot in the numerics as target, or UNKNOWN with the unmapped name as target.
+    Routes are the same as applying DataDictionary.is_categorical_var, the recode map and the code, drop and
+    numeric columns in turn, but each raw column (or categorical level) is resolved only once
+    >>> dd = DataDictionary()
+    >>> dd.code_cols = {'Chemotherapy': ('Code', 'Binary', 'Time-Varying', 'Yes')}
+    >>> dd.code_mappings = {'Chemotherapy': 7}
+    >>> dd.numeric_cols = ['wbc', 'relapse_presentation']
+    >>> dd.categorical_cols = {'relapse_presentation': '2'}
+    >>> router = dd.feature_router({'e_treatment___2': 'Chemotherapy'})
+    >>> router.route('e_treatment___2', 1)
+    ((1, 7, 'Chemotherapy', True), 1)
+    >>> router.route('relapse_presentation', 3)
+    ((2, 1, 'relapse_presentation', False), 3)
+    >>> router.route('relapse_presentation', 2)
+    ((3, 'relapse_presentation_2', 'relapse_presentation_2', False), 1)
+    """
+    DROP, CODE, NUMERIC, UNKNOWN, CATEGORICAL = range(5)
+
+    def __init__(self, datadict, recode_map=None):
+        self.datadict = datadict
+        self.recode_map = recode_map
+        self._recode = recode_map or dict()
+        self._drop_cols = set(datadict.drop_cols)
+        self._numeric_slots = dict()
+        for i, col in reversed(list(enumerate(datadict.numeric_cols))):
+            self._numeric_slots[col] = i
+        self.column_routes = dict()
+        self.level_routes = dict()
+        for col, n_levels in datadict.categorical_cols.items():
+            if n_levels:
+                self.column_routes[col] = (self.CATEGORICAL, None, col, False)
+        for col in list(self._recode) + list(datadict.code_cols) + datadict.numeric_cols + datadict.drop_cols:
+            if col not in self.column_routes:
+                self.column_routes[col] = self._compile(col)
+
+    def _compile(self, col):
+        if col in self._recode:
+            col = self._recode.get(col)
+        if col in self._drop_cols:
+            return self.DROP, None, col, False
+        direct_codekey = self.datadict.code_cols.get(col)
+        if direct_codekey:
+            return self.CODE, self.datadict.code_mappings.get(col), col, direct_codekey[1] == 'Binary'
+        if col in self._numeric_slots:
+            return self.NUMERIC, self._numeric_slots[col], col, False
+        return self.UNKNOWN, col, col, False
+
+    def is_feature(self, col):
+        """
+        return True if the raw column becomes a code or numeric feature,
+        a categorical column counts as a feature whatever its levels become
+        >>> dd = DataDictionary()
+        >>> dd.code_cols = {'Chemotherapy': ('Code', 'Binary', 'Time-Varying', 'Yes')}
+        >>> dd.drop_cols = ['uwid']
+        >>> router = dd.feature_router({'e_treatment___2': 'Chemotherapy'})
+        >>> router.is_feature('e_treatment___2'), router.is_feature('uwid'), router.is_feature('redcap_repeat_instance')
+        (True, False, False)
+        """
+        route = self.column_routes.get(col)
+        if route is None:
+            route = self.column_routes[col] = self._compile(col)
+        return route[0] in (self.CODE, self.NUMERIC, self.CATEGORICAL)
+
+    def route(self, col, val):
+        """
+        :param col: raw feature name
+        :param val: raw feature value
+        :return: the feature's route and its value (1 for a categorical level)
+        """
+        route = self.column_routes.get(col)
+        if route is None:
+            route = self.column_routes[col] = self._compile(col)
+        if route[0] != self.CATEGORICAL:
+            return route, val
+        level = self.level_routes.get((col, val))
+        if level is None:
+            cat_col, cat_val = self.datadict.is_categorical_var(col, val)
+            if cat_col:
+                level = self._compile(cat_col), cat_val
+            else:
+                level = self._compile(col), None
+            self.level_routes[(col, val)] = level
+        route, cat_val = level
+        return route, (val if cat_val is None else cat_val)
+
+
 if __name__ == '__main__':
     config = dict()
     cd = os.path.dirname(os.path.realpath(__file__))
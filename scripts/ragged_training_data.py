@@ -0,0 +1,181 @@
+"""
+store RETAIN training rows as flat, memory-mappable numpy arrays instead of a pickled
+dataframe of nested python lists
+"""
+import os
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class RaggedTrainingData():
+    """
+    Training rows as flat arrays with offsets into them
+
+    every training row is a run of visits, and every visit a run of codes:
+        pids, targets           -> one entry per row, pids of mixed types are stored as strings
+        pid_types               -> one entry per row, PID_INT for the pids to be read back as integers
+        row_offsets             -> visits of row i are row_offsets[i]:row_offsets[i + 1]
+        to_event, numerics      -> one entry (numerics: one line) per visit, missing numerics are NaN
+        code_offsets            -> codes of visit j are code_offsets[j]:code_offsets[j + 1]
+        codes                   -> missing codes are MISSING_CODE
+
+    layout:
+        <data_dir>/manifest.json -> {"rows": <n rows>, "visits": <n visits>, "codes": <n codes>}
+        <data_dir>/<array>.npy
+
+    >>> import tempfile
+    >>> rows = [{'PID': 1, 'numerics': [[None, 2.5]], 'codes': [[7, 3]], 'to_event': [4], 'target': 1},
+    ...         {'PID': 2, 'numerics': [[1, None], [None, None]], 'codes': [[], [None]], 'to_event': [1, 3], 'target': 0}]
+    >>> data_dir = tempfile.mkdtemp()
+    >>> RaggedTrainingData.from_rows(rows).write(data_dir)
+    >>> data = RaggedTrainingData.load(data_dir)
+    >>> isinstance(data.row(1)['numerics'], np.memmap)
+    True
+    >>> len(data), data.row(1)['to_event'].tolist(), [c.tolist() for c in data.row(1)['codes']]
+    (2, [1, 3], [[], [-1]])
+    >>> data.to_rows() == rows
+    True
+    """
+    MANIFEST_NAME = 'manifest.json'
+    ARRAYS = ('pids', 'pid_types', 'targets', 'row_offsets', 'to_event', 'numerics', 'code_offsets', 'codes')
+    MISSING_CODE = -1
+    PID_STR, PID_INT = 0, 1
+
+    def __init__(self, pids, pid_types, targets, row_offsets, to_event, numerics, code_offsets, codes):
+        self.pids = pids
+        self.pid_types = pid_types
+        self.targets = targets
+        self.row_offsets = row_offsets
+        self.to_event = to_event
+        self.numerics = numerics
+        self.code_offsets = code_offsets
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.pids)
+
+    @classmethod
+    def from_rows(cls, rows, n_numerics=None):
+        """
+        :param rows: iterable of training row dictionaries, as made by TrainingRowEvaluator
+        :param n_numerics: the number of numerics per visit, taken from the first visit if not given
+        """
+        pids, targets, row_lengths = [], [], []
+        to_event, numerics, code_lengths, codes = [], [], [], []
+        for row in rows:
+            pids.append(row['PID'])
+            targets.append(row['target'])
+            row_lengths.append(len(row['to_event']))
+            to_event.extend(row['to_event'])
+            numerics.extend(row['numerics'])
+            for visit_codes in row['codes']:
+                code_lengths.append(len(visit_codes))
+                codes.extend(visit_codes)
+        if n_numerics is None:
+            n_numerics = len(numerics[0]) if numerics else 0
+
+        pid_types = np.array([cls.PID_INT if isinstance(pid, (int, np.integer)) else cls.PID_STR for pid in pids],
+                             dtype=np.int8)
+        if len(pids) and (pid_types == cls.PID_INT).all():
+            pids = np.array(pids, dtype=np.int64)
+        else:
+            pids = np.array([str(pid) for pid in pids], dtype=str)
+        numerics = np.array(numerics, dtype=np.float64).reshape(len(to_event), n_numerics)
+        codes = np.array([cls.MISSING_CODE if c is None else c for c in codes], dtype=np.int64)
+        return cls(pids, pid_types, np.array(targets, dtype=np.int8), _offsets(row_lengths), np.array(to_event, dtype=np.int64),
+                   numerics, _offsets(code_lengths), codes)
+
+    @classmethod
+    def from_frame(cls, training_df):
+        return cls.from_rows(training_df.to_dict('records'))
+
+    def write(self, data_dir):
+        os.makedirs(data_dir, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(data_dir, "".join([name, '.npy'])), getattr(self, name), allow_pickle=False)
+        manifest = {'rows': len(self), 'visits': len(self.to_event), 'codes': len(self.codes)}
+        with open(os.path.join(data_dir, self.MANIFEST_NAME), 'w') as fout:
+            json.dump(manifest, fout, indent=1)
+        logger.info("wrote {r} ragged training rows to: {d}".format(r=len(self), d=data_dir))
+
+    @classmethod
+    def load(cls, data_dir, mmap_mode='r'):
+        """
+        :param mmap_mode: passed to np.load, the arrays are memory-mapped read only by default
+        """
+        return cls(*[np.load(os.path.join(data_dir, "".join([name, '.npy'])), mmap_mode=mmap_mode,
+                             allow_pickle=False) for name in cls.ARRAYS])
+
+    def row(self, i):
+        """
+        return training row i with its numerics, codes and to_event as views into the stored arrays
+        """
+        begin, end = self.row_offsets[i], self.row_offsets[i + 1]
+        code_offsets = self.code_offsets[begin:end + 1]
+        codes = [self.codes[code_offsets[j]:code_offsets[j + 1]] for j in range(end - begin)]
+        return {'PID': self._pid(self.pids[i].item(), self.pid_types[i]),
+                'numerics': self.numerics[begin:end],
+                'codes': codes,
+                'to_event': self.to_event[begin:end],
+                'target': self.targets[i].item()
+                }
+
+    def take(self, row_numbers):
+        """
+        return the given training rows as a dataframe of nested python lists, indexed by row number
+        """
+        rows = []
+        for i in row_numbers:
+            row = self.row(i)
+            rows.append({'PID': row['PID'],
+                         'numerics': [[None if v != v else v for v in visit] for visit in row['numerics'].tolist()],
+                         'codes': [[None if c == self.MISSING_CODE else c for c in codes.tolist()]
+                                   for codes in row['codes']],
+                         'to_event': row['to_event'].tolist(),
+                         'target': row['target']
+                         })
+        return pd.DataFrame(rows, index=row_numbers)
+
+    def to_rows(self):
+        """
+        return the training rows as nested python lists, as made by TrainingRowEvaluator
+        """
+        numerics = [[None if v != v else v for v in visit] for visit in self.numerics.tolist()]
+        flat_codes = [None if c == self.MISSING_CODE else c for c in self.codes.tolist()]
+        code_offsets = self.code_offsets.tolist()
+        codes = [flat_codes[code_offsets[j]:code_offsets[j + 1]] for j in range(len(code_offsets) - 1)]
+        to_event = self.to_event.tolist()
+        row_offsets = self.row_offsets.tolist()
+        rows = []
+        for i, (pid, pid_type, target) in enumerate(zip(self.pids.tolist(), self.pid_types.tolist(),
+                                                        self.targets.tolist())):
+            begin, end = row_offsets[i], row_offsets[i + 1]
+            rows.append({'PID': self._pid(pid, pid_type),
+                         'numerics': numerics[begin:end],
+                         'codes': codes[begin:end],
+                         'to_event': to_event[begin:end],
+                         'target': target
+                         })
+        return rows
+
+    def _pid(self, pid, pid_type):
+        """
+        return an integer pid stored among strings as the integer it was
+        """
+        if pid_type == self.PID_INT and isinstance(pid, str):
+            return int(pid)
+        return pid
+
+    def to_frame(self):
+        return pd.DataFrame(self.to_rows())
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
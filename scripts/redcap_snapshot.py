@@ -0,0 +1,135 @@
+"""
+store REDCap form exports on local disk in a columnar format so that
+timelines can be rebuilt without going back to the REDCap API
+"""
+import os
+import json
+import datetime as dt
+import hashlib
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class RedcapSnapshot():
+    """
+    A directory of per-form REDCap exports keyed by form name and project metadata hash
+
+    layout:
+        <snapshot_dir>/manifest.json             -> {"latest": <metadata hash>}
+        <snapshot_dir>/<metadata hash>/manifest.json -> {"forms": [<form>, ...], "last_pull": <iso datetime>}
+        <snapshot_dir>/<metadata hash>/<form>.parquet
+
+    >>> import tempfile
+    >>> snapshot = RedcapSnapshot(tempfile.mkdtemp())
+    >>> md_hash = RedcapSnapshot.metadata_hash([{'field_name': 'record_id', 'form_name': 'patient_id'}])
+    >>> snapshot.write_form(md_hash, 'patient_id', pd.DataFrame({'uwid': ['123']}, index=pd.Index([1], name='record_id')))
+    >>> snapshot.latest_hash() is None
+    True
+    >>> snapshot.set_last_pull(md_hash, dt.datetime(2019, 7, 11))
+    >>> snapshot.latest_hash() == md_hash
+    True
+    >>> [(form, df.index.name, list(df['uwid'])) for form, df in snapshot.replay_forms()]
+    [('patient_id', 'record_id', ['123'])]
+    """
+    MANIFEST_NAME = 'manifest.json'
+    FORM_EXTENSION = '.parquet'
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+
+    @staticmethod
+    def metadata_hash(metadata):
+        """
+        return a stable hash for the REDCap project metadata (the list of field dictionaries)
+        """
+        serialized = json.dumps(metadata, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def _hash_dir(self, metadata_hash):
+        return os.path.join(self.snapshot_dir, metadata_hash)
+
+    def _form_path(self, metadata_hash, form):
+        return os.path.join(self._hash_dir(metadata_hash), "".join([form, self.FORM_EXTENSION]))
+
+    def _read_manifest(self, path):
+        if not os.path.exists(path):
+            return dict()
+        with open(path, 'r') as fin:
+            return json.load(fin)
+
+    def _write_manifest(self, path, manifest):
+        tmp_path = "".join([path, '.tmp'])
+        with open(tmp_path, 'w') as fout:
+            json.dump(manifest, fout, indent=1)
+        os.replace(tmp_path, path)
+
+    def latest_hash(self):
+        return self._read_manifest(os.path.join(self.snapshot_dir, self.MANIFEST_NAME)).get('latest')
+
+    def forms(self, metadata_hash):
+        """
+        return the forms stored for a metadata hash, in the order they were exported
+        """
+        manifest_path = os.path.join(self._hash_dir(metadata_hash), self.MANIFEST_NAME)
+        return self._read_manifest(manifest_path).get('forms', [])
+
+    def last_pull(self, metadata_hash):
+        """
+        return the datetime the snapshot was last brought up to date with REDCap, or None
+        """
+        manifest_path = os.path.join(self._hash_dir(metadata_hash), self.MANIFEST_NAME)
+        last_pull = self._read_manifest(manifest_path).get('last_pull')
+        if last_pull is None:
+            return None
+        return dt.datetime.fromisoformat(last_pull)
+
+    def set_last_pull(self, metadata_hash, pull_date):
+        """
+        mark the snapshot as a completed pull of every form, and as the latest snapshot
+        """
+        manifest_path = os.path.join(self._hash_dir(metadata_hash), self.MANIFEST_NAME)
+        manifest = self._read_manifest(manifest_path)
+        manifest['last_pull'] = pull_date.isoformat()
+        self._write_manifest(manifest_path, manifest)
+        self._write_manifest(os.path.join(self.snapshot_dir, self.MANIFEST_NAME), {'latest': metadata_hash})
+
+    def has_form(self, metadata_hash, form):
+        return form in self.forms(metadata_hash) and os.path.exists(self._form_path(metadata_hash, form))
+
+    def write_form(self, metadata_hash, form, df):
+        """
+        store a single form export, the snapshot only becomes the latest once set_last_pull completes the pull
+        """
+        os.makedirs(self._hash_dir(metadata_hash), exist_ok=True)
+        df.to_parquet(self._form_path(metadata_hash, form))
+
+        manifest_path = os.path.join(self._hash_dir(metadata_hash), self.MANIFEST_NAME)
+        manifest = self._read_manifest(manifest_path)
+        forms = manifest.get('forms', [])
+        if form not in forms:
+            forms.append(form)
+        manifest['forms'] = forms
+        self._write_manifest(manifest_path, manifest)
+        logger.info("wrote REDCap snapshot for form: {f} to: {p}".format(f=form, p=self._form_path(metadata_hash, form)))
+
+    def read_form(self, metadata_hash, form):
+        return pd.read_parquet(self._form_path(metadata_hash, form))
+
+    def replay_forms(self, metadata_hash=None):
+        """
+        yield (form, dataframe) for every form stored in a snapshot, without touching REDCap
+        :param metadata_hash: the snapshot to replay, defaults to the most recently completed snapshot,
+                              a snapshot named here is replayed even when its pull was not completed
+        """
+        if metadata_hash is None:
+            metadata_hash = self.latest_hash()
+            if metadata_hash is None or self.last_pull(metadata_hash) is None:
+                raise ValueError("No completed REDCap snapshot found to replay in: {d}".format(d=self.snapshot_dir))
+        elif self.last_pull(metadata_hash) is None:
+            logger.warning("replaying REDCap snapshot: {h} without a completed pull".format(h=metadata_hash))
+        logger.info("replaying REDCap snapshot: {h} from: {d}".format(h=metadata_hash, d=self.snapshot_dir))
+        for form in self.forms(metadata_hash):
+            yield form, self.read_form(metadata_hash, form)
@@ -3,45 +3,139 @@ import logging
 import numpy as np
 import pandas as pd
 import os
+import pickle
+import datetime as dt
+import threading
+import time
 
 from sklearn.model_selection import GroupKFold
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from redcap import Project, RedcapError
 
-from classes import map_instrument_df_to_class
+from classes import map_instrument_df_to_class, instrument_fields
 from classes.collection.eventday import EventDay
 from classes.collection.patienttimeline import PatientTimeline
 from classes.evaluator.patienttimelineevaluator import PatientTimelineEvaluator
+from classes.evaluator.cohortevaluator import CohortArrays, CohortTimelineEvaluator, sweep_decision_parameters, \
+    sweep_summary
 from classes.evaluator.trainingrowevaluator import TrainingRowEvaluator
 
 import scripts.map_categorical_features as ddict
-from scripts import GATEWAY_FEATURE_RECODE_MAP, BUCKETS
+from scripts import GATEWAY_FEATURE_RECODE_MAP, BUCKETS, GATEWAY_COLUMNS, GATEWAY_ENCODED_COLUMNS, \
+    GATEWAY_DERIVED_FEATURES, GATEWAY_NA_VALUES, FEATURE_RECODE_MAP
+from scripts.redcap_snapshot import RedcapSnapshot
+from scripts.gateway_cache import GatewayCache
+from scripts.ragged_training_data import RaggedTrainingData
+from scripts.training_row_shards import TrainingRowShardWriter, TrainingRowShards
+from scripts.train_dev_test_splits import TrainDevTestSplits
+from scripts.control_matching import match_by_length, match_nearest_neighbours, covariate_frame
+from scripts.feature_recoding import compile_buckets, compile_recoders, MultiHotEncoder
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+GATEWAY_FORM = 'gateway_encounter'
+
 def pull_gateway_data(config):
     '''
     pull gateway data related to hematapoetic cell transplant
     from static csv
+
+    the prepared gateway data is cached under config['GATEWAY_CACHE']['CACHE_DIR'], if configured,
+    and read back while the csv and its preparation are unchanged
     '''
-    gateway_df = pd.read_csv(config['GATEWAY_DATA'])
+    columns = list(GATEWAY_COLUMNS)
+    data_dict = get_field_pushdown_dictionary(config)
+    if data_dict is not None:
+        columns = get_gateway_columns(data_dict)
+    cache_dir = config.get('GATEWAY_CACHE', {}).get('CACHE_DIR')
+    if not cache_dir:
+        return prepare_gateway_data(read_gateway_csv(config['GATEWAY_DATA'], columns))
+    cache = GatewayCache(cache_dir)
+    prepare_key = _gateway_prepare_key(columns)
+    gateway_df = cache.read(config['GATEWAY_DATA'], prepare_key)
+    if gateway_df is None:
+        gateway_df = prepare_gateway_data(read_gateway_csv(config['GATEWAY_DATA'], columns))
+        cache.write(config['GATEWAY_DATA'], prepare_key, gateway_df)
+    return gateway_df
+
+def _gateway_prepare_key(columns):
+    """
+    return a hash of the settings pull_gateway_data prepares the gateway csv with
+    """
+    return RedcapSnapshot.metadata_hash([columns, GATEWAY_COLUMNS, GATEWAY_FEATURE_RECODE_MAP, BUCKETS])
+
+def get_field_pushdown_dictionary(config):
+    """
+    return the DataDictionary that decides which REDCap fields and gateway columns are read,
+    or None to read them all when config['FIELD_PUSHDOWN'] is not set
+    """
+    if not config.get('FIELD_PUSHDOWN'):
+        return None
+    return _load_data_dictionary(config["DATA_DICTIONARY"])
+
+def get_gateway_columns(data_dict):
+    """
+    return the GATEWAY_COLUMNS needed by the gateway encounters, by BUCKETS, or by a code or numeric feature
+    of the data dictionary, whether the feature is the column itself or is prepared from it
+    """
+    router = data_dict.feature_router(FEATURE_RECODE_MAP)
+    features = [f for f in list(data_dict.code_cols) + data_dict.numeric_cols if router.is_feature(f)]
+    needed = instrument_fields(GATEWAY_FORM) | set(BUCKETS)
+    needed.update(col for feature, cols in GATEWAY_DERIVED_FEATURES.items() if router.is_feature(feature) for col in cols)
+    needed.update(col for col in GATEWAY_ENCODED_COLUMNS
+                  if any(f.startswith("".join([col, '_'])) for f in features))
+    return [col for col in GATEWAY_COLUMNS if col in needed or router.is_feature(col)]
+
+def _csv_engine():
+    try:
+        import pyarrow
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+def read_gateway_csv(path, columns=None):
+    """
+    read the GATEWAY_COLUMNS of the gateway csv, with their dtypes, with the multithreaded pyarrow csv reader if
+    it is installed
+    :param columns: optional subset of the GATEWAY_COLUMNS to read
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in GATEWAY_COLUMNS and (columns is None or c in columns)]
+    dtypes = {c: GATEWAY_COLUMNS[c] for c in usecols if GATEWAY_COLUMNS[c] is not None}
+    engine = _csv_engine()
+    gateway_df = pd.read_csv(path, usecols=usecols, dtype=dtypes, engine=engine, na_values=GATEWAY_NA_VALUES,
+                             keep_default_na=False)
+    if engine == 'pyarrow':
+        # the pyarrow reader only applies na_values to non string columns, it keeps the NA strings of str columns
+        for col in [c for c, d in dtypes.items() if d == 'str']:
+            gateway_df[col] = gateway_df[col].mask(gateway_df[col].isin(GATEWAY_NA_VALUES))
+    return gateway_df[usecols]
+
+def prepare_gateway_data(gateway_df):
+    """
+    recode, bucket and one-hot encode the gateway columns read by read_gateway_csv
+    """
     # recode uwid - maintain as string to match redcap pt id
     gateway_df['uwid'] = gateway_df['uwid'].map(lambda x: x.lstrip('U'))
     # define female_donor_male_recipient
-    gateway_df['female_donor_male_recipient'] = gateway_df.eval("donsex == 'Female' and sex == 'Male'").astype(int)
+    # columns left out by get_gateway_columns are not prepared
+    if {'sex', 'donsex'} <= set(gateway_df.columns):
+        gateway_df['female_donor_male_recipient'] = gateway_df.eval("donsex == 'Female' and sex == 'Male'").astype(int)
     # recode features
     gateway_df = recode_features(gateway_df, GATEWAY_FEATURE_RECODE_MAP)
     gateway_df = bucket_features(gateway_df, BUCKETS)
-    gateway_df = pd.get_dummies(gateway_df,prefix=['cmvx','hla_cco','tbidose','celltxl'], \
-                                columns = ['cmvx','hla_cco','tbidose','celltxl'])
-    # one-hot encode proplbl
-    proplbl = gateway_df.proplbl.str.strip().str.split(r'\s*,\s*', expand=True).apply(pd.Series.value_counts, 1).fillna(0, downcast='infer').add_prefix('proplbl_')
-    gateway_df = pd.concat([gateway_df.drop(['proplbl'], axis=1), proplbl], axis=1, sort=False)
-    gateway_df = gateway_df.drop(columns = ['upn','txdatex', 'prexlbl', 'agvhday', 'tx',\
-                                            'don_drm', 'don_mat','birthdat','agvhdat',\
-                                            'agvhgrd','agvhskn','agvhlvr','agvhgut', \
-                                            'don1sex', 'don2sex', 'sex', 'donsex'])
+    dummies = [c for c in ['cmvx','hla_cco','tbidose','celltxl'] if c in gateway_df.columns]
+    gateway_df = pd.get_dummies(gateway_df, prefix=dummies, columns=dummies)
+    if 'proplbl' in gateway_df.columns:
+        # multi-hot encode proplbl, one column for every recoded proplbl whether or not the extract has it
+        proplbl = MultiHotEncoder(GATEWAY_FEATURE_RECODE_MAP['proplbl'].values()).encode(gateway_df.proplbl, prefix='proplbl_')
+        gateway_df = pd.concat([gateway_df.drop(['proplbl'], axis=1), proplbl], axis=1, sort=False)
+    # the other columns of the csv ('upn', 'txdatex', 'prexlbl', 'agvhday', 'tx', 'don_drm', 'don_mat', 'birthdat',
+    # 'agvhdat', 'agvhgrd', 'agvhskn', 'agvhlvr', 'agvhgut', 'don1sex', 'don2sex') are not read
+    gateway_df = gateway_df.drop(columns = [c for c in ['sex', 'donsex'] if c in gateway_df.columns])
     return gateway_df
 
 def get_values(elements, lookups):
@@ -68,11 +162,15 @@ def recode_features(df, lookups):
     :param df: pandas dataframe
     :param lookups: dictionary
     :return: None.
+    values are recoded as get_values would recode them, once per distinct value, see feature_recoding.ValueRecoder
     """
     # columns to recode
-    cols = list(lookups.keys())
+    cols = [c for c in lookups.keys() if c in df.columns]
+    recoders = compile_recoders(lookups)
     for col in cols:
-        df[col] = df[col].apply(lambda x: get_values(x, lookups[col]))
+        # an empty column keeps its dtype, as it would with Series.apply
+        if len(df):
+            df[col] = recoders[col].recode(df[col])
     return df
 
 def bucket_features(df, lookups):
@@ -81,59 +179,415 @@ def bucket_features(df, lookups):
     :param df: pandas dataframe
     :param lookups: dictionary
     :return: pandas dataframe
+    buckets are half-open intervals, values outside of every bucket become NaN, see feature_recoding.IntervalBins
     """   
     # numeric columns to bucket as categorical
     cols = set(lookups.keys()).intersection(set(df.columns))
-    def bucketing_function(value, col):
-        return np.nanmax(np.array([k if value >= v[0] and value < v[1] else None for k,v in \
-                        lookups[col].items()], dtype=np.float64))
+    bins = compile_buckets(lookups)
     for col in cols:
-        df[col] = df[col].apply(lambda x: bucketing_function(x,col))
+        df[col] = bins[col].bucket(df[col].to_numpy())
     return df
 
-def pull_from_red_cap(config):
+def get_redcap_snapshot(config):
     """
-    pull data from the Relapse REDCap project, load into dataframe
-    *for now* output file to temporary csv
+    return the RedcapSnapshot configured under config['REDCAP_SNAPSHOT'], or None if snapshots are disabled
     """
+    snapshot_dir = config.get('REDCAP_SNAPSHOT', {}).get('SNAPSHOT_DIR')
+    if not snapshot_dir:
+        return None
+    return RedcapSnapshot(snapshot_dir)
+
+def export_red_cap_forms(config, replay=False):
+    """
+    yield (form, dataframe) for every REDCap form, followed by the gateway data after the 'patient_id' form
+    exports are written to the configured snapshot as they are pulled
+    :param replay: if True, read every form back from the latest snapshot instead of REDCap
+    """
+    snapshot = get_redcap_snapshot(config)
+    if replay:
+        if snapshot is None:
+            raise ValueError("Replay requested but no REDCAP_SNAPSHOT.SNAPSHOT_DIR is configured")
+        yield from snapshot.replay_forms(config['REDCAP_SNAPSHOT'].get('METADATA_HASH'))
+        return
+
     URL = config["RED_CAP_ENGINE"]["URL"]
     API_KEY = config["RED_CAP_ENGINE"]["API"]
     project = Project(URL, API_KEY)
-    patient_eds = defaultdict(dict)
+    metadata_hash, form_fields = _export_fields_and_hash(config, project)
+
+    export_params = config.get('REDCAP_EXPORT', {})
+    workers = export_params.get('WORKERS', 1)
+    in_flight = threading.BoundedSemaphore(export_params.get('MAX_IN_FLIGHT', workers))
+    retries = export_params.get('RETRIES', 0)
+    backoff = export_params.get('BACKOFF_SECONDS', 1)
+
+    pull_started = dt.datetime.now()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='redcap_export')
+    try:
+        # submit every form up front; results are consumed in form order so downstream processing
+        # of one form overlaps with the download of the forms after it
+        futures = [(form, executor.submit(export_form_with_retry, project, form, retries, backoff, in_flight,
+                                          fields=form_fields.get(form)))
+                   for form in project.forms]
+        failed_forms = []
+        for form, future in futures:
+            try:
+                form_df = future.result()
+            except RedcapError:
+                logger.warning("Failure to export records from REDCap for form: {}".format(form))
+                failed_forms.append(form)
+                continue
+            if snapshot is not None:
+                snapshot.write_form(metadata_hash, form, form_df)
+            yield form, form_df
+            if form == 'patient_id':
+                gateway_df = pull_gateway_data(config)
+                if snapshot is not None:
+                    snapshot.write_form(metadata_hash, GATEWAY_FORM, gateway_df)
+                yield GATEWAY_FORM, gateway_df
+        if snapshot is not None and failed_forms:
+            # the snapshot misses these forms, or has them from an earlier pull, so it is not a complete pull
+            # and the next incremental pull falls back to a full pull
+            logger.warning("REDCap snapshot: {h} not marked as a completed pull, failed forms: {f}".format(
+                h=metadata_hash, f=failed_forms))
+        elif snapshot is not None:
+            snapshot.set_last_pull(metadata_hash, pull_started)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def export_red_cap_delta(config):
+    """
+    bring the REDCap snapshot up to date with the records modified since the last pull
+    only the modified records are exported, and they replace those records' rows in each snapshot form
+    NOTE: records deleted from REDCap are not reported by a date range export, a full pull is needed to drop them
+    :return: tuple of (list of (form, dataframe) for the whole refreshed snapshot, set of modified patient ids as str)
+             or (None, None) if there is no snapshot of the current project metadata to update
+    """
+    snapshot = get_redcap_snapshot(config)
+    if snapshot is None:
+        logger.info("No REDCAP_SNAPSHOT configured, an incremental pull is not possible")
+        return None, None
+
+    URL = config["RED_CAP_ENGINE"]["URL"]
+    API_KEY = config["RED_CAP_ENGINE"]["API"]
+    project = Project(URL, API_KEY)
+    metadata_hash, form_fields = _export_fields_and_hash(config, project)
+    last_pull = snapshot.last_pull(metadata_hash)
+    if last_pull is None:
+        logger.info("No complete REDCap snapshot for project metadata: {h}".format(h=metadata_hash))
+        return None, None
+
+    export_params = config.get('REDCAP_EXPORT', {})
+    retries = export_params.get('RETRIES', 0)
+    backoff = export_params.get('BACKOFF_SECONDS', 1)
+
+    pull_started = dt.datetime.now()
+    modified_df = _export_or_empty(project, fields=[project.def_field], date_begin=last_pull, format='df')
+    dirty_patients = set(_get_record_ids(modified_df))
+    logger.info("{n} patients modified in REDCap since {d}".format(n=len(dirty_patients), d=last_pull))
+
+    forms = []
+    for form in snapshot.forms(metadata_hash):
+        form_df = snapshot.read_form(metadata_hash, form)
+        if dirty_patients and form != GATEWAY_FORM:
+            delta_df = export_form_with_retry(project, form, retries, backoff, records=sorted(dirty_patients),
+                                              fields=form_fields.get(form))
+            form_df = form_df.loc[~_get_record_ids(form_df).isin(dirty_patients)]
+            if not delta_df.empty:
+                form_df = pd.concat([form_df, delta_df])
+            snapshot.write_form(metadata_hash, form, form_df)
+        forms.append((form, form_df))
+    snapshot.set_last_pull(metadata_hash, pull_started)
+
+    return forms, dirty_patients
+
+def _export_fields_and_hash(config, project):
+    """
+    return the metadata hash the snapshot of the export is kept under, and {form: fields} to export
+    ({} to export whole forms), the fields of a FIELD_PUSHDOWN export are part of the hash
+    """
+    data_dict = get_field_pushdown_dictionary(config)
+    if data_dict is None:
+        return RedcapSnapshot.metadata_hash(project.metadata), dict()
+    form_fields = get_export_fields(project, data_dict)
+    return RedcapSnapshot.metadata_hash([project.metadata, form_fields]), form_fields
 
+def get_export_fields(project, data_dict):
+    """
+    return {form: fields} of the REDCap fields needed by the encounter factories, by BUCKETS, or by a code or
+    numeric feature of the data dictionary, plus the record id field which keys every form
+    a field is needed when any of its exported columns is (checkbox fields export as '<field>___<code>')
+    :param project: a redcap Project
+    :param data_dict: a DataDictionary
+    """
+    router = data_dict.feature_router(FEATURE_RECODE_MAP)
+    export_columns = defaultdict(list)
+    for names in project.export_field_names():
+        export_columns[names['original_field_name']].append(names['export_field_name'])
+    form_fields = defaultdict(list)
+    for field in project.metadata:
+        form, name = field['form_name'], field['field_name']
+        needed = instrument_fields(form) | set(BUCKETS)
+        if name == project.def_field or any(c in needed or router.is_feature(c)
+                                            for c in export_columns.get(name, [name])):
+            form_fields[form].append(name)
     for form in project.forms:
+        logger.info("exporting {n} fields of form: {f}".format(n=len(form_fields[form]), f=form))
+    return dict(form_fields)
+
+def _export_or_empty(project, **export_kwargs):
+    """
+    REDCap answers an export that matches no records with an empty body, which cannot be parsed as a dataframe
+    """
+    try:
+        return project.export_records(**export_kwargs)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+def _get_record_ids(df):
+    """
+    return the REDCap record id of each row of an exported form as a string Index
+    """
+    return df.index.get_level_values(0).astype(str)
+
+def export_form_with_retry(project, form, retries=0, backoff=1, in_flight=None, fields=None, **export_kwargs):
+    """
+    export a single form from REDCap, retrying with exponential backoff on RedcapError
+    :param project: a redcap Project
+    :param retries: number of additional attempts after the first failure
+    :param backoff: seconds to wait before the first retry, doubled on each following retry
+    :param in_flight: optional semaphore capping the number of concurrent REDCap requests
+    :param fields: optional list of the form's fields to export instead of the whole form
+    :param export_kwargs: additional arguments for Project.export_records, e.g. records
+    :return: dataframe of the form's records, raises RedcapError once all attempts have failed
+    """
+    # REDCap exports the union of forms and fields, so a field export names the fields only
+    export_kwargs.update({'fields': list(fields)} if fields else {'forms': [form]})
+    for attempt in range(retries + 1):
         try:
-            intermediate_df = bucket_features(project.export_records(forms=[form], format='df'), BUCKETS)
-        except RedcapError:
-            logger.warning("Failure to export records from REDCap for form: {}".format(form))
-            continue        
-        events = map_instrument_df_to_class(form, intermediate_df)
+            if in_flight is None:
+                return _export_or_empty(project, format='df', **export_kwargs)
+            with in_flight:
+                return _export_or_empty(project, format='df', **export_kwargs)
+        except RedcapError as e:
+            if attempt == retries:
+                raise
+            wait = backoff * (2 ** attempt)
+            logger.info("Retrying REDCap export for form: {f} in {w}s after error: {e}".format(f=form, w=wait, e=e))
+            time.sleep(wait)
+
+def pull_from_red_cap(config, replay=False):
+    """
+    pull data from the Relapse REDCap project, load into dataframe
+    *for now* output file to temporary csv
+    :param replay: if True, rebuild timelines from the REDCap snapshot without network access
+    """
+    patient_eds = build_patient_eventdays(export_red_cap_forms(config, replay=replay))
+    timelines = evaluate_patient_timelines(patient_eds, config)
+    write_timeline_cache(timelines, config)
+    log_decision_point_summary(timelines)
+
+    return timelines
+
+def sweep_from_red_cap(config, grid, replay=False):
+    """
+    evaluate many DECISION_PARAMETERS settings against a single pull of the Relapse REDCap project
+    the summary of every setting is written to <OUTPUT_FILEPATH>/decision_parameter_sweep.csv
+    :param grid: a list of DECISION_PARAMETERS dicts, or a dict of DECISION_PARAMETERS key -> list of values
+    :param replay: if True, rebuild timelines from the REDCap snapshot without network access
+    :return: list of (DECISION_PARAMETERS dict, CohortDecisionPoints), in grid order
+    """
+    patient_eds = build_patient_eventdays(export_red_cap_forms(config, replay=replay))
+    timelines = {patientid: PatientTimeline(patientid, list(event_days.values()))
+                 for patientid, event_days in patient_eds.items()}
+    results = sweep_decision_parameters(CohortArrays.from_timelines(timelines), grid)
+
+    summary_df = sweep_summary(results)
+    output_path = os.path.join(config['OUTPUT_FILEPATH'], "decision_parameter_sweep.csv")
+    summary_df.to_csv(output_path, index=False)
+    logger.info("wrote decision parameter sweep of {n} settings to: {o}".format(n=len(results), o=output_path))
+
+    return results
+
+def pull_incremental_from_red_cap(config):
+    """
+    refresh only the patients modified in REDCap since the last pull
+    event days, timelines and decision points are rebuilt for the modified patients only,
+    every other patient's timeline is taken from the timeline cache of the previous run
+    falls back to a full pull when there is no snapshot or timeline cache to update
+    :return: tuple of (timelines, set of modified patient ids as str, or None after a full pull)
+    """
+    cached_timelines = read_timeline_cache(config)
+    forms, dirty_patients = (None, None)
+    if cached_timelines is not None:
+        forms, dirty_patients = export_red_cap_delta(config)
+    if forms is None:
+        logger.info("Incremental pull not possible, falling back to a full pull from REDCap")
+        return pull_from_red_cap(config), None
+
+    patient_eds = build_patient_eventdays(forms, patient_filter=dirty_patients)
+    dirty_timelines = evaluate_patient_timelines(patient_eds, config)
+
+    timelines = {pid: t for pid, t in cached_timelines.items()
+                 if str(pid) not in dirty_patients or pid in dirty_timelines}
+    timelines.update(dirty_timelines)
+    logger.info("Recomputed {n} of {t} patient timelines".format(n=len(dirty_timelines), t=len(timelines)))
+    write_timeline_cache(timelines, config)
+    log_decision_point_summary(timelines)
+
+    return timelines, dirty_patients
+
+def build_patient_eventdays(forms, patient_filter=None):
+    """
+    map every form's records to encounters and collect them into EventDays
+    :param forms: iterable of (form, dataframe) as produced by export_red_cap_forms
+    :param patient_filter: optional set of patient ids (as str), only these patients are mapped
+    :return: dict of patientid -> dict of date -> EventDay
+    """
+    patient_eds = defaultdict(dict)
+    redcap_patients = None
+
+    for form, form_df in forms:
+        if patient_filter is not None:
+            if form == GATEWAY_FORM:
+                form_df = form_df.loc[form_df['uwid'].astype(str).isin(patient_filter)]
+            else:
+                form_df = form_df.loc[_get_record_ids(form_df).isin(patient_filter)]
         if form == 'patient_id':
-            gateway_df = pull_gateway_data(config)
-            events += map_instrument_df_to_class('gateway_encounter', gateway_df)
+            redcap_patients = set(form_df['uwid'].astype(str))
+        if form == GATEWAY_FORM:
+            if redcap_patients is None:
+                logger.warning("gateway data read before the 'patient_id' form, it is not restricted to REDCap patients")
+            else:
+                form_df, _ = restrict_to_redcap_patients(form_df, redcap_patients)
+            # gateway data is bucketed while it is prepared in pull_gateway_data
+            events = map_instrument_df_to_class(form, form_df)
+        else:
+            events = map_instrument_df_to_class(form, bucket_features(form_df, BUCKETS))
         for event in events:
             if event.date not in patient_eds[event.patientid].keys():
                 patient_eds[event.patientid][event.date] = EventDay(event.patientid, event.date, event)
             else:
                 patient_eds[event.patientid][event.date].add_event(event)
+
+    return patient_eds
+
+def restrict_to_redcap_patients(gateway_df, redcap_patients):
+    """
+    semi-join the gateway rows to the patients of the REDCap project, before any encounters are made for them
+    :param redcap_patients: set of the uwid (as str) of every patient in the REDCap 'patient_id' form
+    :return: tuple of (gateway rows of REDCap patients, number of gateway rows dropped)
+    >>> gateway_df = pd.DataFrame({'uwid': ['1', '2', '3', '2'], 'txage': [0, 1, 2, 3]})
+    >>> gateway_df, n_dropped = restrict_to_redcap_patients(gateway_df, {'2', '4'})
+    >>> list(gateway_df.index), n_dropped
+    ([1, 3], 2)
+    """
+    is_redcap_patient = gateway_df['uwid'].astype(str).isin(redcap_patients)
+    n_dropped = int((~is_redcap_patient).sum())
+    if n_dropped:
+        logger.info("dropped {n} gateway rows of {p} patients not in the REDCap project".format(
+            n=n_dropped, p=gateway_df.loc[~is_redcap_patient, 'uwid'].nunique()))
+    return gateway_df.loc[is_redcap_patient], n_dropped
+
+def _get_parallel_settings(config):
+    """
+    return (workers, chunksize) for evaluating patients in a process pool, workers <= 1 means evaluate serially
+    """
+    parallel = config.get('PARALLEL_EVALUATION', {})
+    workers = parallel.get('WORKERS', 1)
+    if not workers:
+        workers = os.cpu_count() or 1
+    return workers, max(1, parallel.get('CHUNKSIZE', 1))
+
+def _map_patients(func, items, config, initializer, initargs):
+    """
+    apply func to every item, in a process pool when PARALLEL_EVALUATION has more than one worker
+    the results are yielded in the order of items whatever the number of workers
+
+    every worker process runs initializer(*initargs) once, so state such as evaluators is per process
+    at most two chunks per worker are submitted ahead of the results yielded, so items are read and results
+    are held a window at a time rather than for the whole cohort
+    """
+    workers, chunksize = _get_parallel_settings(config)
+    if workers <= 1:
+        initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+    logger.info("evaluating patients with {w} worker processes in chunks of {c}".format(w=workers, c=chunksize))
+    items = iter(items)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(items, chunksize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_map_chunk, func, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+def _map_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+# per process state of the patient evaluation workers, set by the _init_* functions
+_WORKER_STATE = dict()
+
+def _init_timeline_worker(evaluation_params):
+    _WORKER_STATE['timeline_evaluator'] = PatientTimelineEvaluator(
+        induction_timewindow=evaluation_params["INDUCTION_WINDOW"],
+        mrd_timewindow=evaluation_params["MRD_WINDOW"],
+        consolidation_timewindow=evaluation_params["CONSOLIDATION_WINDOW"],
+        dpoint_eval_window=evaluation_params["DECISION_POINT_EVAL_WINDOW"],
+        dpoint_positive_labels=evaluation_params["DECISION_POINT_REASONS"])
+
+def _evaluate_patient_timeline(patient):
+    patientid, event_days = patient
+    timeline = PatientTimeline(patientid, event_days)
+    timeline.decision_points = _WORKER_STATE['timeline_evaluator'].evaluate(timeline)
+    return timeline
+
+def _evaluate_cohort_timelines(patient_eds, evaluation_params):
+    timelines = {patientid: PatientTimeline(patientid, list(event_days.values()))
+                 for patientid, event_days in patient_eds.items()}
+    evaluator = CohortTimelineEvaluator(induction_timewindow=evaluation_params["INDUCTION_WINDOW"],
+                                        mrd_timewindow=evaluation_params["MRD_WINDOW"],
+                                        consolidation_timewindow=evaluation_params["CONSOLIDATION_WINDOW"],
+                                        dpoint_eval_window=evaluation_params["DECISION_POINT_EVAL_WINDOW"],
+                                        dpoint_positive_labels=evaluation_params["DECISION_POINT_REASONS"])
+    for patientid, decision_pts in evaluator.evaluate_timelines(timelines).items():
+        timelines[patientid].decision_points = decision_pts
+    return timelines
+
+def evaluate_patient_timelines(patient_eds, config):
+    """
+    build a PatientTimeline for every patient and assign its labelled decision points
+    patients are evaluated in a process pool when config['PARALLEL_EVALUATION']['WORKERS'] is more than 1,
+    or all at once by the vectorized CohortTimelineEvaluator when config['EVALUATION_ENGINE'] is 'cohort'
+    :param patient_eds: dict of patientid -> dict of date -> EventDay
+    :return: dict of patientid -> PatientTimeline, in the order of patient_eds
+    """
     evaluation_params = config["DECISION_PARAMETERS"]
-    evaluator = PatientTimelineEvaluator(induction_timewindow=evaluation_params["INDUCTION_WINDOW"],
-                                         mrd_timewindow=evaluation_params["MRD_WINDOW"],
-                                         consolidation_timewindow=evaluation_params["CONSOLIDATION_WINDOW"],
-                                         dpoint_eval_window=evaluation_params["DECISION_POINT_EVAL_WINDOW"],
-                                         dpoint_positive_labels=evaluation_params["DECISION_POINT_REASONS"])
-    timelines = dict()
+    if config.get('EVALUATION_ENGINE', 'timeline') == 'cohort':
+        timelines = _evaluate_cohort_timelines(patient_eds, evaluation_params)
+    else:
+        patients = [(patientid, list(event_days.values())) for patientid, event_days in patient_eds.items()]
+        timelines = {timeline.patientid: timeline for timeline in _map_patients(
+            _evaluate_patient_timeline, patients, config, _init_timeline_worker, (evaluation_params,))}
+    for patientid, timeline in timelines.items():
+        logger.info("number of decision points for patient {} on timeline: {}".format(patientid, len(timeline.decision_points)))
+        logger.info("decision points for patient {} timeline: {}".format(patientid, timeline.decision_points))
+
+    return timelines
+
+def log_decision_point_summary(timelines):
     sum_dps = 0
     dp_type = dict()
     dp_label = dict()
-    for patientid, event_days in patient_eds.items():
-        timelines[patientid] = PatientTimeline(patientid, list(event_days.values()))
-        decision_pts = evaluator.evaluate(timelines[patientid])
-        logger.info("number of decision points for patient {} on timeline: {}".format(patientid, len(decision_pts)))
-        timelines[patientid].decision_points = decision_pts
-        logger.info("decision points for patient {} timeline: {}".format(patientid, timelines[patientid].decision_points))
-        sum_dps += len(timelines[patientid].decision_points)
-        for dp in decision_pts:
+    for timeline in timelines.values():
+        sum_dps += len(timeline.decision_points)
+        for dp in timeline.decision_points:
             dp_type[dp.label_cause] = dp_type.get(dp.label_cause, 0) + 1
             dp_label[dp.label] = dp_label.get(dp.label, 0) + 1
 
@@ -153,51 +607,195 @@ def pull_from_red_cap(config):
     logger.info("Breakdown of Decision Point Reasons: {}".format(dp_type))
     logger.info("Breakdown of Decision Point Labels: {}".format(dp_label))
 
-    return timelines
-
-def evaluate_timelines_for_trainingrows(timelines, config):
-    data_dict_pkl_path = os.path.realpath(config["DATA_DICTIONARY"]["data_dict"])
-    data_dict_csv_path = os.path.realpath(config["DATA_DICTIONARY"]["data_dict_csv"])
-    categorical_feature_path = os.path.realpath(config["DATA_DICTIONARY"]["categorical_feature"])
+def _read_cache(config, key):
+    cache_path = config.get('INCREMENTAL_CACHE', {}).get(key)
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    with open(cache_path, 'rb') as fin:
+        return pickle.load(fin)
+
+def _write_cache(config, key, obj):
+    cache_path = config.get('INCREMENTAL_CACHE', {}).get(key)
+    if not cache_path:
+        return
+    with open(cache_path, 'wb') as fout:
+        pickle.dump(obj, fout)
+    logger.info("wrote {k} cache to: {p}".format(k=key, p=cache_path))
+
+def read_timeline_cache(config):
+    return _read_cache(config, 'TIMELINES')
+
+def write_timeline_cache(timelines, config):
+    _write_cache(config, 'TIMELINES', timelines)
+
+def _load_data_dictionary(data_dictionary_config):
+    data_dict_pkl_path = os.path.realpath(data_dictionary_config["data_dict"])
+    data_dict_csv_path = os.path.realpath(data_dictionary_config["data_dict_csv"])
+    categorical_feature_path = os.path.realpath(data_dictionary_config["categorical_feature"])
     data_dict = ddict.DataDictionary(data_dict_csv_path, data_dict_pkl_path, categorical_feature_path)
     data_dict.load_data_dict()
     data_dict.load_categorical_dict()
-    training_translator = TrainingRowEvaluator()
+    return data_dict
+
+def _init_training_row_worker(data_dictionary_config):
+    _WORKER_STATE['data_dict'] = _load_data_dictionary(data_dictionary_config)
+    _WORKER_STATE['training_translator'] = TrainingRowEvaluator()
+
+def _translate_patient_timeline(patient):
+    """
+    return (pid, training rows, None), or (pid, None, error) if the timeline could not be translated
+    """
+    pid, timeline = patient
+    try:
+        return pid, _WORKER_STATE['training_translator'].evaluate_timeline_for_training_rows(
+            timeline, _WORKER_STATE['data_dict']), None
+    except AttributeError as e:
+        return pid, None, e
+
+def generate_training_rows(timelines, config, cached_rows=None, dirty_patients=None):
+    """
+    yield (pid, training rows) for every timeline, in the order of timelines
+    the rows are None for a timeline that could not be translated
+    :param cached_rows: optional {pid: training rows} to reuse for patients that are not in dirty_patients
+    """
+    cached_rows = cached_rows or dict()
+    dirty_patients = dirty_patients or set()
+    to_translate = [(pid, timeline) for pid, timeline in timelines.items()
+                    if not (pid in cached_rows and str(pid) not in dirty_patients)]
+    translated = _map_patients(_translate_patient_timeline, to_translate, config,
+                               _init_training_row_worker, (config["DATA_DICTIONARY"],))
+    for pid in timelines.keys():
+        if pid in cached_rows and str(pid) not in dirty_patients:
+            yield pid, cached_rows[pid]
+            continue
+        translated_pid, pid_train_rows, err = next(translated)
+        if err is not None:
+            msg = "Alert! An Error occurred while translating Patient Id: {id} Timeline: {err}".format(id=pid, err=err)
+            logger.warning(msg)
+        yield pid, pid_train_rows
+
+def evaluate_timelines_for_trainingrows(timelines, config, dirty_patients=None):
+    """
+    create the RETAIN training rows for every timeline and write them to a pickled dataframe
+    timelines are translated in a process pool when config['PARALLEL_EVALUATION']['WORKERS'] is more than 1
+
+    when config['TRAINING_ROW_SHARDS']['STREAMING'] is set the rows are streamed to shards instead,
+    see stream_timelines_to_training_shards, and None is returned
+    :param dirty_patients: optional set of patient ids (as str) modified since the last run;
+                           if given, every other patient's rows are taken from the training row cache
+    """
+    if _is_streaming(config):
+        stream_timelines_to_training_shards(timelines, config)
+        return None
+
+    cached_rows = dict()
+    if dirty_patients is not None:
+        cached_rows = _read_cache(config, 'TRAINING_ROWS') or dict()
 
     all_rows = []
+    patient_rows = dict()
     attr_errs = 0
-    for pid, timeline in timelines.items():
-        try:
-            pid_train_rows = training_translator.evaluate_timeline_for_training_rows(timeline, data_dict)
-            all_rows.extend(pid_train_rows)
-        except AttributeError as e:
-            msg = "Alert! An Error occurred while translating Patient Id: {id} Timeline: {err}".format(id=pid, err=e)
-            logger.warning(msg)
+    for pid, pid_train_rows in generate_training_rows(timelines, config, cached_rows, dirty_patients):
+        # None marks a timeline that could not be translated, so cached failures are still counted
+        patient_rows[pid] = pid_train_rows
+        if pid_train_rows is None:
             attr_errs += 1
+        else:
+            all_rows.extend(pid_train_rows)
+    _write_cache(config, 'TRAINING_ROWS', patient_rows)
 
     logger.info("{num} Training rows created from timelines.".format(num=len(all_rows)))
     logger.info("{num} Timelines had no training rows.".format(num=attr_errs))
 
     training_df = pd.DataFrame(all_rows)
-    output_path = os.path.sep.join([config['OUTPUT_FILEPATH'], "".join([config['TRAINING_DATAFRAME_NAME'], ".pkl"])])
-    training_df.to_pickle(path=output_path)
+    output_path = get_training_data_path(config)
+    if _is_ragged_format(config):
+        RaggedTrainingData.from_rows(all_rows).write(output_path)
+    else:
+        training_df.to_pickle(path=output_path)
     logger.info("wrote training dataframe to output path: {o}".format(o=output_path))
 
     return training_df
 
+def _is_streaming(config):
+    return config.get('TRAINING_ROW_SHARDS', {}).get('STREAMING', False)
+
+def get_training_shard_dir(config):
+    return os.path.join(config['OUTPUT_FILEPATH'], "".join([config['TRAINING_DATAFRAME_NAME'], "_shards"]))
+
+def stream_timelines_to_training_shards(timelines, config):
+    """
+    translate every timeline and write its training rows straight to pickled shards of at most
+    config['TRAINING_ROW_SHARDS']['MAX_VISITS_PER_SHARD'] visits, so only one shard of rows is held in memory
+
+    the training row cache is neither read nor written, every timeline is translated
+    :return: the shard manifest
+    """
+    shard_dir = get_training_shard_dir(config)
+    max_visits = config['TRAINING_ROW_SHARDS'].get('MAX_VISITS_PER_SHARD', 100000)
+    attr_errs = 0
+    with TrainingRowShardWriter(shard_dir, max_visits=max_visits) as writer:
+        for pid, pid_train_rows in generate_training_rows(timelines, config):
+            if pid_train_rows is None:
+                attr_errs += 1
+            else:
+                writer.add_rows(pid_train_rows)
+    manifest = writer.manifest
+
+    logger.info("{num} Training rows created from timelines.".format(num=manifest['rows']))
+    logger.info("{num} Timelines had no training rows.".format(num=attr_errs))
+    return manifest
+
+def _is_ragged_format(config):
+    return config.get('TRAINING_DATA_FORMAT', 'pickle') == 'ragged'
+
+def get_training_data_path(config):
+    """
+    return the path the training data is written to: a pickled dataframe, or a directory of memory-mappable
+    arrays when config['TRAINING_DATA_FORMAT'] is 'ragged'
+    """
+    extension = '' if _is_ragged_format(config) else '.pkl'
+    return os.path.sep.join([config['OUTPUT_FILEPATH'], "".join([config['TRAINING_DATAFRAME_NAME'], extension])])
+
+def read_training_data(config):
+    """
+    return the training dataframe written by evaluate_timelines_for_trainingrows
+    """
+    filepath = get_training_data_path(config)
+    if _is_ragged_format(config):
+        return RaggedTrainingData.load(filepath).to_frame()
+    return pd.read_pickle(filepath)
+
 def write_train_dev_test(config, training_df = None):
     """
     split input data frame to be training set and dev set.
+
+    when the training rows were streamed to shards, the splits are made on the shards' row index.
+    With SPLIT_FORMAT 'manifest' (the default for streamed rows) only the row numbers of the splits are written,
+    with SPLIT_FORMAT 'pickle' every row selected for the holdout and train/dev sets is read back from the shards
+    into memory, which is most of the cohort
     :param config:
     :return:
     """
     # read training data frame
+    shards = None
     if training_df is None:
-        filepath = os.path.sep.join([config['OUTPUT_FILEPATH'], "".join([config['TRAINING_DATAFRAME_NAME'], ".pkl"])])
-        training_df = pd.read_pickle(filepath)
+        if _is_streaming(config):
+            shards = TrainingRowShards(get_training_shard_dir(config))
+            training_df = shards.read_index()
+        else:
+            training_df = read_training_data(config)
 
     # holdout test sets
-    df_train_dev, df_holdout = holdout_test(training_df, holdout_percent=0.1, seed=config['SEED'], match_num=config['MATCH_NUM'])
+    df_train_dev, df_holdout = holdout_test(training_df, holdout_percent=0.1, seed=config['SEED'], match_num=config['MATCH_NUM'],
+                                            covariates=get_matching_covariates(config, training_df, shards),
+                                            caliper=config.get('CONTROL_MATCHING', {}).get('CALIPER'))
+    if _get_split_format(config) == 'manifest':
+        write_train_dev_test_manifest(config, training_df, df_train_dev, df_holdout)
+        return
+    if shards is not None:
+        df_train_dev = _take_shard_rows(shards, df_train_dev)
+        df_holdout = _take_shard_rows(shards, df_holdout)
     # split training, dev sets
     train_dev_split_sets = train_dev_split_cv(df_train_dev, k_folds=5, match_num=config['MATCH_NUM'])
 
@@ -220,6 +818,70 @@ def write_train_dev_test(config, training_df = None):
             train_dev_split_sets[i][k].to_pickle(outpath)
             logger.info("wrote train, dev data frame to output path: {o}".format(o=outpath))
 
+def _get_split_format(config):
+    """
+    return config['SPLIT_FORMAT'], 'manifest' by default for streamed training rows and 'pickle' otherwise
+    """
+    streaming = _is_streaming(config)
+    split_format = config.get('SPLIT_FORMAT', 'manifest' if streaming else 'pickle')
+    if streaming and split_format == 'pickle':
+        logger.warning("SPLIT_FORMAT 'pickle' reads the selected training rows back from the shards into memory, "
+                       "use 'manifest' to keep the memory of streamed training rows bounded")
+    return split_format
+
+def get_matching_covariates(config, training_df, shards=None):
+    """
+    return the covariates to match controls on, indexed like training_df,
+    or None when controls are matched by sequence length only (config['CONTROL_MATCHING']['METHOD'] is 'length')
+    """
+    matching = config.get('CONTROL_MATCHING', {})
+    if matching.get('METHOD', 'length') == 'length':
+        return None
+    if matching['METHOD'] != 'nearest_neighbour':
+        raise ValueError("Unknown control matching method: {m}".format(m=matching['METHOD']))
+    covariates = matching.get('COVARIATES', ['length', 'days_since_hct'])
+    code_mappings = None
+    if not set(covariates) <= {'length', 'days_since_hct'}:
+        code_mappings = _load_data_dictionary(config["DATA_DICTIONARY"]).code_mappings
+    if shards is not None:
+        # the shards' row index has no codes, read the shards one at a time instead
+        return pd.concat([covariate_frame(shard_df, covariates, code_mappings) for shard_df in shards.iter_shards()])
+    return covariate_frame(training_df, covariates, code_mappings)
+
+def get_split_manifest_dir(config):
+    return os.path.join(config['OUTPUT_FILEPATH'], "train_dev_test_split")
+
+def write_train_dev_test_manifest(config, training_df, df_train_dev, df_holdout):
+    """
+    write the holdout, train/dev and cross validation splits as row numbers into the stored training data,
+    they are read back as lazy views with load_train_dev_test_splits
+    """
+    if _is_streaming(config):
+        dataset_format, dataset_path = 'shards', get_training_shard_dir(config)
+    else:
+        dataset_format = 'ragged' if _is_ragged_format(config) else 'pickle'
+        dataset_path = get_training_data_path(config)
+    train_dev_rows = training_df.index.get_indexer(df_train_dev.index)
+    folds = [(train_dev_rows[train_index], train_dev_rows[test_index])
+             for train_index, test_index in train_dev_fold_indices(df_train_dev, k_folds=5)]
+    TrainDevTestSplits.write(get_split_manifest_dir(config), dataset_format, dataset_path,
+                             holdout=training_df.index.get_indexer(df_holdout.index), train_dev=train_dev_rows,
+                             folds=folds)
+
+def load_train_dev_test_splits(config):
+    """
+    return the TrainDevTestSplits written by write_train_dev_test when config['SPLIT_FORMAT'] is 'manifest'
+    """
+    return TrainDevTestSplits.load(get_split_manifest_dir(config))
+
+def _take_shard_rows(shards, index_df):
+    """
+    return the full training rows for a subset of the shards' row index, with its row order, index and dtypes
+    """
+    rows = shards.take(index_df.index)
+    rows.index = index_df.index
+    return rows.astype(index_df.dtypes.to_dict())
+
 def train_dev_split_cv(df, k_folds=None, match_num=None):
     """
     split train dev sets using cross validation
@@ -232,6 +894,20 @@ def train_dev_split_cv(df, k_folds=None, match_num=None):
     X = df.iloc[:, df.columns != 'target']
     y = df.target.to_frame()
 
+    for train_index, test_index in train_dev_fold_indices(df, k_folds):
+        df_subset = {}
+        df_subset['data_train'], df_subset['data_test'] = X.iloc[train_index], X.iloc[test_index]
+        df_subset['target_train'], df_subset['target_test'] = y.iloc[train_index], y.iloc[test_index]
+        output.append(df_subset)
+    return output
+
+def train_dev_fold_indices(df, k_folds=None):
+    """
+    return the (train, test) positions of every cross validation fold, grouped by PID
+    """
+    X = df.iloc[:, df.columns != 'target']
+    y = df.target.to_frame()
+
     if not k_folds:
         print('Applied 5-fold cross validation by default')
         k_folds = 5
@@ -240,18 +916,14 @@ def train_dev_split_cv(df, k_folds=None, match_num=None):
     group_kfold = GroupKFold(n_splits=k_folds)
     group_kfold.get_n_splits(X, y, groups=X.PID)
 
-    for train_index, test_index in group_kfold.split(X, y, groups=X.PID):
-        df_subset = {}
-        df_subset['data_train'], df_subset['data_test'] = X.iloc[train_index], X.iloc[test_index]
-        df_subset['target_train'], df_subset['target_test'] = y.iloc[train_index], y.iloc[test_index]
-        output.append(df_subset)
-    return output
+    return list(group_kfold.split(X, y, groups=X.PID))
 
-def holdout_test(df, holdout_percent=None, seed=None, match_num=None):
+def holdout_test(df, holdout_percent=None, seed=None, match_num=None, covariates=None, caliper=None):
     """
     partition holdout test set at PID level
     :param df: input data
     :param holdout_percent: % of data hold out for testing
+    :param covariates: optional covariates to match controls on, see limit_to_match_controls
     :return: two sets: holdout and (train+dev)
     """
     np.random.RandomState(seed)
@@ -265,18 +937,29 @@ def holdout_test(df, holdout_percent=None, seed=None, match_num=None):
     df_holdout = df.loc[df.PID.isin(perm[:sep_index])].sort_values(by='len').drop(columns='len')
     df_train_dev = df.loc[df.PID.isin(perm[sep_index:])].sort_values(by='len').drop(columns='len')
     if match_num:
-        df_holdout = limit_to_match_controls(df_holdout, seed, match_num)
-        df_train_dev = limit_to_match_controls(df_train_dev, seed, match_num)
+        df_holdout = limit_to_match_controls(df_holdout, seed, match_num, covariates, caliper)
+        df_train_dev = limit_to_match_controls(df_train_dev, seed, match_num, covariates, caliper)
     return df_train_dev, df_holdout
 
 
-def limit_to_match_controls(df, seed, match_num):
+def limit_to_match_controls(df, seed, match_num, covariates=None, caliper=None):
     """
     return dataframe with same number of negative (no relapse) events
     each paired with 'match_num' number of positive relapse events by similar sequence len
+    see control_matching.match_by_length
+
+    when covariates are given the positive events are the nearest neighbours in covariate space instead,
+    see control_matching.match_nearest_neighbours
+    :param covariates: optional dataframe of matching covariates, indexed like df (e.g. from covariate_frame)
+    :param caliper: largest distance, in standard deviations, between matched covariates
     """
-    pos_df = df.loc[(df['target'] == 1)]
-    neg_df = df.loc[(df['target'] == 0)]
+    if covariates is None:
+        selected = match_by_length(df['to_event'].str.len().to_numpy(), df['target'].to_numpy(), seed, match_num)
+    else:
+        selected = match_nearest_neighbours(covariates.loc[df.index].to_numpy(), df['target'].to_numpy(), seed,
+                                            match_num, caliper)
+    if selected:
+        return df.iloc[selected]
 
     new_df = pd.DataFrame()
     # setting column dtypes directly on empty columns throws an error
@@ -284,20 +967,6 @@ def limit_to_match_controls(df, seed, match_num):
     # https://stackoverflow.com/questions/36462257/create-empty-dataframe-in-pandas-specifying-column-types
     for c, d in zip(df.columns, df.dtypes):
         new_df[c] = pd.Series(dtype=d)
-    for i in set(neg_df['to_event'].str.len()): # for each sequence length in negative instances        
-        for n, row in neg_df.loc[(neg_df['to_event'].str.len() == i)].iterrows(): # negative entries of event length i
-            min_dist = min(abs(pos_df['to_event'].str.len() - i)) # closest positive instance seedquence len
-            pos_inst_df = pos_df.loc[(pos_df['to_event'].str.len() - i) == min_dist]
-            try:
-                # NOTE: this will still skip over potential matches if there are not at least 'match_num'
-                pos_pick = pos_inst_df.sample(match_num, random_state=seed)
-                pos_df = pos_df.drop(index=pos_pick.index)
-                # append both positive and negative instances
-                new_df = new_df.append(pos_pick)
-                new_df = new_df.append(row)
-            except:
-                logger.info("missing matched controls for sequence length: {s}".format(s=i))
-
     return new_df
 
 def get_sorted_pid_list(df):
@@ -309,11 +978,22 @@ def get_sorted_pid_list(df):
 
 
 if __name__ == '__main__':
+    import argparse
     import yaml
     import logging
     import logging.config
     import os
 
+    parser = argparse.ArgumentParser(description='Reformat Relapse REDCap data for RETAIN')
+    parser.add_argument('--replay', action='store_true',
+                        help='rebuild timelines from the REDCap snapshot instead of exporting from REDCap')
+    parser.add_argument('--incremental', action='store_true',
+                        help='export only records modified since the last pull and recompute only those patients')
+    parser.add_argument('--sweep', metavar='GRID_JSON',
+                        help='evaluate every DECISION_PARAMETERS setting in a json grid and write their summary '
+                             'instead of the training data')
+    args = parser.parse_args()
+
     cd = os.path.dirname(os.path.realpath(__file__))
     with open(os.path.join(cd, '../logging.yaml'), 'r') as f:
         log_cfg = yaml.safe_load(f.read())
@@ -324,7 +1004,16 @@ if __name__ == '__main__':
         with open(os.path.join(cd, c), 'r') as fin:
             config.update(json.load(fin))
 
-    timelines = pull_from_red_cap(config)
-    training_df = evaluate_timelines_for_trainingrows(timelines, config)
+    if args.sweep:
+        with open(args.sweep, 'r') as fin:
+            sweep_from_red_cap(config, json.load(fin), replay=args.replay)
+        raise SystemExit(0)
+
+    dirty_patients = None
+    if args.incremental:
+        timelines, dirty_patients = pull_incremental_from_red_cap(config)
+    else:
+        timelines = pull_from_red_cap(config, replay=args.replay)
+    training_df = evaluate_timelines_for_trainingrows(timelines, config, dirty_patients=dirty_patients)
 
     write_train_dev_test(config, training_df=training_df)
@@ -0,0 +1,133 @@
+"""
+store the holdout and cross validation splits of the RETAIN training data as row numbers into
+the single stored training dataset, instead of writing every split out as its own dataframe
+"""
+import os
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from scripts.ragged_training_data import RaggedTrainingData
+from scripts.training_row_shards import TrainingRowShards
+
+logger = logging.getLogger(__name__)
+
+
+class TrainDevTestSplits():
+    """
+    The holdout set, the train/dev set and its cross validation folds, as row numbers of a stored training dataset
+
+    layout:
+        <split_dir>/manifest.json -> {"dataset": {"format": <pickle|ragged|shards>, "path": <path relative to split_dir>},
+                                      "folds": <n folds>}
+        <split_dir>/rows.npz      -> holdout, train_dev, train_<i> and test_<i> row numbers
+
+    >>> import tempfile
+    >>> out_dir = tempfile.mkdtemp()
+    >>> df = pd.DataFrame({'PID': [1, 1, 2, 3], 'to_event': [[1], [1, 2], [3], [4]], 'target': [0, 1, 0, 1]})
+    >>> df.to_pickle(os.path.join(out_dir, 'training_df.pkl'))
+    >>> TrainDevTestSplits.write(os.path.join(out_dir, 'splits'), 'pickle', os.path.join(out_dir, 'training_df.pkl'),
+    ...                          holdout=[3], train_dev=[2, 0, 1], folds=[([2], [0, 1]), ([0, 1], [2])])
+    >>> splits = TrainDevTestSplits.load(os.path.join(out_dir, 'splits'))
+    >>> len(splits.holdout), splits.folds[0]['test'].data()['PID'].tolist()
+    (1, [1, 1])
+    >>> splits.folds[1]['train'].target()
+       target
+    0       0
+    1       1
+    """
+    MANIFEST_NAME = 'manifest.json'
+    ROWS_NAME = 'rows.npz'
+
+    def __init__(self, dataset, holdout, train_dev, folds):
+        self.dataset = dataset
+        self.holdout = SplitView(dataset, holdout)
+        self.train_dev = SplitView(dataset, train_dev)
+        self.folds = [{'train': SplitView(dataset, train), 'test': SplitView(dataset, test)} for train, test in folds]
+
+    @classmethod
+    def write(cls, split_dir, dataset_format, dataset_path, holdout, train_dev, folds):
+        """
+        :param dataset_format: 'pickle', 'ragged' or 'shards', how the training dataset at dataset_path is stored
+        :param holdout: row numbers of the holdout set
+        :param train_dev: row numbers of the train/dev set
+        :param folds: list of (train row numbers, test row numbers)
+        """
+        os.makedirs(split_dir, exist_ok=True)
+        rows = {'holdout': np.asarray(holdout, dtype=np.int64), 'train_dev': np.asarray(train_dev, dtype=np.int64)}
+        for i, (train, test) in enumerate(folds):
+            rows['train_{}'.format(i)] = np.asarray(train, dtype=np.int64)
+            rows['test_{}'.format(i)] = np.asarray(test, dtype=np.int64)
+        np.savez(os.path.join(split_dir, cls.ROWS_NAME), **rows)
+        manifest = {'dataset': {'format': dataset_format,
+                                'path': os.path.relpath(os.path.realpath(dataset_path), os.path.realpath(split_dir))},
+                    'folds': len(folds)}
+        with open(os.path.join(split_dir, cls.MANIFEST_NAME), 'w') as fout:
+            json.dump(manifest, fout, indent=1)
+        logger.info("wrote holdout and {k} train, dev splits of: {d} to: {s}".format(k=len(folds), d=dataset_path,
+                                                                                   s=split_dir))
+
+    @classmethod
+    def load(cls, split_dir):
+        with open(os.path.join(split_dir, cls.MANIFEST_NAME), 'r') as fin:
+            manifest = json.load(fin)
+        dataset = open_training_dataset(manifest['dataset']['format'],
+                                        os.path.join(split_dir, manifest['dataset']['path']))
+        with np.load(os.path.join(split_dir, cls.ROWS_NAME)) as rows:
+            folds = [(rows['train_{}'.format(i)], rows['test_{}'.format(i)]) for i in range(manifest['folds'])]
+            return cls(dataset, rows['holdout'], rows['train_dev'], folds)
+
+
+class SplitView():
+    """
+    A subset of the rows of a stored training dataset, read from the dataset only when asked for
+    """
+    def __init__(self, dataset, rows):
+        self.dataset = dataset
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_frame(self):
+        """
+        the training rows of the split, indexed by their row numbers in the dataset
+        """
+        return self.dataset.take(self.rows)
+
+    def data(self):
+        df = self.to_frame()
+        return df.iloc[:, df.columns != 'target']
+
+    def target(self):
+        df = self.to_frame()
+        return df.iloc[:, df.columns == 'target']
+
+
+class _PickledFrameDataset():
+    """
+    a pickled training dataframe, read on first use
+    """
+    def __init__(self, path):
+        self.path = path
+        self._df = None
+
+    def take(self, row_numbers):
+        if self._df is None:
+            self._df = pd.read_pickle(self.path)
+        return self._df.iloc[row_numbers]
+
+
+def open_training_dataset(dataset_format, dataset_path):
+    """
+    :return: the stored training dataset, an object whose take(row_numbers) returns those training rows as a dataframe
+    """
+    if dataset_format == 'pickle':
+        return _PickledFrameDataset(dataset_path)
+    if dataset_format == 'ragged':
+        return RaggedTrainingData.load(dataset_path)
+    if dataset_format == 'shards':
+        return TrainingRowShards(dataset_path)
+    raise ValueError("Unknown training dataset format: {f}".format(f=dataset_format))
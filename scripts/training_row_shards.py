@@ -0,0 +1,149 @@
+"""
+stream RETAIN training rows to size-bounded pickled dataframe shards, so the rows of a whole
+cohort never have to be held in memory at once
+"""
+import os
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingRowShardWriter():
+    """
+    Buffers training rows and writes them out as a new shard whenever the buffer holds max_visits visits
+
+    layout:
+        <shard_dir>/manifest.json  -> {"rows": <n rows>, "columns": <columns of the rows>,
+                                       "shards": [{"name": <file>, "index": <file>, "first_row": <row>, "rows": <n>}]}
+        <shard_dir>/shard_<n>.pkl  -> the training rows, indexed by their row number across all shards
+        <shard_dir>/index_<n>.pkl  -> PID, to_event and target of the shard's rows, indexed the same way
+
+    only the rows of the shard being filled are held in memory, the row index is written with every shard
+
+    >>> import tempfile
+    >>> shard_dir = tempfile.mkdtemp()
+    >>> with TrainingRowShardWriter(shard_dir, max_visits=2) as writer:
+    ...     for pid in range(3):
+    ...         writer.add_rows([{'PID': pid, 'numerics': [[None]], 'codes': [[1]], 'to_event': [1], 'target': 0}] * 2)
+    >>> shards = TrainingRowShards(shard_dir)
+    >>> len(shards), len(shards.manifest['shards'])
+    (6, 3)
+    >>> shards.take([5, 0])[['PID', 'to_event']].values.tolist()
+    [[2, [1]], [0, [1]]]
+    """
+    MANIFEST_NAME = 'manifest.json'
+    INDEX_COLUMNS = ['PID', 'to_event', 'target']
+
+    def __init__(self, shard_dir, max_visits=100000):
+        self.shard_dir = shard_dir
+        self.max_visits = max_visits
+        self.shards = []
+        self.columns = None
+        self.n_rows = 0
+        self.manifest = None
+        self._buffer = []
+        self._buffer_visits = 0
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self.manifest is None:
+            self.close()
+
+    def add_rows(self, rows):
+        for row in rows:
+            self._buffer.append(row)
+            self._buffer_visits += len(row['to_event'])
+            if self._buffer_visits >= self.max_visits:
+                self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        name = "shard_{:05d}.pkl".format(len(self.shards))
+        index_name = "index_{:05d}.pkl".format(len(self.shards))
+        first_row = self.n_rows
+        shard_df = pd.DataFrame(self._buffer, index=pd.RangeIndex(first_row, first_row + len(self._buffer)))
+        if self.columns is None:
+            self.columns = list(shard_df.columns)
+        shard_df.to_pickle(os.path.join(self.shard_dir, name))
+        shard_df[self.INDEX_COLUMNS].to_pickle(os.path.join(self.shard_dir, index_name))
+        self.shards.append({'name': name, 'index': index_name, 'first_row': first_row, 'rows': len(self._buffer)})
+        self.n_rows += len(self._buffer)
+        self._buffer = []
+        self._buffer_visits = 0
+
+    def close(self):
+        """
+        write the last shard and the manifest
+        :return: the manifest
+        """
+        self.flush()
+        manifest = {'rows': self.n_rows, 'columns': self.columns or self.INDEX_COLUMNS, 'shards': self.shards}
+        tmp_path = os.path.join(self.shard_dir, "".join([self.MANIFEST_NAME, '.tmp']))
+        with open(tmp_path, 'w') as fout:
+            json.dump(manifest, fout, indent=1)
+        os.replace(tmp_path, os.path.join(self.shard_dir, self.MANIFEST_NAME))
+        self.manifest = manifest
+        logger.info("wrote {r} training rows in {s} shards to: {d}".format(r=self.n_rows, s=len(self.shards),
+                                                                           d=self.shard_dir))
+        return manifest
+
+
+class TrainingRowShards():
+    """
+    The training rows written by a TrainingRowShardWriter, read back one shard at a time
+    """
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, TrainingRowShardWriter.MANIFEST_NAME), 'r') as fin:
+            self.manifest = json.load(fin)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def read_index(self):
+        """
+        return the PID, to_event and target of every row, indexed by row number
+        """
+        if not self.manifest['shards']:
+            return self._empty_frame(TrainingRowShardWriter.INDEX_COLUMNS)
+        return pd.concat([pd.read_pickle(os.path.join(self.shard_dir, shard['index']))
+                          for shard in self.manifest['shards']])
+
+    @staticmethod
+    def _empty_frame(columns):
+        return pd.DataFrame(columns=columns, index=pd.RangeIndex(0))
+
+    def read_shard(self, shard):
+        return pd.read_pickle(os.path.join(self.shard_dir, shard['name']))
+
+    def iter_shards(self):
+        for shard in self.manifest['shards']:
+            yield self.read_shard(shard)
+
+    def take(self, row_numbers):
+        """
+        return the training rows with the given row numbers, in the given order,
+        reading only the shards that hold them
+        """
+        row_numbers = np.asarray(row_numbers, dtype=np.int64)
+        shards = self.manifest['shards']
+        first_rows = np.array([s['first_row'] for s in shards], dtype=np.int64)
+        shard_of_row = np.searchsorted(first_rows, row_numbers, side='right') - 1
+        parts = []
+        for s in np.unique(shard_of_row):
+            shard_df = self.read_shard(shards[s])
+            parts.append(shard_df.loc[row_numbers[shard_of_row == s]])
+        if not parts and not shards:
+            # no training rows were written, e.g. for a cohort without decision points
+            return self._empty_frame(self.manifest.get('columns', TrainingRowShardWriter.INDEX_COLUMNS))
+        if not parts:
+            return self.read_shard(shards[0]).iloc[:0]
+        return pd.concat(parts).loc[row_numbers]
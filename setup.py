@@ -14,6 +14,7 @@ setup(
     install_requires=['pycap',
                       'pandas',
                       'pandas-profiling',
+                      'pyarrow',
                       'pyyaml',
                       'sklearn'],
     url='https://github.com/FredHutch/RelapseDataReformatting',
@@ -0,0 +1,145 @@
+import nose
+import numpy as np
+from datetime import datetime, timedelta
+from nose.tools import assert_equals, assert_raises
+
+from classes.collection.patienttimeline import PatientTimeline
+from classes.event.relapseencounter import RelapseEncounter
+from classes.event.treatmentencounter import TreatmentEncounter
+from classes.event.vitalsencounter import VitalsEncounter
+from classes.evaluator.cohortevaluator import CohortArrays, CohortTimelineEvaluator, sweep_decision_parameters, \
+    sweep_summary
+from classes.evaluator.patienttimelineevaluator import PatientTimelineEvaluator
+
+from test import _make_event_day, _make_timeline
+
+
+def _summary(decision_points):
+    return [(dp.eval_date, [ed.date for ed in dp.eventdays], dp.label, dp.label_cause, dp.target_date)
+            for dp in decision_points]
+
+
+class TestCohortTimelineEvaluator:
+
+    def setup(self):
+        self.start = datetime(2019, 7, 11)
+        self.treatments = ['induction_chemo', 'consolidation_chemo', 'hydroxyurea', 'targeted', 'cytokine']
+        self.indications = [TreatmentEncounter.INDICATION_INDUCTION, TreatmentEncounter.INDICATION_MRD_TREATMENT,
+                            TreatmentEncounter.INDICATION_CONSOLIDATION_CR, None]
+
+    def _treatment(self, pid, offset, rx_indication=TreatmentEncounter.INDICATION_INDUCTION, **treatments):
+        date = self.start + timedelta(days=offset)
+        return TreatmentEncounter(pid, date, date, offset, 0, rx_indication=rx_indication, **treatments)
+
+    def _relapse(self, pid, offset, presentation=RelapseEncounter.MORPHOLOGIC_PRESENTATION):
+        return RelapseEncounter(pid, self.start + timedelta(days=offset), offset, 0, relapse_or_response=1,
+                                relapse_presentation=presentation)
+
+    def _random_timelines(self, n_patients, seed):
+        rng = np.random.RandomState(seed)
+        timelines = dict()
+        for pid in range(n_patients):
+            days = []
+            for offset in np.cumsum(rng.choice([1, 2, 4, 30, 100], rng.randint(1, 15))):
+                offset = int(offset)
+                ed = _make_event_day(pid, self.start + timedelta(days=offset), event_days=[])
+                if rng.rand() < 0.6:
+                    given = {t: 1 for t in self.treatments if rng.rand() < 0.3}
+                    ed.add_event(self._treatment(pid, offset, self.indications[rng.randint(4)], **given))
+                if rng.rand() < 0.2:
+                    ed.add_event(self._relapse(pid, offset, rng.choice([1, 2, 3])))
+                if rng.rand() < 0.05:
+                    ed.add_event(VitalsEncounter(pid, ed.date, offset, 0, death_status=1))
+                days.append(ed)
+            timelines[pid] = _make_timeline(pid, days)
+        return timelines
+
+    def _assert_same_as_timeline_evaluator(self, timelines, **params):
+        actual = CohortTimelineEvaluator(**params).evaluate_timelines(timelines)
+        for pid, timeline in timelines.items():
+            expected = PatientTimelineEvaluator(**params).evaluate(timeline)
+            assert_equals(_summary(actual[pid]), _summary(expected))
+            assert_equals(actual[pid], expected)
+
+    def test_random_cohort_matches_timeline_evaluator(self):
+        timelines = self._random_timelines(300, seed=3)
+        self._assert_same_as_timeline_evaluator(timelines)
+        self._assert_same_as_timeline_evaluator(timelines, induction_timewindow=5, mrd_timewindow=40,
+                                                consolidation_timewindow=2, dpoint_eval_window=3,
+                                                dpoint_positive_labels=['Morph'])
+
+    def test_mrd_treatment_change_and_consolidation(self):
+        pid = 1
+        days = [_make_event_day(pid, self.start, event_days=[self._treatment(pid, 0, induction_chemo=1)]),
+                _make_event_day(pid, self.start + timedelta(days=2),
+                                event_days=[self._treatment(pid, 2, consolidation_chemo=1)]),
+                _make_event_day(pid, self.start + timedelta(days=20),
+                                event_days=[self._treatment(pid, 20, TreatmentEncounter.INDICATION_MRD_TREATMENT,
+                                                            targeted=1)])]
+        timelines = {pid: PatientTimeline(pid, days)}
+        actual = CohortTimelineEvaluator().evaluate_timelines(timelines)[pid]
+
+        # the first two treatments are consolidated, the new targeted treatment labels them
+        assert_equals([(len(dp.eventdays), dp.label_cause, dp.target_date) for dp in actual],
+                      [(2, 'MRD', self.start + timedelta(days=20)), (1, None, None)])
+        self._assert_same_as_timeline_evaluator(timelines)
+
+    def test_duplicate_dates(self):
+        pid = 1
+        days = [_make_event_day(pid, self.start, event_days=[self._treatment(pid, 0, induction_chemo=1)]),
+                _make_event_day(pid, self.start, event_days=[self._relapse(pid, 0)]),
+                _make_event_day(pid, self.start, event_days=[self._treatment(pid, 0, targeted=1)]),
+                _make_event_day(pid, self.start + timedelta(days=1), event_days=[self._relapse(pid, 1)])]
+        self._assert_same_as_timeline_evaluator({pid: PatientTimeline(pid, days)})
+
+    def test_other_indication_fails_like_timeline_evaluator(self):
+        pid = 1
+        # the decision point's only valid indication is OTHER, which has no evaluation window
+        days = [_make_event_day(pid, self.start, event_days=[
+                    self._treatment(pid, 0, None, induction_chemo=1),
+                    self._treatment(pid, 0, TreatmentEncounter.INDICATION_OTHER_INDICATION, cytokine=1)]),
+                _make_event_day(pid, self.start + timedelta(days=1), event_days=[self._relapse(pid, 1)])]
+        timeline = PatientTimeline(pid, days)
+        with assert_raises(TypeError):
+            PatientTimelineEvaluator().evaluate(timeline)
+        with assert_raises(TypeError):
+            CohortTimelineEvaluator().evaluate_timelines({pid: timeline})
+
+    def test_empty_cohort(self):
+        timelines = {1: PatientTimeline(1, [])}
+        assert_equals(CohortTimelineEvaluator().evaluate_timelines(timelines), {1: []})
+        assert_equals(len(CohortTimelineEvaluator().evaluate(CohortArrays.from_timelines(dict()))), 0)
+
+
+class TestDecisionParameterSweep:
+
+    def setup(self):
+        cohort_test = TestCohortTimelineEvaluator()
+        cohort_test.setup()
+        self.cohort = CohortArrays.from_timelines(cohort_test._random_timelines(100, seed=5))
+        self.grid = {'INDUCTION_WINDOW': [5, 90], 'MRD_WINDOW': [365], 'CONSOLIDATION_WINDOW': [30, 365],
+                     'DECISION_POINT_EVAL_WINDOW': [0, 7], 'DECISION_POINT_REASONS': [['Death', 'Morph', 'MRD'], ['MRD']]}
+
+    def test_sweep_matches_single_evaluations(self):
+        results = sweep_decision_parameters(self.cohort, self.grid)
+        assert_equals(len(results), 16)
+        for params, dpts in results:
+            evaluator = CohortTimelineEvaluator(params['INDUCTION_WINDOW'], params['MRD_WINDOW'],
+                                                params['CONSOLIDATION_WINDOW'], params['DECISION_POINT_EVAL_WINDOW'],
+                                                params['DECISION_POINT_REASONS'])
+            expected = evaluator.evaluate(self.cohort).to_frame()
+            assert_equals(dpts.to_frame().equals(expected), True)
+
+    def test_sweep_summary(self):
+        results = sweep_decision_parameters(self.cohort, self.grid)
+        summary = sweep_summary(results)
+        assert_equals(len(summary), 16)
+        for (params, dpts), row in zip(results, summary.to_dict('records')):
+            assert_equals(row['DECISION_POINT_EVAL_WINDOW'], params['DECISION_POINT_EVAL_WINDOW'])
+            assert_equals(row['total_decision_points'], len(dpts))
+            assert_equals(sum(row['decision_point_labels'].values()), len(dpts))
+            assert_equals(row['decision_point_labels'].get(True, 0), int(dpts.label.sum()))
+
+
+if __name__ == '__main__':
+    nose.run()
@@ -116,7 +116,20 @@ class TestPatientTimelineEvaluator:
         assert_equals(actual_dpts, [merged_dpt1, merged_dpt2])
 
     def test_assign_labels(self):
-        return
+        dpt1 = DecisionPoint(patientid=self.PID, eventdays=[self.ed1, self.ed2])
+        dpt2 = DecisionPoint(patientid=self.PID, eventdays=[self.ed6])
+
+        self.evaluator.assign_labels(self.timeline, [dpt1, dpt2])
+        assert_equals((dpt1.label, dpt1.label_cause, dpt1.target_date), (True, 'Morph', self.ed3.date))
+        assert_equals((dpt2.label, dpt2.label_cause, dpt2.target_date), (False, None, None))
+
+    def test_assign_labels_stops_at_window_end(self):
+        dpt1 = DecisionPoint(patientid=self.PID, eventdays=[self.ed1, self.ed2])
+        # the relapse the day after the decision point is outside a zero day evaluation window
+        evaluator = pte.PatientTimelineEvaluator(induction_timewindow=0)
+
+        evaluator.assign_labels(self.timeline, [dpt1])
+        assert_equals((dpt1.label, dpt1.label_cause, dpt1.target_date), (False, None, None))
 
     def test_target_eval_mr(self):
         dpt1 = DecisionPoint(patientid=self.PID, eventdays=[self.ed1, self.ed2])
@@ -1,5 +1,6 @@
 import datetime as dt
 import nose
+from unittest import mock
 from nose import with_setup
 from nose.tools import assert_equals, assert_in, assert_raises
 
@@ -156,3 +157,77 @@ class TestTrainingRowEvaluator:
         actual = self.evaluator.evaluate_timeline_for_training_rows(self.timeline, self.datadict)
 
         assert_equals(expected, actual)
+
+    def test_visits_encoded_once_per_timeline(self):
+        dpt1 = DecisionPoint(patientid=self.PID, eventdays=[self.ed2])
+        dpt2 = DecisionPoint(patientid=self.PID, eventdays=[self.ed5])
+        dpt3 = DecisionPoint(patientid=self.PID, eventdays=[self.ed6])
+        self.timeline.decision_points = [dpt1, dpt2, dpt3]
+        encoded_days = []
+        build_visit_dict = self.evaluator.build_visit_dict
+
+        def counting_build_visit_dict(rowdict, datadict, error_cols, default_vals=None):
+            encoded_days.append(rowdict['DAY'])
+            return build_visit_dict(rowdict, datadict, error_cols, default_vals)
+        self.evaluator.build_visit_dict = counting_build_visit_dict
+
+        actual = self.evaluator.evaluate_timeline_for_training_rows(self.timeline, self.datadict)
+
+        assert_equals([1, 3, 4, 5, 6, 7], encoded_days)
+        assert_equals([[1, 3], [1, 3, 4, 5, 6], [1, 3, 4, 5, 6, 7]], [row['to_event'] for row in actual])
+
+    def test_duplicate_days_since_epoch_keep_last_day(self):
+        # the first two event days share days since epoch 1, the later one is kept
+        date = self.EVENT_DATE_ONE + timedelta(days=1)
+        ed = _make_event_day(self.PID, date,
+                             event_days=[RelapseEncounter(self.PID, date, self.INDEX_EPOCH, self.INDEX_RELAPSE,
+                                                          relapse_or_response=1, relapse_presentation=3,
+                                                          raw_df={'subject_id': self.PID, 'relapse_or_response': 1,
+                                                                  'relapse_presentation': 3})])
+        timeline = _make_timeline(self.PID, [self.ed1, ed, self.ed2])
+        timeline.decision_points = [DecisionPoint(patientid=self.PID, eventdays=[self.ed1]),
+                                    DecisionPoint(patientid=self.PID, eventdays=[self.ed2])]
+
+        actual = self.evaluator.evaluate_timeline_for_training_rows(timeline, self.datadict)
+
+        assert_equals([{'PID': 12345, 'numerics': [[None, None]], 'codes': [[7]], 'to_event': [1], 'target': 0},
+                       {'PID': 12345, 'numerics': [[1, 3], [None, None]], 'codes': [[], [7]], 'to_event': [1, 3],
+                        'target': 0}], actual)
+
+    def test_overwritten_day_is_not_encoded(self):
+        # the day with an unknown feature shares days since epoch 1 with the day after it,
+        # which overwrites it in the only decision point
+        date = self.EVENT_DATE_ONE - timedelta(days=1)
+        ed = _make_event_day(self.PID, date,
+                             event_days=[Encounter(self.PID, date, self.INDEX_EPOCH, self.INDEX_RELAPSE,
+                                                   raw_df={'subject_id': self.PID, 'unknown_feature': 1})])
+        timeline = _make_timeline(self.PID, [ed, self.ed1, self.ed2])
+        timeline.decision_points = [DecisionPoint(patientid=self.PID, eventdays=[self.ed2])]
+        encoded_days = []
+        build_visit_dict = self.evaluator.build_visit_dict
+
+        def counting_build_visit_dict(rowdict, datadict, error_cols, default_vals=None):
+            encoded_days.append(rowdict['DAY'])
+            return build_visit_dict(rowdict, datadict, error_cols, default_vals)
+        self.evaluator.build_visit_dict = counting_build_visit_dict
+
+        with mock.patch.object(tre.logger, 'warning') as warning:
+            actual = self.evaluator.evaluate_timeline_for_training_rows(timeline, self.datadict)
+
+        assert_equals([1, 3], encoded_days)
+        assert_equals([[1, 3]], [row['to_event'] for row in actual])
+        assert_equals(warning.called, False)
+
+        # a decision point on the overwritten day encodes it, and reports its unknown feature
+        timeline.decision_points.insert(0, DecisionPoint(patientid=self.PID, eventdays=[ed]))
+        encoded_days.clear()
+        with mock.patch.object(tre.logger, 'warning') as warning:
+            actual = self.evaluator.evaluate_timeline_for_training_rows(timeline, self.datadict)
+
+        assert_equals([1, 1, 3], encoded_days)
+        assert_equals([[1], [1, 3]], [row['to_event'] for row in actual])
+        assert_in('unknown_feature', warning.call_args[0][0])
+
+
+if __name__ == '__main__':
+    nose.run()
@@ -0,0 +1,146 @@
+import itertools
+import pickle
+
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+from classes.event.encounter import Encounter, EncounterFactory, FeatureTable
+from classes.event.treatmentencounter import TreatmentEncounterFactory
+from classes.event.relapseencounter import RelapseEncounterFactory
+from classes.event.vitalsencounter import VitalsEncounterFactory
+
+
+class DayCountFactory(EncounterFactory):
+    """
+    makes encounters from forms of numbers only, dated by a fixed date
+    """
+    def __init__(self):
+        super(DayCountFactory, self).__init__(Encounter)
+
+    def translate_df_to_dict(self, df_row):
+        row_dictionary = self._store_df_row(df_row)
+        row_dictionary['date'] = '2019-07-11'
+        row_dictionary['patientid'] = df_row['subject_id']
+        row_dictionary['days_since_epoch'] = df_row['days_hct1']
+        row_dictionary['days_since_relapse'] = df_row['days_relapse']
+        return row_dictionary
+
+
+class TestEncounterFactoryBatch:
+
+    def setup(self):
+        self.treatment_df = pd.DataFrame({'redcap_repeat_instrument': ['treatment_event'] * 3,
+                                          'date_treatment': ['2019-07-11', '2019-07-12', '2019-07-20'],
+                                          'w_target_stop': [np.nan, '2019-07-14', np.nan],
+                                          'days_hct1_to_tx': [3, 4, 12],
+                                          'days_index_relapse_to_tx': [1, 2, 10],
+                                          'rx_indication': [1, 2, np.nan],
+                                          'e_treatment___1': [1, 0, 0],
+                                          'e_treatment___9': [0, 1, np.nan]},
+                                         index=pd.Index([123, 123, 456], name='subject_id'))
+        self.relapse_df = pd.DataFrame({'date_response': ['2019-07-11', 'bad date'], 'days_hct1_to_e': [3, 4],
+                                        'days_index_relapse_to_e': [2, 3], 'e_response': [1, 2],
+                                        'w_relapse': [3, np.nan], 'w_crdepth': [np.nan, 1], 'wbc': [1.0, np.nan],
+                                        'pb_blasts': [np.nan, 2.0], 'bm_blasts': [np.nan, np.nan]},
+                                       index=[123, 456])
+
+    def _per_row(self, factory, df):
+        return list(itertools.chain(*[factory.make_encounters(index, row) for index, row in df.iterrows()]))
+
+    def _assert_same_encounters(self, expected, actual):
+        assert_equals(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            assert_equals(repr(e), repr(a))
+            assert_equals(e.days_since_epoch, a.days_since_epoch)
+            assert_equals(list(e.features.keys()), list(a.features.keys()))
+            assert_equals(e.existant_features, a.existant_features)
+
+    def test_treatment_batch_matches_per_row(self):
+        factory = TreatmentEncounterFactory()
+        expected = self._per_row(factory, self.treatment_df.copy())
+        actual = factory.make_encounters_from_df(self.treatment_df.copy())
+
+        # the multi-day treatment is split into one encounter per day
+        assert_equals(len(actual), 5)
+        self._assert_same_encounters(expected, actual)
+
+    def test_relapse_batch_matches_per_row(self):
+        factory = RelapseEncounterFactory()
+        expected = self._per_row(factory, self.relapse_df)
+        actual = factory.make_encounters_from_df(self.relapse_df)
+
+        # the unparseable date is dropped in both
+        assert_equals(len(actual), 1)
+        self._assert_same_encounters(expected, actual)
+
+    def test_numeric_batch_matches_per_row(self):
+        factory = DayCountFactory()
+        float_df = pd.DataFrame({'days_hct1': [3.0, 4.0], 'days_relapse': [1.0, 2.0], 'wbc': [np.nan, 5.0]},
+                                index=[123, 456])
+        for df in [float_df,
+                   pd.DataFrame({'days_hct1': [3.0, 4.0], 'days_relapse': [1, 2]}, index=[123, 456]),
+                   pd.DataFrame({'days_hct1': [3, 4], 'days_relapse': [1, 2]}, index=[123, 456])]:
+            expected = self._per_row(factory, df)
+            actual = factory.make_encounters_from_df(df)
+
+            self._assert_same_encounters(expected, actual)
+            for e, a in zip(expected, actual):
+                assert_equals(e.patientid, a.patientid)
+                assert_equals([(type(v), v) for v in e.features.values() if v == v],
+                              [(type(v), v) for v in a.features.values() if v == v])
+
+        # the rows of a float frame hold a float subject id, and their values are kept as python floats
+        features = factory.make_encounters_from_df(float_df)[1].existant_features
+        assert_equals([(k, type(v), v) for k, v in features.items()],
+                      [('days_hct1', float, 4.0), ('days_relapse', float, 2.0), ('wbc', float, 5.0),
+                       ('subject_id', float, 456.0)])
+
+    def test_empty_form(self):
+        factory = VitalsEncounterFactory()
+        assert_equals(factory.make_encounters_from_df(self.relapse_df.iloc[0:0]), [])
+
+
+class TestCompactEncounter:
+
+    def setup(self):
+        self.relapse_df = pd.DataFrame({'date_response': ['2019-07-11', '2019-07-12'], 'days_hct1_to_e': [3, 4],
+                                        'days_index_relapse_to_e': [2, 3], 'e_response': [1, 2],
+                                        'w_relapse': [3, np.nan], 'w_crdepth': [np.nan, 1], 'wbc': [1.0, np.nan],
+                                        'pb_blasts': [np.nan, 2.0], 'bm_blasts': [np.nan, np.nan]},
+                                       index=[123, 456])
+        self.encounters = RelapseEncounterFactory().make_encounters_from_df(self.relapse_df)
+
+    def test_no_instance_dict(self):
+        for enc in self.encounters:
+            assert_equals(hasattr(enc, '__dict__'), False)
+
+    def test_feature_table_shared(self):
+        first, second = self.encounters
+        assert_equals(first._feature_table is second._feature_table, True)
+        # only the non-null values are stored
+        assert_equals(len(first._feature_vals), 7)
+
+    def test_features_restore_missing_values(self):
+        features = self.encounters[1].features
+        assert_equals(list(features.keys()), list(self.relapse_df.columns) + ['subject_id'])
+        assert_equals(np.isnan(features['wbc']), True)
+        assert_equals(features['pb_blasts'], 2.0)
+
+    def test_pickle_round_trip(self):
+        enc = pickle.loads(pickle.dumps(self.encounters[0]))
+        assert_equals(enc._feature_table is FeatureTable.intern(enc._feature_table.names), True)
+        assert_equals(enc.existant_features, self.encounters[0].existant_features)
+
+    def test_features_memoized_until_raw_df_replaced(self):
+        enc = self.encounters[0]
+        features = enc.features
+        assert_equals(enc.features is features, True)
+        enc.raw_df = {'wbc': 2.0}
+        assert_equals(enc.features, {'wbc': 2.0})
+        assert_equals(enc.existant_features, {'wbc': 2.0})
+
+
+if __name__ == '__main__':
+    nose.run()
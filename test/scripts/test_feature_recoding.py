@@ -0,0 +1,85 @@
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+from scripts import BUCKETS, GATEWAY_FEATURE_RECODE_MAP
+from scripts.feature_recoding import IntervalBins, compile_buckets, compile_recoders, MultiHotEncoder
+from scripts.reformat_relapse_data import bucket_features, recode_features, get_values
+
+
+class TestBucketFeatures:
+
+    def setup(self):
+        self.df = pd.DataFrame({'txage': [0, 0.99, 1, 11.9, 12, 12.5, 13, 18, 60, 159, 160, np.nan, -3],
+                                'other': range(13)}, index=range(20, 7, -1))
+
+    def test_bucket_features_half_open_with_gaps(self):
+        actual = bucket_features(self.df.copy(), BUCKETS)
+
+        # 12 up to 13 falls in the gap between the 1 and 2 buckets, 160 is past the last bucket
+        expected = [0, 0, 1, 1, np.nan, np.nan, 2, 3, 4, 4, np.nan, np.nan, np.nan]
+        assert_equals(actual['txage'].equals(pd.Series(expected, index=self.df.index, dtype=np.float64)), True)
+        assert_equals(actual['other'].equals(self.df['other']), True)
+
+    def test_overlapping_buckets_take_the_largest(self):
+        bins = IntervalBins({0: (0, 10), 3: (5, 7), 1: (6, 20)})
+        assert_equals(bins.bucket([4, 5, 6, 7, 19, 20]).tolist()[:5], [0, 3, 3, 1, 1])
+
+    def test_compiled_once_per_lookups(self):
+        assert compile_buckets(BUCKETS) is compile_buckets(BUCKETS)
+        assert compile_buckets(dict(BUCKETS)) is not compile_buckets(BUCKETS)
+
+
+class TestRecodeFeatures:
+
+    def setup(self):
+        self.df = pd.DataFrame({'cmvx': ['-/-', '+/+', np.nan, 'bad', '/'],
+                                'tbidose': [450.0, 1320.0, np.nan, 7.0, 0.0],
+                                'proplbl': ['FK506,MMF,CSP', 'MTX', 'FK506,BAD', 'BAD,OTHER', np.nan],
+                                'hla_cco': ['RD/CORD', 'ISO/MATCHED', 'URD/MATCHED', np.nan, 'UNKNOWN']})
+
+    def test_recode_features_matches_get_values(self):
+        expected = {col: [get_values(v, GATEWAY_FEATURE_RECODE_MAP[col]) for v in self.df[col]] for col in self.df}
+        actual = recode_features(self.df.copy(), GATEWAY_FEATURE_RECODE_MAP)
+        for col in self.df:
+            assert_equals(actual[col].tolist(), expected[col])
+        assert_equals(actual['tbidose'].tolist(), ['le450', 'ge1200', None, None, 'le450'])
+        assert_equals(sorted(actual['proplbl'][0].split(',')), ['CNI', 'MMF'])
+        assert_equals(actual['proplbl'].tolist()[1:], ['MTX', 'CNI', '', None])
+
+    def test_recoded_values_are_remembered(self):
+        recoder = compile_recoders(GATEWAY_FEATURE_RECODE_MAP)['hla_cco']
+        recode_features(self.df.copy(), GATEWAY_FEATURE_RECODE_MAP)
+        assert_equals(recoder._strings['RD/CORD'], 'CORD')
+        assert compile_recoders(GATEWAY_FEATURE_RECODE_MAP)['hla_cco'] is recoder
+
+    def test_integer_columns_are_not_recoded(self):
+        df = pd.DataFrame({'tbidose': [450, 1320]})
+        actual = recode_features(df, {'tbidose': GATEWAY_FEATURE_RECODE_MAP['tbidose']})
+        assert_equals(actual['tbidose'].tolist(), [None, None])
+
+
+class TestMultiHotEncoder:
+
+    def setup(self):
+        self.encoder = MultiHotEncoder(GATEWAY_FEATURE_RECODE_MAP['proplbl'].values())
+        self.columns = ['proplbl_CNI', 'proplbl_MMF', 'proplbl_MTX', 'proplbl_Post-Transplant_Cyclophosphamide',
+                        'proplbl_RAPA', 'proplbl_STEROIDS']
+
+    def test_columns_do_not_depend_on_the_extract(self):
+        for proplbl in [['MMF'], ['STEROIDS,CNI', None], ['RAPA', 'MTX,Post-Transplant_Cyclophosphamide', '']]:
+            actual = self.encoder.encode(pd.Series(proplbl), prefix='proplbl_')
+            assert_equals(list(actual.columns), self.columns)
+            assert_equals(list(actual.dtypes.unique()), [np.uint8])
+
+    def test_rows_hold_their_labels(self):
+        recoded = recode_features(pd.DataFrame({'proplbl': ['FK506,MMF', np.nan, 'PTCY,CSP', 'UNKNOWN']}),
+                                  {'proplbl': GATEWAY_FEATURE_RECODE_MAP['proplbl']})
+        actual = self.encoder.encode(recoded['proplbl'], prefix='proplbl_')
+        assert_equals(actual.values.tolist(), [[1, 1, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0], [1, 0, 0, 1, 0, 0],
+                                               [0, 0, 0, 0, 0, 0]])
+
+
+if __name__ == '__main__':
+    nose.run()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+from scripts.reformat_relapse_data import pull_gateway_data, read_gateway_csv
+
+
+class TestGatewayCache:
+
+    def setup(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.output_dir, 'gateway.csv')
+        rows = []
+        for pid in range(1, 9):
+            rows.append({'upn': pid * 10, 'uwid': 'U{}'.format(pid), 'tx': 1, 'txdatex': 'x',
+                         'txdate': '2019-07-{:02d}'.format(pid), 'txage': [0.5, 5, 12.5, np.nan][pid % 4],
+                         'relage': [5, 40][pid % 2], 'minitx': pid % 2, 'delatg': 0, 'delcamp': 1,
+                         'sex': ['Male', 'Female', 'NA'][pid % 3], 'donsex': ['Female', 'Male'][pid % 2],
+                         'birthdat': '1970-01-01', 'tbidose': [200, 1320, np.nan][pid % 3],
+                         'proplbl': ['FK506,MMF', 'CSP,MTX', '', 'NA'][pid % 4],
+                         'cmvx': ['-/-', '+/-', '/'][pid % 3], 'hla_cco': ['URD/MATCHED', 'RD/CORD'][pid % 2],
+                         'celltxl': ['BM', 'PBSC'][pid % 2]})
+        pd.DataFrame(rows).to_csv(self.csv_path, index=False)
+        self.config = {'GATEWAY_DATA': self.csv_path}
+
+    def teardown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_pyarrow_reads_like_the_c_reader(self):
+        expected = pd.read_csv(self.csv_path).drop(columns=['upn', 'tx', 'txdatex', 'birthdat'])
+        for engine in ['c', 'pyarrow']:
+            with mock.patch('scripts.reformat_relapse_data._csv_engine', return_value=engine):
+                actual = read_gateway_csv(self.csv_path)
+            assert_equals(list(actual.columns), list(expected.columns))
+            assert_equals(actual.isna().equals(expected.isna()), True)
+            assert_equals(actual['tbidose'].dtype, np.float64)
+
+    def test_cached_gateway_data(self):
+        expected = pull_gateway_data(self.config)
+        self.config['GATEWAY_CACHE'] = {'CACHE_DIR': os.path.join(self.output_dir, 'cache')}
+        assert_equals(pull_gateway_data(self.config).equals(expected), True)
+
+        with mock.patch('scripts.reformat_relapse_data.read_gateway_csv') as read_csv:
+            cached = pull_gateway_data(self.config)
+            # a new modification time alone does not invalidate the cache
+            os.utime(self.csv_path, ns=(0, 0))
+            touched = pull_gateway_data(self.config)
+        assert_equals(read_csv.call_count, 0)
+        assert_equals(cached.equals(expected), True)
+        assert_equals(touched.equals(expected), True)
+
+        with open(self.csv_path, 'a') as fout:
+            fout.write('90,U9,1,x,2019-07-09,70,70,0,0,0,Male,Male,1970-01-01,450,MTX,-/-,RD/CORD,BM\n')
+        assert_equals(len(pull_gateway_data(self.config)), len(expected) + 1)
+
+
+if __name__ == '__main__':
+    nose.run()
@@ -0,0 +1,45 @@
+import nose
+from nose.tools import assert_equals, assert_is
+
+from scripts.map_categorical_features import DataDictionary, FeatureRouter
+
+
+class TestFeatureRouter:
+
+    def setup(self):
+        self.datadict = DataDictionary()
+        self.datadict.code_cols = {'Chemotherapy': ('Code', 'Binary', 'Time-Varying', 'Yes'),
+                                   'rx_indication_mrd': ('Code', 'Binary', 'Time-Varying', 'Yes'),
+                                   'hla_cco': ('Code', 'Categorical', 'Static', 'No')}
+        self.datadict.code_mappings = {'Chemotherapy': 7, 'rx_indication_mrd': 8, 'hla_cco': 9}
+        self.datadict.numeric_cols = ['wbc', 'relapse_presentation', 'wbc']
+        self.datadict.drop_cols = ['subject_id']
+        self.datadict.categorical_cols = {'rx_indication': '4'}
+        self.recode_map = {'e_treatment___2': 'Chemotherapy', 'rx_indication_2': 'rx_indication_mrd'}
+
+    def test_routes(self):
+        router = self.datadict.feature_router(self.recode_map)
+        assert_equals(router.route('subject_id', 123), ((FeatureRouter.DROP, None, 'subject_id', False), 123))
+        assert_equals(router.route('e_treatment___2', 0), ((FeatureRouter.CODE, 7, 'Chemotherapy', True), 0))
+        assert_equals(router.route('hla_cco', 0), ((FeatureRouter.CODE, 9, 'hla_cco', False), 0))
+        # the first slot of a repeated numeric column, like numeric_cols.index
+        assert_equals(router.route('wbc', 2.5), ((FeatureRouter.NUMERIC, 0, 'wbc', False), 2.5))
+        assert_equals(router.route('unknown', 1), ((FeatureRouter.UNKNOWN, 'unknown', 'unknown', False), 1))
+
+    def test_categorical_levels(self):
+        router = self.datadict.feature_router(self.recode_map)
+        assert_equals(router.route('rx_indication', 2.0), ((FeatureRouter.CODE, 8, 'rx_indication_mrd', True), 1))
+        assert_equals(router.route('rx_indication', 3),
+                      ((FeatureRouter.UNKNOWN, 'rx_indication_3', 'rx_indication_3', False), 1))
+        # levels above the number of categories are not one-hot encoded
+        assert_equals(router.route('rx_indication', 9),
+                      ((FeatureRouter.UNKNOWN, 'rx_indication', 'rx_indication', False), 9))
+
+    def test_router_is_reused_until_recode_map_changes(self):
+        router = self.datadict.feature_router(self.recode_map)
+        assert_is(self.datadict.feature_router(self.recode_map), router)
+        assert_equals(self.datadict.feature_router(dict()).route('e_treatment___2', 1)[0][0], FeatureRouter.UNKNOWN)
+
+
+if __name__ == '__main__':
+    nose.run()
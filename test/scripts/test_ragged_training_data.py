@@ -0,0 +1,61 @@
+import shutil
+import tempfile
+
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+from scripts.ragged_training_data import RaggedTrainingData
+from scripts.reformat_relapse_data import get_training_data_path, read_training_data
+
+
+class TestRaggedTrainingData:
+
+    def setup(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.rows = [{'PID': 12345, 'numerics': [[None, None], [1, 3.5]], 'codes': [[7], []], 'to_event': [1, 3],
+                      'target': 1},
+                     {'PID': 12345, 'numerics': [[None, 2]], 'codes': [[7, None, 2]], 'to_event': [5], 'target': 0},
+                     {'PID': 67890, 'numerics': [], 'codes': [], 'to_event': [], 'target': 0}]
+
+    def teardown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_round_trip(self):
+        RaggedTrainingData.from_rows(self.rows).write(self.output_dir)
+        data = RaggedTrainingData.load(self.output_dir)
+
+        assert_equals(data.to_rows(), self.rows)
+        assert_equals(data.to_frame().equals(pd.DataFrame(self.rows)), True)
+
+    def test_round_trip_mixed_pids(self):
+        rows = [dict(self.rows[0], PID=12345), dict(self.rows[1], PID='U678'), dict(self.rows[2], PID='12345')]
+        RaggedTrainingData.from_rows(rows).write(self.output_dir)
+        data = RaggedTrainingData.load(self.output_dir)
+
+        assert_equals([row['PID'] for row in data.to_rows()], [12345, 'U678', '12345'])
+        assert_equals([data.row(i)['PID'] for i in range(len(data))], [12345, 'U678', '12345'])
+        assert_equals(list(data.take([2, 0])['PID']), ['12345', 12345])
+
+    def test_rows_are_views(self):
+        RaggedTrainingData.from_rows(self.rows).write(self.output_dir)
+        data = RaggedTrainingData.load(self.output_dir)
+        row = data.row(0)
+
+        assert_equals((row['PID'], row['target'], row['to_event'].tolist()), (12345, 1, [1, 3]))
+        assert_equals([codes.tolist() for codes in data.row(1)['codes']], [[7, RaggedTrainingData.MISSING_CODE, 2]])
+        assert_equals(np.shares_memory(row['numerics'], data.numerics), True)
+        assert_equals(np.shares_memory(row['codes'][0], data.codes), True)
+        assert_equals(data.row(2)['numerics'].shape, (0, 2))
+
+    def test_read_training_data(self):
+        config = {'OUTPUT_FILEPATH': self.output_dir, 'TRAINING_DATAFRAME_NAME': 'training_df',
+                  'TRAINING_DATA_FORMAT': 'ragged'}
+        RaggedTrainingData.from_rows(self.rows).write(get_training_data_path(config))
+
+        assert_equals(read_training_data(config).to_dict('records'), self.rows)
+
+
+if __name__ == '__main__':
+    nose.run()
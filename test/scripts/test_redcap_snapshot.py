@@ -0,0 +1,188 @@
+import datetime as dt
+import os
+import pickle
+import shutil
+import tempfile
+
+import nose
+import pandas as pd
+from unittest import mock
+from nose.tools import assert_equals, assert_raises
+
+from scripts.redcap_snapshot import RedcapSnapshot
+from scripts.reformat_relapse_data import export_red_cap_forms, export_red_cap_delta, pull_incremental_from_red_cap, \
+    evaluate_timelines_for_trainingrows, build_patient_eventdays, evaluate_patient_timelines, read_timeline_cache, \
+    write_timeline_cache
+
+
+class TestRedcapSnapshot:
+
+    def setup(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.config = {'REDCAP_SNAPSHOT': {'SNAPSHOT_DIR': self.snapshot_dir}}
+        self.metadata_hash = RedcapSnapshot.metadata_hash([{'field_name': 'record_id', 'form_name': 'patient_id'}])
+        self.patient_df = pd.DataFrame({'uwid': ['123', '456'], 'hct1_date_manual': ['2019-07-11', '2019-07-12']},
+                                       index=pd.Index([123, 456], name='record_id'))
+        self.vitals_df = pd.DataFrame({'redcap_repeat_instrument': [None, 'vital_status'],
+                                       'e_status': [float('nan'), 1.0]},
+                                      index=pd.Index([123, 123], name='record_id'))
+
+    def teardown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_metadata_hash_is_order_independent(self):
+        first = RedcapSnapshot.metadata_hash([{'field_name': 'a', 'form_name': 'b'}])
+        second = RedcapSnapshot.metadata_hash([{'form_name': 'b', 'field_name': 'a'}])
+        assert_equals(first, second)
+
+    def test_replay_round_trip(self):
+        snapshot = RedcapSnapshot(self.snapshot_dir)
+        snapshot.write_form(self.metadata_hash, 'patient_id', self.patient_df)
+        snapshot.write_form(self.metadata_hash, 'vital_status', self.vitals_df)
+        snapshot.set_last_pull(self.metadata_hash, dt.datetime(2019, 7, 11))
+
+        replayed = list(export_red_cap_forms(self.config, replay=True))
+
+        assert_equals([form for form, _ in replayed], ['patient_id', 'vital_status'])
+        pd.testing.assert_frame_equal(replayed[0][1], self.patient_df)
+        pd.testing.assert_frame_equal(replayed[1][1], self.vitals_df)
+
+    def test_replay_without_snapshot(self):
+        with assert_raises(ValueError):
+            list(export_red_cap_forms(self.config, replay=True))
+
+    def test_replay_refuses_incomplete_pull(self):
+        snapshot = RedcapSnapshot(self.snapshot_dir)
+        snapshot.write_form(self.metadata_hash, 'patient_id', self.patient_df)
+
+        assert_equals(snapshot.latest_hash(), None)
+        with assert_raises(ValueError):
+            list(export_red_cap_forms(self.config, replay=True))
+
+        # a snapshot named in the config is replayed anyway
+        self.config['REDCAP_SNAPSHOT']['METADATA_HASH'] = self.metadata_hash
+        assert_equals([form for form, _ in export_red_cap_forms(self.config, replay=True)], ['patient_id'])
+
+
+class FakeDeltaProject:
+    def __init__(self, metadata, modified, form_dfs):
+        self.metadata = metadata
+        self.def_field = 'record_id'
+        self.modified = modified
+        self.form_dfs = form_dfs
+        self.exports = []
+
+    def export_records(self, format, fields=None, forms=None, records=None, date_begin=None):
+        self.exports.append({'fields': fields, 'forms': forms, 'records': records, 'date_begin': date_begin})
+        if date_begin is not None:
+            return pd.DataFrame(index=pd.Index(self.modified, name='record_id'))
+        df = self.form_dfs[forms[0]]
+        return df.loc[df.index.astype(str).isin(records)]
+
+
+class TestRedcapDelta:
+
+    def setup(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.config = {'RED_CAP_ENGINE': {'URL': 'url', 'API': 'key'},
+                       'REDCAP_SNAPSHOT': {'SNAPSHOT_DIR': self.snapshot_dir}}
+        self.metadata = [{'field_name': 'record_id', 'form_name': 'vital_status'}]
+        self.metadata_hash = RedcapSnapshot.metadata_hash(self.metadata)
+        self.last_pull = dt.datetime(2019, 7, 11)
+        self.snapshot = RedcapSnapshot(self.snapshot_dir)
+        self.snapshot.write_form(self.metadata_hash, 'vital_status',
+                                 pd.DataFrame({'e_status': [2.0, 2.0]}, index=pd.Index([1, 2], name='record_id')))
+        self.snapshot.set_last_pull(self.metadata_hash, self.last_pull)
+
+    def teardown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_delta_replaces_modified_records(self):
+        updated = pd.DataFrame({'e_status': [1.0]}, index=pd.Index([2], name='record_id'))
+        project = FakeDeltaProject(self.metadata, [2], {'vital_status': updated})
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=project):
+            forms, dirty = export_red_cap_delta(self.config)
+
+        assert_equals(dirty, {'2'})
+        assert_equals(project.exports[0]['date_begin'], self.last_pull)
+        assert_equals(project.exports[1]['records'], ['2'])
+        form, form_df = forms[0]
+        assert_equals(form, 'vital_status')
+        assert_equals(form_df['e_status'].to_dict(), {1: 2.0, 2: 1.0})
+        assert_equals(self.snapshot.read_form(self.metadata_hash, 'vital_status')['e_status'].to_dict(), {1: 2.0, 2: 1.0})
+        assert self.snapshot.last_pull(self.metadata_hash) > self.last_pull
+
+    def test_delta_requires_matching_metadata(self):
+        project = FakeDeltaProject([{'field_name': 'other', 'form_name': 'gvhd'}], [], {})
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=project):
+            assert_equals(export_red_cap_delta(self.config), (None, None))
+
+
+class TestIncrementalPull:
+
+    def setup(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.config = {'RED_CAP_ENGINE': {'URL': 'url', 'API': 'key'},
+                       'REDCAP_SNAPSHOT': {'SNAPSHOT_DIR': os.path.join(self.output_dir, 'snapshot')},
+                       'INCREMENTAL_CACHE': {'TIMELINES': os.path.join(self.output_dir, 'timelines.pkl'),
+                                             'TRAINING_ROWS': os.path.join(self.output_dir, 'training_rows.pkl')},
+                       'DECISION_PARAMETERS': {'MRD_WINDOW': 365, 'CONSOLIDATION_WINDOW': 365, 'INDUCTION_WINDOW': 90,
+                                               'DECISION_POINT_EVAL_WINDOW': 7,
+                                               'DECISION_POINT_REASONS': ['Death', 'Morph', 'MRD']},
+                       'DATA_DICTIONARY': {}, 'OUTPUT_FILEPATH': self.output_dir,
+                       'TRAINING_DATAFRAME_NAME': 'training_df'}
+        self.metadata = [{'field_name': 'record_id', 'form_name': 'patient_id'}]
+        metadata_hash = RedcapSnapshot.metadata_hash(self.metadata)
+        snapshot = RedcapSnapshot(self.config['REDCAP_SNAPSHOT']['SNAPSHOT_DIR'])
+        snapshot.write_form(metadata_hash, 'patient_id', self._patient_df(['2019-07-11', '2019-07-12']))
+        snapshot.set_last_pull(metadata_hash, dt.datetime(2019, 7, 11))
+
+        # the cache of the previous run, patient 1's timeline and rows differ from what REDCap would give
+        cached_patient_eds = build_patient_eventdays([('patient_id', self._patient_df(['2000-01-01', '2019-07-12']))])
+        write_timeline_cache(evaluate_patient_timelines(cached_patient_eds, self.config), self.config)
+        with open(self.config['INCREMENTAL_CACHE']['TRAINING_ROWS'], 'wb') as fout:
+            pickle.dump({'1': [self._row('1', 'cached')], '2': [self._row('2', 'cached')]}, fout)
+
+    def teardown(self):
+        shutil.rmtree(self.output_dir)
+
+    @staticmethod
+    def _patient_df(hct1_dates):
+        return pd.DataFrame({'uwid': ['1', '2'], 'hct1_date_manual': hct1_dates,
+                             'relapse_date_manual': ['2020-01-01', '2020-02-01']},
+                            index=pd.Index(['1', '2'], name='record_id'))
+
+    @staticmethod
+    def _row(pid, source):
+        return {'PID': pid, 'numerics': [], 'codes': [], 'to_event': [], 'target': 0, 'source': source}
+
+    def test_incremental_pull_recomputes_dirty_patients_only(self):
+        # patient 2's transplant date was changed in REDCap since the last pull
+        project = FakeDeltaProject(self.metadata, ['2'], {'patient_id': self._patient_df(['2019-07-11', '2019-08-01'])})
+        translated = []
+
+        def translate(patient):
+            translated.append(patient[0])
+            return patient[0], [self._row(patient[0], 'translated')], None
+
+        # the patients have no decision points to summarise
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=project), \
+                mock.patch('scripts.reformat_relapse_data.log_decision_point_summary'), \
+                mock.patch('scripts.reformat_relapse_data._init_training_row_worker'), \
+                mock.patch('scripts.reformat_relapse_data._translate_patient_timeline', translate):
+            timelines, dirty = pull_incremental_from_red_cap(self.config)
+            training_df = evaluate_timelines_for_trainingrows(timelines, self.config, dirty_patients=dirty)
+
+        assert_equals(dirty, {'2'})
+        dates = {pid: [ed.date for ed in t.get_sorted_events()] for pid, t in timelines.items()}
+        assert_equals(dates, {'1': [dt.datetime(2000, 1, 1)], '2': [dt.datetime(2019, 8, 1)]})
+        assert_equals(read_timeline_cache(self.config)['2'].get_sorted_events()[0].date, dt.datetime(2019, 8, 1))
+
+        assert_equals(translated, ['2'])
+        assert_equals(training_df[['PID', 'source']].values.tolist(), [['1', 'cached'], ['2', 'translated']])
+        with open(self.config['INCREMENTAL_CACHE']['TRAINING_ROWS'], 'rb') as fin:
+            assert_equals(pickle.load(fin), {'1': [self._row('1', 'cached')], '2': [self._row('2', 'translated')]})
+
+
+if __name__ == '__main__':
+    nose.run()
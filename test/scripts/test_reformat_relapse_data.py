@@ -1,7 +1,23 @@
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
 import nose
 import pandas as pd
+from unittest import mock
+from nose.tools import assert_equals, assert_raises
+from redcap import RedcapError
 
-from scripts.reformat_relapse_data import limit_to_match_controls
+from classes.collection.eventday import EventDay
+from classes.event.relapseencounter import RelapseEncounter
+from classes.event.treatmentencounter import TreatmentEncounter
+from scripts.reformat_relapse_data import limit_to_match_controls, export_form_with_retry, export_red_cap_forms, \
+    evaluate_patient_timelines, build_patient_eventdays, get_export_fields, get_gateway_columns, _map_patients, GATEWAY_FORM
+from scripts.map_categorical_features import DataDictionary
+from scripts.redcap_snapshot import RedcapSnapshot
+from scripts.control_matching import covariate_frame
 
 
 class TestMatching:
@@ -53,5 +69,209 @@ class TestMatching:
         expected.sort_index(inplace=True)
         assert (actual.values == expected.values).all()
 
+    def test_limit_to_match_controls_orders_pairs_and_skips_unmatched(self):
+        df = pd.DataFrame({'to_event': [[1, 2, 3], [1], [1, 2, 3, 4], [1, 2, 3, 4, 5], [1, 2]],
+                           'target': [1, 0, 0, 0, 1]}, index=['A', 'B', 'C', 'D', 'E'])
+        actual = limit_to_match_controls(df, seed=self.seed, match_num=1)
+
+        # B is matched with the closest longer positive, the remaining positive A is shorter than C,
+        # and no positives are left for D
+        assert_equals(list(actual.index), ['E', 'B'])
+        assert_equals(list(actual.dtypes), list(df.dtypes))
+
+    def test_limit_to_match_controls_nearest_neighbours(self):
+        df = pd.DataFrame({'to_event': [[1, 30], [1, 2, 3], [1, 2, 29], [1, 2], [1, 2, 3, 4, 60], [1, 2, 3, 4, 58]],
+                           'target': [0, 1, 1, 0, 1, 0]}, index=['A', 'B', 'C', 'D', 'E', 'F'])
+        covariates = covariate_frame(df, ['length', 'days_since_hct'])
+        actual = limit_to_match_controls(df, seed=self.seed, match_num=1, covariates=covariates)
+
+        # every negative row follows its nearest positive row, though A and C differ in length and D and B do not
+        pairs = [list(actual.index[i:i + 2]) for i in range(0, len(actual), 2)]
+        assert_equals(sorted(pairs), [['B', 'D'], ['C', 'A'], ['E', 'F']])
+
+        # no positive row is within the caliper
+        actual = limit_to_match_controls(df, seed=self.seed, match_num=1, covariates=covariates, caliper=0.01)
+        assert_equals(len(actual), 0)
+        assert_equals(list(actual.dtypes), list(df.dtypes))
+
+
+class FakeProject:
+    def __init__(self, forms, failures=None, delays=None):
+        self.forms = forms
+        self.metadata = [{'field_name': 'record_id', 'form_name': f} for f in forms]
+        self.def_field = 'record_id'
+        self.failures = dict(failures or {})
+        self.delays = delays or {}
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def export_records(self, format, forms=None, fields=None):
+        form = forms[0] if forms else fields[-1]
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delays.get(form, 0.01))
+            with self.lock:
+                if self.failures.get(form, 0) > 0:
+                    self.failures[form] -= 1
+                    raise RedcapError("export failed for {}".format(form))
+            return pd.DataFrame({'form': [form]})
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestRedcapExport:
+
+    def setup(self):
+        self.config = {'RED_CAP_ENGINE': {'URL': 'url', 'API': 'key'},
+                       'REDCAP_EXPORT': {'WORKERS': 4, 'MAX_IN_FLIGHT': 2, 'RETRIES': 1, 'BACKOFF_SECONDS': 0}}
+
+    def test_export_form_with_retry_recovers(self):
+        project = FakeProject(['gvhd'], failures={'gvhd': 1})
+        df = export_form_with_retry(project, 'gvhd', retries=1, backoff=0)
+        assert_equals(list(df['form']), ['gvhd'])
+
+    def test_export_form_with_retry_gives_up(self):
+        project = FakeProject(['gvhd'], failures={'gvhd': 2})
+        with assert_raises(RedcapError):
+            export_form_with_retry(project, 'gvhd', retries=1, backoff=0)
+
+    def test_export_red_cap_forms_keeps_form_order_and_cap(self):
+        forms = ['vital_status', 'gvhd', 'graft_rejection', 'treatment_event', 'immunosuppression_kinetics']
+        project = FakeProject(forms, failures={'gvhd': 2}, delays={'vital_status': 0.05})
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=project):
+            exported = [form for form, _ in export_red_cap_forms(self.config)]
+
+        assert_equals(exported, ['vital_status', 'graft_rejection', 'treatment_event', 'immunosuppression_kinetics'])
+        assert project.max_active <= 2
+
+    def test_export_red_cap_forms_failure_leaves_snapshot_incomplete(self):
+        forms = ['vital_status', 'gvhd']
+        self.config['REDCAP_SNAPSHOT'] = {'SNAPSHOT_DIR': tempfile.mkdtemp()}
+        snapshot = RedcapSnapshot(self.config['REDCAP_SNAPSHOT']['SNAPSHOT_DIR'])
+        metadata_hash = RedcapSnapshot.metadata_hash(FakeProject(forms).metadata)
+
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=FakeProject(forms, failures={'gvhd': 2})):
+            list(export_red_cap_forms(self.config))
+        assert_equals(snapshot.forms(metadata_hash), ['vital_status'])
+        assert_equals(snapshot.last_pull(metadata_hash), None)
+        assert_equals(snapshot.latest_hash(), None)
+
+        with mock.patch('scripts.reformat_relapse_data.Project', return_value=FakeProject(forms)):
+            list(export_red_cap_forms(self.config))
+        assert snapshot.last_pull(metadata_hash) is not None
+        assert_equals(snapshot.latest_hash(), metadata_hash)
+        shutil.rmtree(self.config['REDCAP_SNAPSHOT']['SNAPSHOT_DIR'])
+
+    def test_export_form_with_retry_exports_fields(self):
+        project = FakeProject(['gvhd'])
+        df = export_form_with_retry(project, 'gvhd', fields=['record_id', 'date_gvhd'])
+        assert_equals(list(df['form']), ['date_gvhd'])
+
+
+class TestFieldPushdown:
+
+    def setup(self):
+        self.data_dict = DataDictionary()
+        self.data_dict.code_cols = {'Chemotherapy': ('Code', 'Binary', 'Time-Varying', 'Yes'),
+                                    'cmvx_neg_neg': ('Code', 'Binary', 'Static', 'Yes'),
+                                    'female_donor_male_recipient': ('Code', 'Binary', 'Static', 'Yes')}
+        self.data_dict.code_mappings = {'Chemotherapy': 1, 'cmvx_neg_neg': 2, 'female_donor_male_recipient': 3}
+        self.data_dict.numeric_cols = ['wbc']
+
+    def test_get_export_fields(self):
+        project = FakeProject(['gvhd', 'treatment_event', 'labs'])
+        project.metadata += [{'field_name': 'date_gvhd', 'form_name': 'gvhd'},
+                             {'field_name': 'gvhd_notes', 'form_name': 'gvhd'},
+                             {'field_name': 'e_chemo', 'form_name': 'treatment_event'},
+                             {'field_name': 'wbc', 'form_name': 'labs'},
+                             {'field_name': 'lab_notes', 'form_name': 'labs'}]
+        # the checkbox field e_chemo is needed for its e_treatment___2 (Chemotherapy) column
+        project.export_field_names = lambda: [{'original_field_name': 'e_chemo', 'export_field_name': 'e_treatment___2'},
+                                              {'original_field_name': 'e_chemo', 'export_field_name': 'e_treatment___99'}]
+        with mock.patch('scripts.reformat_relapse_data.FEATURE_RECODE_MAP', {'e_treatment___2': 'Chemotherapy'}):
+            form_fields = get_export_fields(project, self.data_dict)
+
+        assert_equals(form_fields, {'gvhd': ['record_id', 'date_gvhd'],
+                                    'treatment_event': ['record_id', 'e_chemo'],
+                                    'labs': ['record_id', 'wbc']})
+
+    def test_get_gateway_columns(self):
+        # txage and relage are bucketed, cmvx is one-hot encoded and sex and donsex are the
+        # female_donor_male_recipient feature, tbidose, hla_cco, celltxl and proplbl are no features here
+        assert_equals(get_gateway_columns(self.data_dict),
+                      ['uwid', 'txdate', 'txage', 'relage', 'sex', 'donsex', 'cmvx'])
+
+
+class TestBuildPatientEventdays:
+
+    def setup(self):
+        self.patient_df = pd.DataFrame({'uwid': ['1', '2'], 'hct1_date_manual': ['2019-07-11', '2019-08-01'],
+                                        'relapse_date_manual': ['2020-01-01', '2020-02-01']},
+                                       index=pd.Index([1, 2], name='record_id'))
+        self.gateway_df = pd.DataFrame({'uwid': ['3', '1', '2', '4'],
+                                        'txdate': ['2019-05-01', '2019-07-11', '2019-08-01', '2019-06-01'],
+                                        'txage': [1.0, 2.0, 3.0, 4.0]})
+
+    def test_gateway_restricted_to_redcap_patients(self):
+        patient_eds = build_patient_eventdays([('patient_id', self.patient_df), (GATEWAY_FORM, self.gateway_df)])
+
+        assert_equals(sorted(patient_eds.keys()), ['1', '2'])
+        assert_equals([type(e).__name__ for ed in patient_eds['1'].values() for e in ed.events],
+                      ['DemographicsEncounter', 'gatewayEncounter'])
+
+
+class TestParallelEvaluation:
+
+    def setup(self):
+        self.config = {'DECISION_PARAMETERS': {'MRD_WINDOW': 365, 'CONSOLIDATION_WINDOW': 365, 'INDUCTION_WINDOW': 90,
+                                               'DECISION_POINT_EVAL_WINDOW': 7,
+                                               'DECISION_POINT_REASONS': ['Death', 'Morph', 'MRD']}}
+        start = datetime(2019, 7, 11)
+
+        def patient_eds(pid, relapse_offset):
+            treatment = TreatmentEncounter(pid, start, start, 1, 1, induction_chemo=1,
+                                           rx_indication=TreatmentEncounter.INDICATION_INDUCTION)
+            relapse_date = start + timedelta(days=relapse_offset)
+            relapse = RelapseEncounter(pid, relapse_date, 1 + relapse_offset, 1, relapse_or_response=1,
+                                       relapse_presentation=1)
+            return {start: EventDay(pid, start, treatment), relapse_date: EventDay(pid, relapse_date, relapse)}
+
+        # patients are added out of id order, with relapses inside and outside the induction window
+        self.patient_eds = {pid: patient_eds(pid, offset) for pid, offset in [(5, 10), (2, 200), (9, 30), (1, 91)]}
+
+    def _summary(self, timelines):
+        return [(pid, [(dp.eval_date, dp.label, dp.label_cause, dp.target_date) for dp in t.decision_points])
+                for pid, t in timelines.items()]
+
+    def test_parallel_matches_serial(self):
+        serial = evaluate_patient_timelines(self.patient_eds, self.config)
+        self.config['PARALLEL_EVALUATION'] = {'WORKERS': 2, 'CHUNKSIZE': 1}
+        parallel = evaluate_patient_timelines(self.patient_eds, self.config)
+
+        assert_equals(list(parallel.keys()), [5, 2, 9, 1])
+        assert_equals(self._summary(parallel), self._summary(serial))
+        assert_equals([dp.label_cause for t in serial.values() for dp in t.decision_points],
+                      ['Morph', None, 'Morph', None])
+
+    def test_parallel_submits_a_window_of_chunks(self):
+        self.config['PARALLEL_EVALUATION'] = {'WORKERS': 2, 'CHUNKSIZE': 3}
+        consumed = []
+
+        def items():
+            for i in range(50):
+                consumed.append(i)
+                yield -i
+
+        results = _map_patients(abs, items(), self.config, int, ())
+        assert_equals(next(results), 0)
+        # two chunks of three items per worker are submitted ahead
+        assert_equals(len(consumed), 12)
+        assert_equals(list(results), list(range(1, 50)))
+
+
 if __name__ == '__main__':
     nose.run()
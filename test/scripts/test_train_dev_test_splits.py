@@ -0,0 +1,91 @@
+import glob
+import os
+import shutil
+import tempfile
+
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+from scripts.ragged_training_data import RaggedTrainingData
+import scripts.reformat_relapse_data as rrd
+from scripts.reformat_relapse_data import get_training_data_path, get_training_shard_dir
+from scripts.training_row_shards import TrainingRowShardWriter
+
+
+class TestTrainDevTestSplits:
+
+    def setup(self):
+        self.output_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(5)
+        self.rows = []
+        for pid in range(40):
+            for k in range(rng.randint(1, 4)):
+                n_visits = rng.randint(1, 6)
+                self.rows.append({'PID': pid, 'numerics': [[None, float(v)] for v in range(n_visits)],
+                                  'codes': [[int(c)] for c in rng.randint(0, 9, n_visits)],
+                                  'to_event': list(range(n_visits)), 'target': int(rng.rand() < 0.5)})
+
+    def teardown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _config(self, **kwargs):
+        config = {'OUTPUT_FILEPATH': tempfile.mkdtemp(dir=self.output_dir), 'TRAINING_DATAFRAME_NAME': 'training_df',
+                  'SEED': 12345, 'MATCH_NUM': 1}
+        config.update(kwargs)
+        return config
+
+    def _write_splits(self, config):
+        # the holdout patients are drawn from numpy's global random state
+        np.random.seed(0)
+        rrd.write_train_dev_test(config)
+
+    def _pickled_splits(self):
+        config = self._config()
+        pd.DataFrame(self.rows).to_pickle(get_training_data_path(config))
+        self._write_splits(config)
+        return {os.path.basename(p)[:-len('.pkl')]: pd.read_pickle(p)
+                for p in glob.glob(os.path.join(config['OUTPUT_FILEPATH'], '*.pkl'))}
+
+    def _assert_views_match(self, expected, splits):
+        # the holdout and train/dev pickles swap their data and target file names
+        assert_equals(splits.holdout.data().equals(expected['data_holdout']), True)
+        assert_equals(splits.holdout.target().equals(expected['target_holdout']), True)
+        assert_equals(splits.train_dev.to_frame().equals(expected['train_dev_df']), True)
+        assert_equals(splits.train_dev.target().equals(expected['data_train_dev']), True)
+        assert_equals(len(splits.folds), 5)
+        for i, fold in enumerate(splits.folds):
+            for part in ['train', 'test']:
+                assert_equals(fold[part].data().equals(expected['data_{}_{}'.format(part, i)]), True)
+                assert_equals(fold[part].target().equals(expected['target_{}_{}'.format(part, i)]), True)
+                assert_equals(list(fold[part].data().index), list(expected['data_{}_{}'.format(part, i)].index))
+
+    def test_manifest_matches_pickled_splits(self):
+        expected = self._pickled_splits()
+
+        config = self._config(SPLIT_FORMAT='manifest')
+        pd.DataFrame(self.rows).to_pickle(get_training_data_path(config))
+        self._write_splits(config)
+
+        assert_equals(glob.glob(os.path.join(config['OUTPUT_FILEPATH'], '*.pkl')), [get_training_data_path(config)])
+        self._assert_views_match(expected, rrd.load_train_dev_test_splits(config))
+
+    def test_manifest_over_ragged_data_and_shards(self):
+        expected = self._pickled_splits()
+
+        config = self._config(SPLIT_FORMAT='manifest', TRAINING_DATA_FORMAT='ragged')
+        RaggedTrainingData.from_rows(self.rows).write(get_training_data_path(config))
+        np.random.seed(0)
+        rrd.write_train_dev_test(config, training_df=pd.DataFrame(self.rows))
+        self._assert_views_match(expected, rrd.load_train_dev_test_splits(config))
+
+        config = self._config(SPLIT_FORMAT='manifest', TRAINING_ROW_SHARDS={'STREAMING': True})
+        with TrainingRowShardWriter(get_training_shard_dir(config), max_visits=25) as writer:
+            writer.add_rows(self.rows)
+        self._write_splits(config)
+        self._assert_views_match(expected, rrd.load_train_dev_test_splits(config))
+
+
+if __name__ == '__main__':
+    nose.run()
@@ -0,0 +1,110 @@
+import glob
+import os
+import shutil
+import tempfile
+
+import nose
+import numpy as np
+import pandas as pd
+from nose.tools import assert_equals
+
+import scripts.reformat_relapse_data as rrd
+from scripts.reformat_relapse_data import get_training_shard_dir
+from scripts.training_row_shards import TrainingRowShardWriter, TrainingRowShards
+
+
+class TestTrainingRowShards:
+
+    def setup(self):
+        self.output_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(3)
+        self.rows = []
+        for pid in range(40):
+            for k in range(rng.randint(1, 4)):
+                n_visits = rng.randint(1, 6)
+                self.rows.append({'PID': pid, 'numerics': [[None, float(v)] for v in range(n_visits)],
+                                  'codes': [[int(c)] for c in rng.randint(0, 9, n_visits)],
+                                  'to_event': list(range(n_visits)), 'target': int(rng.rand() < 0.5)})
+
+    def teardown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write_shards(self, shard_dir, max_visits):
+        with TrainingRowShardWriter(shard_dir, max_visits=max_visits) as writer:
+            for row in self.rows:
+                writer.add_rows([row])
+        return TrainingRowShards(shard_dir)
+
+    def test_shards_are_size_bounded(self):
+        shards = self._write_shards(self.output_dir, max_visits=10)
+        assert_equals(len(shards), len(self.rows))
+        for shard_df in shards.iter_shards():
+            # a shard is written as soon as it holds max_visits visits
+            assert_equals(shard_df['to_event'].str.len().iloc[:-1].sum() < 10, True)
+        assert_equals(pd.concat(shards.iter_shards()).equals(pd.DataFrame(self.rows)), True)
+        assert_equals(shards.read_index().equals(pd.DataFrame(self.rows)[['PID', 'to_event', 'target']]), True)
+        # every shard has its own row index, there is no index of the whole cohort
+        assert_equals(len(glob.glob(os.path.join(self.output_dir, 'index_*.pkl'))), len(shards.manifest['shards']))
+
+    def test_take(self):
+        shards = self._write_shards(self.output_dir, max_visits=10)
+        row_numbers = [len(self.rows) - 1, 0, 17, 3]
+        assert_equals(shards.take(row_numbers).equals(pd.DataFrame(self.rows).loc[row_numbers]), True)
+        assert_equals(len(shards.take([])), 0)
+
+    def test_no_shards(self):
+        with TrainingRowShardWriter(self.output_dir) as writer:
+            writer.add_rows([])
+        shards = TrainingRowShards(self.output_dir)
+
+        assert_equals((len(shards), shards.manifest['shards']), (0, []))
+        assert_equals(list(shards.take([]).columns), TrainingRowShardWriter.INDEX_COLUMNS)
+        assert_equals(len(shards.take([])), 0)
+        assert_equals(list(shards.read_index().columns), TrainingRowShardWriter.INDEX_COLUMNS)
+
+    def _assert_shards_match_dataframe(self, **kwargs):
+        outputs = dict()
+        for streaming in [False, True]:
+            config = {'OUTPUT_FILEPATH': tempfile.mkdtemp(dir=self.output_dir), 'TRAINING_DATAFRAME_NAME': 'training_df',
+                      'TRAINING_ROW_SHARDS': {'STREAMING': streaming}, 'SPLIT_FORMAT': 'pickle', 'SEED': 12345,
+                      'MATCH_NUM': 1}
+            config.update(kwargs)
+            if streaming:
+                self._write_shards(get_training_shard_dir(config), max_visits=25)
+            else:
+                pd.DataFrame(self.rows).to_pickle(os.path.join(config['OUTPUT_FILEPATH'], 'training_df.pkl'))
+            # the holdout patients are drawn from numpy's global random state
+            np.random.seed(0)
+            rrd.write_train_dev_test(config)
+            outputs[streaming] = {os.path.basename(p): pd.read_pickle(p)
+                                  for p in glob.glob(os.path.join(config['OUTPUT_FILEPATH'], '*.pkl'))
+                                  if not os.path.basename(p).startswith('training_df')}
+
+        assert_equals(sorted(outputs[False]), sorted(outputs[True]))
+        for name, expected in outputs[False].items():
+            assert_equals(expected.equals(outputs[True][name]), True)
+            assert_equals(list(expected.index), list(outputs[True][name].index))
+        return outputs[False]
+
+    def test_write_train_dev_test_from_shards(self):
+        self._assert_shards_match_dataframe()
+
+    def test_streaming_defaults_to_manifest_splits(self):
+        config = {'OUTPUT_FILEPATH': self.output_dir, 'TRAINING_DATAFRAME_NAME': 'training_df',
+                  'TRAINING_ROW_SHARDS': {'STREAMING': True}, 'SEED': 12345, 'MATCH_NUM': 1}
+        self._write_shards(get_training_shard_dir(config), max_visits=25)
+        rrd.write_train_dev_test(config)
+
+        splits = rrd.load_train_dev_test_splits(config)
+        assert_equals(len(splits.folds), 5)
+        assert_equals(glob.glob(os.path.join(self.output_dir, '*.pkl')), [])
+
+    def test_write_train_dev_test_from_shards_nearest_neighbour_matching(self):
+        matching = {'METHOD': 'nearest_neighbour', 'COVARIATES': ['length', 'days_since_hct'], 'CALIPER': None}
+        outputs = self._assert_shards_match_dataframe(CONTROL_MATCHING=matching)
+        target = outputs['train_dev_df.pkl']['target'].tolist()
+        assert_equals(target[1::2], [0] * (len(target) // 2))
+
+
+if __name__ == '__main__':
+    nose.run()